@@ -1,8 +1,13 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
+from django.shortcuts import render
 
+from .middleware import RECENT_REQUESTS_SIZE
+from .middleware import slowest_recent_requests
 from .models import CommentReaction
 from .models import Hint
+from .models import OutboundEmail
+from .models import PendingNotification
 from .models import Puzzle
 from .models import PuzzleAnswer
 from .models import PuzzleComment
@@ -11,11 +16,14 @@ from .models import PuzzleTag
 from .models import PuzzleVisited
 from .models import Round
 from .models import SiteSetting
+from .models import StatusChange
 from .models import StatusSubscription
 from .models import TestsolveGuess
 from .models import TestsolveParticipation
 from .models import TestsolveSession
+from .models import UnreadPuzzle
 from .models import User
+from .rendering import render_cache
 
 admin.site.register(User, UserAdmin)
 admin.site.register(Round)
@@ -24,7 +32,9 @@ admin.site.register(Puzzle)
 admin.site.register(PuzzleTag)
 admin.site.register(PuzzlePostprod)
 admin.site.register(PuzzleVisited)
+admin.site.register(UnreadPuzzle)
 admin.site.register(StatusSubscription)
+admin.site.register(StatusChange)
 admin.site.register(TestsolveSession)
 admin.site.register(PuzzleComment)
 admin.site.register(TestsolveParticipation)
@@ -32,3 +42,22 @@ admin.site.register(TestsolveGuess)
 admin.site.register(Hint)
 admin.site.register(CommentReaction)
 admin.site.register(SiteSetting)
+admin.site.register(OutboundEmail)
+admin.site.register(PendingNotification)
+
+
+def slow_requests(request):
+    """List the slowest requests RequestTimingMiddleware has seen recently (in
+    this process). Wrapped in admin.site.admin_view in puzzlord/urls.py."""
+
+    return render(
+        request,
+        "admin/slow_requests.html",
+        {
+            **admin.site.each_context(request),
+            "title": "Slow requests",
+            "requests": slowest_recent_requests(),
+            "buffer_size": RECENT_REQUESTS_SIZE,
+            "markdown_cache": render_cache,
+        },
+    )
@@ -0,0 +1,161 @@
+"""Draws chart PNGs in a small pool of worker processes.
+
+matplotlib is slow to import, holds on to a lot of memory and can take a
+second or more to draw a chart, none of which we want in the processes
+serving requests. This module doesn't import Django, so the workers only
+load it and matplotlib; they're sent plain lists and send back PNG bytes."""
+import atexit
+import concurrent.futures
+import logging
+import multiprocessing
+import threading
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from datetime import timezone
+from io import BytesIO
+
+# per web process; charts are cached, so one is plenty
+MAX_WORKERS = 1
+# renders queued or running at once, beyond which render() refuses more
+MAX_PENDING = 4
+# how long callers should wait for a render, in seconds
+RENDER_TIMEOUT = 10
+
+logger = logging.getLogger("puzzles.charts")
+
+_lock = threading.Lock()
+_pool = None
+_in_flight = {}
+
+
+class RendererBusy(Exception):
+    """The chart couldn't be drawn in time, or failed to draw, or too many
+    are already being drawn. It's worth trying again in a few seconds."""
+
+
+def _warm_up():
+    """Run in each worker as it starts, so the first chart it draws doesn't
+    pay for importing matplotlib and loading its fonts."""
+
+    import matplotlib
+
+    matplotlib.use("Agg")
+    from matplotlib.figure import Figure
+
+    fig = Figure()
+    fig.add_subplot(1, 1, 1).plot([0, 1], [0, 1], label="warm up")
+    fig.legend()
+    fig.savefig(BytesIO(), format="png")
+
+
+def draw_stacked_chart(times, columns, labels, colors, xlim=None, target=None):
+    """Draw columns of counts stacked on top of each other over `times` (in
+    seconds since the epoch), bottom first, with a horizontal line at
+    `target` if there is one. Returns the PNG."""
+
+    from matplotlib.figure import Figure
+
+    dates = [datetime.fromtimestamp(t, timezone.utc) for t in times]
+    # A bare Figure isn't registered with pyplot, so it's freed as soon as
+    # it's unreferenced instead of piling up in pyplot's list of figures.
+    fig = Figure(figsize=(11, 8))  # width, height (inches...)
+    ax = fig.add_subplot(1, 1, 1)
+    ax.xaxis_date("US/Eastern")
+    if xlim is not None:
+        ax.set_xlim(*(datetime.fromtimestamp(t, timezone.utc) for t in xlim))
+    ax.stackplot(dates, columns, labels=labels, colors=colors)
+    if target is not None:
+        ax.plot(dates, [target for _ in dates], color=(0, 0, 0))
+    handles, plabels = ax.get_legend_handles_labels()
+    ax.legend(handles[::-1], plabels[::-1], loc="upper left", fontsize="small")
+    with BytesIO() as buf:
+        fig.savefig(buf, format="png")
+        return buf.getvalue()
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        # spawn rather than fork, so the workers don't start out as copies
+        # of a web process (with its Django, database connections, etc.)
+        _pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=MAX_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_warm_up,
+        )
+    return _pool
+
+
+@atexit.register
+def shutdown():
+    """Stop the worker processes, once they've drawn what they're drawing."""
+
+    global _pool
+    with _lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
+
+
+def _discard_pool(pool):
+    """Stop using a pool whose worker died, if it hasn't been already. The
+    next render starts a new one."""
+
+    global _pool
+    with _lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def _forget(key, future):
+    with _lock:
+        if _in_flight.get(key) is future:
+            del _in_flight[key]
+
+
+def render(key, *args, **kwargs):
+    """Start draw_stacked_chart(*args, **kwargs) in the pool, returning a
+    Future for the PNG. Callers asking for the same `key` while it's being
+    drawn share one render.
+
+    Raises RendererBusy if MAX_PENDING renders are already waiting."""
+
+    global _pool
+    with _lock:
+        future = _in_flight.get(key)
+        if future is not None:
+            return future
+        if len(_in_flight) >= MAX_PENDING:
+            raise RendererBusy()
+        pool = _get_pool()
+        try:
+            future = pool.submit(draw_stacked_chart, *args, **kwargs)
+        except BrokenProcessPool:
+            # a worker died (e.g. killed for using too much memory); start over
+            pool.shutdown(wait=False)
+            _pool = None
+            pool = _get_pool()
+            future = pool.submit(draw_stacked_chart, *args, **kwargs)
+        future.pool = pool
+        _in_flight[key] = future
+    future.add_done_callback(lambda f: _forget(key, f))
+    return future
+
+
+def wait(future, timeout=None):
+    """The PNG from a render() Future, raising RendererBusy if it takes more
+    than `timeout` (by default RENDER_TIMEOUT) seconds, in which case the
+    render carries on in the background, or if it fails."""
+
+    try:
+        return future.result(timeout=timeout or RENDER_TIMEOUT)
+    except concurrent.futures.TimeoutError as e:
+        raise RendererBusy() from e
+    except BrokenProcessPool as e:
+        logger.error("Chart worker process died; starting a new one")
+        _discard_pool(future.pool)
+        raise RendererBusy() from e
+    except Exception as e:
+        logger.exception("Failed to draw a chart")
+        raise RendererBusy() from e
@@ -1,17 +1,18 @@
-import base64
-from collections import Counter
-from datetime import datetime
+import bisect
 from datetime import timedelta
-from io import BytesIO
 
-import matplotlib
-import matplotlib.pyplot as plt
-import numpy as np
+from django.core.cache import cache
+from django.db.models import Count
+from django.db.models import Max
+from django.utils import timezone
 
+from puzzle_editing import chart_renderer
 from puzzle_editing import status
-from puzzle_editing.models import PuzzleComment
+from puzzle_editing.models import StatusChange
 
-matplotlib.use("Agg")
+# numpy is imported where it's used, so that importing this module (which
+# views.py does) doesn't load it into every worker; matplotlib is only ever
+# loaded by chart_renderer's worker processes.
 
 rev_status_map = {}
 for st in status.STATUSES:
@@ -37,44 +38,168 @@ timetypes = {
 
 exclude = [status.DEAD, status.DEFERRED, status.INITIAL_IDEA]
 
+# matplotlib's tab20 colormap, which the chart has always been drawn with
+TAB20 = [
+    "#1f77b4",
+    "#aec7e8",
+    "#ff7f0e",
+    "#ffbb78",
+    "#2ca02c",
+    "#98df8a",
+    "#d62728",
+    "#ff9896",
+    "#9467bd",
+    "#c5b0d5",
+    "#8c564b",
+    "#c49c94",
+    "#e377c2",
+    "#f7b6d2",
+    "#7f7f7f",
+    "#c7c7c7",
+    "#bcbd22",
+    "#dbdb8d",
+    "#17becf",
+    "#9edae5",
+]
 
-def curr_puzzle_graph_b64(time: str, target_count):
-    comments = PuzzleComment.objects.order_by("date")
-    counts = Counter()
-    curr_status = {}
-    x = []
-    y = []
-    labels = [
-        status.get_display(s) for s in status.STATUSES[-1::-1] if s not in exclude
-    ]
-
-    for comment in comments:
-        new_status = comment.status_change
-        if new_status:
-            counts[new_status] += 1
-            if comment.puzzle.id in curr_status:
-                counts[curr_status[comment.puzzle.id]] -= 1
-            curr_status[comment.puzzle.id] = new_status
-            x.append(comment.date)
-            y.append([counts[s] for s in status.STATUSES[-1::-1] if s not in exclude])
-
-    # Plot
-    fig = plt.figure(figsize=(11, 8))  # width, height (inches...)
-    ax = plt.subplot(1, 1, 1)
-    ax.xaxis_date("US/Eastern")
-    if time in timetypes:
-        now = datetime.now()
-        xmax = x[-1] if x else now
-        plt.xlim(xmax - timetypes[time], now)
-    colormap = [i for i in matplotlib.cm.get_cmap("tab20").colors]
-    col = (colormap[::2] + colormap[1::2])[: len(status.STATUSES) - len(exclude)]
-    ax.stackplot(x, np.transpose(y), labels=labels, colors=col[-1::-1])
-    if target_count is not None:
-        ax.plot(x, [target_count for i in x], color=(0, 0, 0))
-    handles, plabels = ax.get_legend_handles_labels()
-    ax.legend(handles[::-1], plabels[::-1], loc="upper left", fontsize="small")
-    buf = BytesIO()
-    fig.savefig(buf, format="png")
-    image_base64 = base64.b64encode(buf.getvalue()).decode("utf-8").replace("\n", "")
-    buf.close()
-    return image_base64
+# Charts are keyed by the status change version, so this only bounds how long
+# outdated ones linger.
+GRAPH_CACHE_TIMEOUT = 60 * 60 * 24
+# How often charts of a timetypes window are redrawn to move the window along,
+# in seconds, even if no statuses changed.
+WINDOW_REDRAW_INTERVAL = 60 * 60
+
+
+def plotted_statuses():
+    """The statuses the chart stacks, bottom first."""
+
+    return [s for s in status.STATUSES[-1::-1] if s not in exclude]
+
+
+def series_colors():
+    """The color of each of plotted_statuses()."""
+
+    colors = (TAB20[::2] + TAB20[1::2])[: len(plotted_statuses())]
+    return colors[-1::-1]
+
+
+def window_start(time):
+    """When the chart starts for a `time` from timetypes, or None for all
+    time."""
+
+    if time not in timetypes:
+        return None
+    return timezone.now() - timetypes[time]
+
+
+def status_counts_over_time():
+    """The dates puzzles changed status, and for each date, how many puzzles
+    were in each plotted status (last status first, skipping `exclude`) right
+    after."""
+
+    import numpy as np
+
+    plotted = plotted_statuses()
+    column = {s: i for i, s in enumerate(plotted)}
+    changes = list(
+        StatusChange.objects.order_by("date", "id").values_list(
+            "from_status", "to_status", "date"
+        )
+    )
+
+    # one row per change: -1 in the column it left, +1 in the one it entered
+    deltas = np.zeros((len(changes), len(plotted)), dtype=int)
+    rows = np.arange(len(changes), dtype=int)
+    for index, sign in ((0, -1), (1, 1)):
+        columns = np.array(
+            [column.get(change[index], -1) for change in changes], dtype=int
+        )
+        deltas[rows[columns >= 0], columns[columns >= 0]] += sign
+    return [date for _, _, date in changes], np.cumsum(deltas, axis=0)
+
+
+def status_series(time):
+    """What the statistics chart plots, as columns for the browser to draw.
+
+    `t` is the times (in seconds since the epoch) to plot, from the start of
+    the `time` window to now, and `counts` has, for each plotted status, the
+    number of puzzles in it at each of those times. Changes before the window
+    are folded into its first point."""
+
+    x, y = status_counts_over_time()
+    now = timezone.now()
+    start = window_start(time)
+    first = 0 if start is None else bisect.bisect_right(x, start)
+    dates = x[first:]
+    rows = list(y[first:])
+    if first:
+        dates.insert(0, start)
+        rows.insert(0, y[first - 1])
+    if rows:
+        dates.append(now)
+        rows.append(rows[-1])
+    return {
+        "statuses": [status.get_display(s) for s in plotted_statuses()],
+        "colors": series_colors(),
+        "start": (start or (dates[0] if dates else now)).timestamp(),
+        "end": now.timestamp(),
+        "t": [date.timestamp() for date in dates],
+        "counts": [list(map(int, column)) for column in zip(*rows)]
+        or [[] for _ in plotted_statuses()],
+    }
+
+
+def status_change_version():
+    """Changes whenever a StatusChange is added or removed."""
+
+    version = StatusChange.objects.aggregate(last=Max("id"), count=Count("id"))
+    return "{}.{}".format(version["last"] or 0, version["count"])
+
+
+def render_puzzle_graph(time, target_count, key):
+    """Start drawing the stacked chart of puzzle statuses over time in
+    chart_renderer's worker processes, returning a Future for the PNG."""
+
+    x, y = status_counts_over_time()
+    start = window_start(time)
+    xlim = None
+    if start is not None:
+        xlim = (start.timestamp(), timezone.now().timestamp())
+    return chart_renderer.render(
+        key,
+        [date.timestamp() for date in x],
+        y.T.tolist(),
+        [status.get_display(s) for s in plotted_statuses()],
+        series_colors(),
+        xlim=xlim,
+        target=target_count,
+    )
+
+
+def puzzle_graph_etag(time, target_count):
+    if time not in timetypes:
+        return '"alltime-{}-{}"'.format(target_count, status_change_version())
+    # windowed charts end now, so they also go stale as time passes
+    bucket = int(timezone.now().timestamp() // WINDOW_REDRAW_INTERVAL)
+    return '"{}-{}-{}-{}"'.format(time, target_count, status_change_version(), bucket)
+
+
+def cached_puzzle_graph(time, target_count, etag):
+    """The PNG render_puzzle_graph would draw, from the cache if it has been
+    drawn since the last status change. `etag` is from puzzle_graph_etag.
+
+    Raises chart_renderer.RendererBusy if it isn't drawn within
+    chart_renderer.RENDER_TIMEOUT; it's still cached once it's done."""
+
+    key = "puzzle-graph:" + etag.strip('"')
+    png = cache.get(key)
+    if png is not None:
+        return png
+
+    def save(future):
+        if not future.cancelled() and future.exception() is None:
+            cache.set(key, future.result(), GRAPH_CACHE_TIMEOUT)
+
+    future = render_puzzle_graph(time, target_count, key)
+    future.add_done_callback(save)
+    return chart_renderer.wait(future)
@@ -0,0 +1,82 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from puzzle_editing import status
+from puzzle_editing.models import PuzzleComment
+from puzzle_editing.models import StatusChange
+
+rev_status_map = {}
+for st in status.STATUSES:
+    rev_status_map[status.get_display(st)] = st
+
+
+def parse_comment(content, status_change):
+    """The status a comment says its puzzle entered, if any."""
+
+    if status_change:
+        return status_change
+    if content == "Created puzzle":
+        return status.INITIAL_IDEA
+    # very old comments only said so in words
+    if content.startswith("Status changed to "):
+        return rev_status_map.get(content[len("Status changed to ") :])
+    return None
+
+
+@transaction.atomic
+def backfill_status_changes(force=False):
+    """Create the StatusChanges of puzzles from the comments that recorded
+    their status changes. Puzzles that already have some are skipped, unless
+    `force` is given, in which case all of them are recreated.
+
+    Returns how many StatusChanges were created."""
+
+    if force:
+        StatusChange.objects.all().delete()
+    done = set(StatusChange.objects.values_list("puzzle_id", flat=True).distinct())
+
+    comments = (
+        PuzzleComment.objects.filter(
+            ~Q(status_change="")
+            | Q(is_system=True, content="Created puzzle")
+            | Q(is_system=True, content__startswith="Status changed to ")
+        )
+        .exclude(puzzle_id__in=done)
+        .order_by("date", "id")
+        .values_list("puzzle_id", "author_id", "content", "status_change", "date")
+    )
+    current = {}
+    changes = []
+    for puzzle_id, author_id, content, status_change, date in comments.iterator():
+        new_status = parse_comment(content, status_change)
+        if new_status is None:
+            continue
+        changes.append(
+            StatusChange(
+                puzzle_id=puzzle_id,
+                from_status=current.get(puzzle_id, ""),
+                to_status=new_status,
+                date=date,
+                user_id=author_id,
+            )
+        )
+        current[puzzle_id] = new_status
+    StatusChange.objects.bulk_create(changes, batch_size=500)
+    return len(changes)
+
+
+class Command(BaseCommand):
+    help = """Fill in the StatusChange table from old comments.
+
+    Puzzles' status histories used to only be recorded in comments; this
+    recreates them for puzzles that have no StatusChanges yet."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force", action="store_true", help="recreate every StatusChange"
+        )
+
+    def handle(self, *args, **options):
+        count = backfill_status_changes(force=options["force"])
+        print(f"Created {count} status changes")
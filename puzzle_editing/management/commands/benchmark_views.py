@@ -0,0 +1,175 @@
+import json
+import statistics
+import time
+
+import django.urls as urls
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from puzzle_editing.models import Hint
+from puzzle_editing.models import Puzzle
+from puzzle_editing.models import PuzzleAnswer
+from puzzle_editing.models import PuzzleComment
+from puzzle_editing.models import PuzzleTag
+from puzzle_editing.models import Round
+from puzzle_editing.models import TestsolveSession
+from puzzle_editing.models import User
+from puzzle_editing.urls import urlpatterns
+
+# URLs it doesn't make sense to hit repeatedly: logging out would end the
+# benchmark's session, and postprod zips are files that usually don't exist
+# on a benchmarking database.
+SKIPPED = {"logout", "postprod_zip"}
+
+
+def sample_args(user):
+    """Pick the arguments to benchmark URLs with, favoring the biggest objects
+    (most comments etc.) since those are the slow ones."""
+
+    def biggest(queryset, field):
+        return (
+            queryset.annotate(size=Count(field))
+            .order_by("-size", "id")
+            .values_list("id", flat=True)
+            .first()
+        )
+
+    puzzle = biggest(Puzzle.objects, "comments")
+    samples = {
+        "puzzle": puzzle,
+        "comment": PuzzleComment.objects.filter(author=user)
+        .values_list("id", flat=True)
+        .first()
+        or PuzzleComment.objects.values_list("id", flat=True).first(),
+        "hint": Hint.objects.values_list("id", flat=True).first(),
+        "session": biggest(TestsolveSession.objects, "comments"),
+        "answer": PuzzleAnswer.objects.values_list("id", flat=True).first(),
+        "round": biggest(Round.objects, "answers"),
+        "tag": biggest(PuzzleTag.objects, "puzzles"),
+        "user": user.username,
+    }
+    kinds = {
+        "puzzle": "puzzle",
+        "puzzle_comments": "puzzle",
+        "puzzle_edit": "puzzle",
+        "puzzle_people": "puzzle",
+        "puzzle_answers": "puzzle",
+        "puzzle_tags": "puzzle",
+        "puzzle_postprod": "puzzle",
+        "puzzle_escape": "puzzle",
+        "edit_comment": "comment",
+        "edit_hint": "hint",
+        "testsolve_one": "session",
+        "testsolve_comments": "session",
+        "testsolve_finish": "session",
+        "edit_answer": "answer",
+        "edit_round": "round",
+        "bulk_add_answers": "round",
+        "single_tag": "tag",
+        "edit_tag": "tag",
+        "user": "user",
+    }
+    return {name: samples[kind] for name, kind in kinds.items()}
+
+
+def benchmark_urls(user):
+    """Yield (name, path) for every URL in puzzle_editing.urls that can be
+    benchmarked with the current database."""
+
+    args = sample_args(user)
+    for pattern in urlpatterns:
+        name = pattern.name or str(pattern.pattern)
+        if name in SKIPPED:
+            continue
+        if not pattern.pattern.converters:
+            yield name, "/" + str(pattern.pattern)
+        elif args.get(name) is not None:
+            yield name, urls.reverse(name, args=[args[name]])
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class Command(BaseCommand):
+    help = """Time GET requests to every puzzle_editing URL.
+
+    Reports p50/p95 latency and SQL query counts for each URL, and saves them
+    as JSON to compare against later runs. Run `generate_hunt` first to get
+    realistic numbers."""
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", type=str, help="username to browse as")
+        parser.add_argument("--repeat", type=int, default=10)
+        parser.add_argument("--output", type=str, help="JSON file to save to")
+        parser.add_argument("--compare", type=str, help="JSON file from an earlier run")
+        parser.add_argument(
+            "--only", type=str, nargs="*", help="URL names to benchmark"
+        )
+
+    def handle(self, *args, **options):
+        if options["user"]:
+            user = User.objects.filter(username=options["user"]).first()
+        else:
+            user = User.objects.filter(is_superuser=True).order_by("id").first()
+        if user is None:
+            raise CommandError("No user to browse as; pass --user")
+
+        baseline = {}
+        if options["compare"]:
+            with open(options["compare"]) as f:
+                baseline = json.load(f)["results"]
+
+        client = Client(HTTP_HOST="localhost")
+        client.force_login(user)
+
+        results = {}
+        for name, path in benchmark_urls(user):
+            if options["only"] and name not in options["only"]:
+                continue
+            # once to warm up caches, then the timed runs
+            client.get(path)
+            timings = []
+            for _ in range(options["repeat"]):
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.perf_counter()
+                    response = client.get(path)
+                    timings.append((time.perf_counter() - start) * 1000)
+            results[name] = {
+                "path": path,
+                "status": response.status_code,
+                "p50_ms": round(statistics.median(timings), 2),
+                "p95_ms": round(percentile(timings, 0.95), 2),
+                "queries": len(queries),
+            }
+
+            line = "{:<24} {:>4} {:>9.1f}ms {:>9.1f}ms {:>5} queries".format(
+                name,
+                response.status_code,
+                results[name]["p50_ms"],
+                results[name]["p95_ms"],
+                len(queries),
+            )
+            if name in baseline:
+                line += "  (was {:.1f}ms, {} queries)".format(
+                    baseline[name]["p50_ms"], baseline[name]["queries"]
+                )
+            print(line)
+
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(
+                    {
+                        "user": user.username,
+                        "repeat": options["repeat"],
+                        "puzzles": Puzzle.objects.count(),
+                        "results": results,
+                    },
+                    f,
+                    indent=2,
+                )
@@ -0,0 +1,295 @@
+import datetime
+import random
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from puzzle_editing import status
+from puzzle_editing.models import CommentReaction
+from puzzle_editing.models import Hint
+from puzzle_editing.models import Puzzle
+from puzzle_editing.models import PuzzleAnswer
+from puzzle_editing.models import PuzzleComment
+from puzzle_editing.models import PuzzleTag
+from puzzle_editing.models import PuzzleVisited
+from puzzle_editing.models import refresh_puzzle_list_rows
+from puzzle_editing.models import refresh_unread_puzzles
+from puzzle_editing.models import rerender_markdown
+from puzzle_editing.models import Round
+from puzzle_editing.models import StatusChange
+from puzzle_editing.models import TestsolveGuess
+from puzzle_editing.models import TestsolveParticipation
+from puzzle_editing.models import TestsolveSession
+from puzzle_editing.models import User
+
+WORDS = """
+    alpha bravo charlie delta echo foxtrot golf hotel india juliett kilo lima
+    mike november oscar papa quebec romeo sierra tango uniform victor whiskey
+    xray yankee zulu crossword cryptic logic meta runaround grid trivia
+""".split()
+
+
+def words(rng, count):
+    return " ".join(rng.choice(WORDS) for _ in range(count))
+
+
+class Command(BaseCommand):
+    help = """Fill the database with a synthetic hunt, for benchmarking.
+
+    Everything is created with bulk inserts, so signals don't run; the
+    puzzle list rows, unread puzzles and rendered markdown are rebuilt at the
+    end instead. Each puzzle gets one StatusChange, into its current status,
+    spread over the last 60 days."""
+
+    def add_arguments(self, parser):
+        parser.add_argument("--puzzles", type=int, default=200)
+        parser.add_argument("--users", type=int, default=50)
+        parser.add_argument("--comments", type=int, default=10, help="per puzzle")
+        parser.add_argument("--rounds", type=int, default=10)
+        parser.add_argument("--tags", type=int, default=20)
+        parser.add_argument(
+            "--sessions", type=int, default=2, help="per puzzle in testsolving"
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--prefix",
+            type=str,
+            default="hunt",
+            help="prefix for generated usernames, which must not exist yet",
+        )
+        parser.add_argument("--password", type=str, default="password")
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        now = timezone.now()
+        prefix = options["prefix"]
+
+        # hashing is slow, and everyone can share the same password
+        password = make_password(options["password"])
+        users = User.objects.bulk_create(
+            User(
+                username=f"{prefix}{i}",
+                email=f"{prefix}{i}@example.com",
+                display_name=f"{words(rng, 2).title()} {i}",
+                credits_name=f"{prefix.title()} User {i}",
+                bio=words(rng, 20),
+                password=password,
+                is_staff=i == 0,
+                is_superuser=i == 0,
+            )
+            for i in range(options["users"])
+        )
+        # bulk_create only sets primary keys on some backends
+        users = list(
+            User.objects.filter(
+                username__in=[user.username for user in users]
+            ).order_by("id")
+        )
+
+        rounds = Round.objects.bulk_create(
+            Round(name=f"Round {i}: {words(rng, 2)}", description=words(rng, 10))
+            for i in range(options["rounds"])
+        )
+        rounds = list(Round.objects.order_by("-id")[: len(rounds)])
+        tags = PuzzleTag.objects.bulk_create(
+            PuzzleTag(
+                name=f"{words(rng, 1)} {i}",
+                description=words(rng, 10),
+                important=rng.random() < 0.2,
+            )
+            for i in range(options["tags"])
+        )
+        tags = list(PuzzleTag.objects.order_by("-id")[: len(tags)])
+
+        Puzzle.objects.bulk_create(
+            Puzzle(
+                name=f"Puzzle {i}: {words(rng, 3)}",
+                codename=f"{prefix}-{i}" if rng.random() < 0.5 else "",
+                status=rng.choice(status.STATUSES),
+                status_mtime=now,
+                summary=words(rng, 15),
+                description=words(rng, 40),
+                notes=words(rng, 10),
+                editor_notes=words(rng, 10),
+                content=words(rng, 100),
+                solution=words(rng, 60),
+                priority=rng.randint(1, 5),
+            )
+            for i in range(options["puzzles"])
+        )
+        puzzles = list(Puzzle.objects.order_by("-id")[: options["puzzles"]])
+        puzzle_ids = [puzzle.id for puzzle in puzzles]
+        StatusChange.objects.bulk_create(
+            StatusChange(
+                puzzle=puzzle,
+                to_status=puzzle.status,
+                date=now - datetime.timedelta(days=60 * i / len(puzzles)),
+            )
+            for i, puzzle in enumerate(puzzles)
+        )
+
+        answers = []
+        if rounds:
+            answers = PuzzleAnswer.objects.bulk_create(
+                PuzzleAnswer(answer=words(rng, 2).upper(), round=rng.choice(rounds))
+                for _ in range(len(puzzles))
+            )
+            answers = list(PuzzleAnswer.objects.order_by("-id")[: len(answers)])
+
+        through_rows = {
+            name: []
+            for name in (
+                "authors",
+                "editors",
+                "spoiled",
+                "factcheckers",
+                "postprodders",
+                "tags",
+                "answers",
+            )
+        }
+        spoiled_users = {}
+        for puzzle in puzzles:
+            authors = rng.sample(users, min(len(users), rng.randint(1, 3)))
+            editors = rng.sample(users, min(len(users), rng.randint(0, 2)))
+            spoiled = set(authors) | set(editors)
+            spoiled |= set(rng.sample(users, min(len(users), rng.randint(0, 5))))
+            spoiled_users[puzzle.id] = list(spoiled)
+            people = {
+                "authors": authors,
+                "editors": editors,
+                "spoiled": spoiled,
+                "factcheckers": rng.sample(users, min(len(users), rng.randint(0, 1))),
+                "postprodders": rng.sample(users, min(len(users), rng.randint(0, 1))),
+            }
+            for name, chosen in people.items():
+                through = getattr(Puzzle, name).through
+                through_rows[name].extend(
+                    through(puzzle_id=puzzle.id, user_id=user.id) for user in chosen
+                )
+            for tag in rng.sample(tags, min(len(tags), rng.randint(0, 3))):
+                through_rows["tags"].append(
+                    Puzzle.tags.through(puzzle_id=puzzle.id, puzzletag_id=tag.id)
+                )
+            if answers and rng.random() < 0.7:
+                through_rows["answers"].append(
+                    Puzzle.answers.through(
+                        puzzle_id=puzzle.id, puzzleanswer_id=answers.pop().id
+                    )
+                )
+        for name, rows in through_rows.items():
+            getattr(Puzzle, name).through.objects.bulk_create(rows)
+
+        PuzzleVisited.objects.bulk_create(
+            PuzzleVisited(puzzle_id=puzzle_id, user=user)
+            for puzzle_id, spoiled in spoiled_users.items()
+            for user in spoiled
+            if rng.random() < 0.5
+        )
+
+        Hint.objects.bulk_create(
+            Hint(
+                puzzle_id=puzzle_id,
+                order=order,
+                keywords=",".join(rng.sample(WORDS, 3)),
+                content=words(rng, 12),
+            )
+            for puzzle_id in puzzle_ids
+            for order in range(rng.randint(0, 3))
+        )
+
+        sessions = TestsolveSession.objects.bulk_create(
+            TestsolveSession(
+                puzzle=puzzle,
+                joinable=rng.random() < 0.5,
+                notes=words(rng, 10),
+            )
+            for puzzle in puzzles
+            if status.get_status_rank(puzzle.status)
+            >= status.get_status_rank(status.TESTSOLVING)
+            for _ in range(options["sessions"])
+        )
+        sessions = list(TestsolveSession.objects.order_by("-id")[: len(sessions)])
+
+        participations = []
+        guesses = []
+        for session in sessions:
+            for user in rng.sample(users, min(len(users), rng.randint(1, 4))):
+                finished = rng.random() < 0.5
+                participations.append(
+                    TestsolveParticipation(
+                        session=session,
+                        user=user,
+                        ended=now if finished else None,
+                        fun_rating=rng.randint(1, 5) if finished else None,
+                        difficulty_rating=rng.randint(1, 5) if finished else None,
+                        hours_spent=rng.random() * 4 if finished else None,
+                    )
+                )
+                guesses.extend(
+                    TestsolveGuess(
+                        session=session,
+                        user=user,
+                        guess=words(rng, 2).upper(),
+                        correct=rng.random() < 0.1,
+                    )
+                    for _ in range(rng.randint(0, 5))
+                )
+        TestsolveParticipation.objects.bulk_create(participations)
+        TestsolveGuess.objects.bulk_create(guesses)
+
+        session_ids = {}
+        for session in sessions:
+            session_ids.setdefault(session.puzzle_id, []).append(session.id)
+        comments = PuzzleComment.objects.bulk_create(
+            PuzzleComment(
+                puzzle_id=puzzle_id,
+                author=rng.choice(spoiled_users[puzzle_id]),
+                is_system=False,
+                testsolve_session_id=(
+                    rng.choice(session_ids[puzzle_id])
+                    if puzzle_id in session_ids and rng.random() < 0.3
+                    else None
+                ),
+                content=words(rng, rng.randint(5, 80)),
+            )
+            for puzzle_id in puzzle_ids
+            for _ in range(options["comments"])
+        )
+        comment_ids = list(
+            PuzzleComment.objects.order_by("-id").values_list("id", flat=True)[
+                : len(comments)
+            ]
+        )
+
+        reactions = set()
+        for comment_id in comment_ids:
+            for _ in range(rng.randint(0, 3)):
+                reactions.add(
+                    (
+                        rng.choice(CommentReaction.EMOJI_OPTIONS),
+                        comment_id,
+                        rng.choice(users).id,
+                    )
+                )
+        CommentReaction.objects.bulk_create(
+            CommentReaction(emoji=emoji, comment_id=comment_id, reactor_id=user_id)
+            for emoji, comment_id, user_id in reactions
+        )
+
+        user_ids = [user.id for user in users]
+        for i in range(0, len(puzzle_ids), 500):
+            refresh_puzzle_list_rows(puzzle_ids[i : i + 500])
+            refresh_unread_puzzles(puzzle_ids[i : i + 500], user_ids)
+        rerender_markdown()
+
+        print(
+            f"Generated {len(puzzles)} puzzles, {len(users)} users, "
+            f"{len(comment_ids)} comments, {len(reactions)} reactions, "
+            f"{len(sessions)} testsolve sessions and {len(guesses)} guesses"
+        )
+        if users:
+            print(f"Log in as {users[0].username} (a superuser) to look around")
@@ -1,38 +1,26 @@
-import time
-
 from django.core.management.base import BaseCommand
+from django.db.models import Exists
+from django.db.models import Max
+from django.db.models import OuterRef
+from django.db.models import Subquery
 
-from puzzle_editing import status
 from puzzle_editing.models import Puzzle
-from puzzle_editing.models import PuzzleComment
-
-rev_status_map = {}
-for st in status.STATUSES:
-    rev_status_map[status.get_display(st)] = st
-
-
-def parse_comment(comment: str):
-    if comment == "Created puzzle":
-        return status.INITIAL_IDEA
-    elif comment.startswith("Status changed to "):
-        if comment[18:] in rev_status_map:
-            return rev_status_map[comment[18:]]
-        else:
-            print("Missing status in map:", comment)
-            return None
+from puzzle_editing.models import StatusChange
 
 
 class Command(BaseCommand):
-    help = """Fix up the status mtime field."""
+    help = """Fix up the status mtime field from the puzzles' StatusChanges.
 
-    def handle(self, *args, **options):
-        comments = PuzzleComment.objects.filter(is_system=True).order_by("date")
-        last_updates = {}
-        for comment in comments:
-            if parse_comment(comment.content):
-                last_updates[comment.puzzle.pk] = comment.date
+    Run `backfill_status_changes` first if those might be missing."""
 
-        for pk, mtime in last_updates.items():
-            time.sleep(0.1)  # this avoids strange database overload issues
-            print(f"Processing puzzle #{pk}")
-            Puzzle.objects.filter(pk=pk).update(status_mtime=mtime)
+    def handle(self, *args, **options):
+        last_change = (
+            StatusChange.objects.filter(puzzle=OuterRef("pk"))
+            .values("puzzle")
+            .annotate(last=Max("date"))
+            .values("last")
+        )
+        count = Puzzle.objects.filter(
+            Exists(StatusChange.objects.filter(puzzle=OuterRef("pk")))
+        ).update(status_mtime=Subquery(last_change))
+        print(f"Updated the status mtime of {count} puzzles")
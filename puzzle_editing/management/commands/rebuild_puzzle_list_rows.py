@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from puzzle_editing.models import Puzzle
+from puzzle_editing.models import refresh_puzzle_list_rows
+
+
+class Command(BaseCommand):
+    help = """Recompute the denormalized rows used to list puzzles."""
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        puzzle_ids = list(Puzzle.objects.order_by("id").values_list("id", flat=True))
+        batch_size = options["batch_size"]
+        for i in range(0, len(puzzle_ids), batch_size):
+            refresh_puzzle_list_rows(puzzle_ids[i : i + batch_size])
+        print(f"Rebuilt list rows for {len(puzzle_ids)} puzzles")
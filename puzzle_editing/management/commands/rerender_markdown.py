@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from puzzle_editing.models import rerender_markdown
+
+
+class Command(BaseCommand):
+    help = """Re-render the stored HTML of markdown fields.
+
+    Only objects rendered by an older version of the renderer are redone,
+    unless --force is given. This also runs after every migrate."""
+
+    def add_arguments(self, parser):
+        parser.add_argument("--force", action="store_true")
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        count = rerender_markdown(
+            force=options["force"], batch_size=options["batch_size"]
+        )
+        print(f"Re-rendered markdown for {count} objects")
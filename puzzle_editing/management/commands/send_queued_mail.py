@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from puzzle_editing.messaging import send_digests
+from puzzle_editing.messaging import send_queued_mail
+
+
+class Command(BaseCommand):
+    help = """Send the emails queued by messaging.send_mail_wrapper, after
+    queueing the digests that are due.
+
+    Each batch is sent over one connection to the mail server. With --loop,
+    keeps checking the queue every --interval seconds; otherwise sends
+    whatever is due and exits, for running from cron. Only run one of these
+    at a time."""
+
+    def add_arguments(self, parser):
+        parser.add_argument("--loop", action="store_true")
+        parser.add_argument("--interval", type=float, default=10)
+        parser.add_argument("--batch-size", type=int, default=100)
+
+    def handle(self, *args, **options):
+        while True:
+            digests = send_digests()
+            if digests:
+                print(f"Queued {digests} digest emails")
+            sent, failed = send_queued_mail(limit=options["batch_size"])
+            if sent or failed:
+                print(f"Sent {sent} emails, {failed} failed")
+            if sent + failed == options["batch_size"]:
+                continue  # there may be more due already
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
@@ -1,20 +1,240 @@
+import collections
+import datetime
+
 from django.conf import settings
+from django.core.mail import get_connection
 from django.core.mail.message import EmailMultiAlternatives
+from django.db import transaction
+from django.db.models import Q
 from django.template.loader import render_to_string
+from django.utils import timezone
+
+from puzzle_editing.models import OutboundEmail
+from puzzle_editing.models import PendingNotification
+from puzzle_editing.models import PuzzleComment
+from puzzle_editing.models import User
+
+FROM_EMAIL = "FIXME email sender <fixme@example.com>"
+REPLY_TO = ["FIXME_reply_to_address@example.com"]
+
+# Failed sends are retried after RETRY_DELAY, then twice that, and so on up to
+# MAX_RETRY_DELAY, and given up on after MAX_SEND_ATTEMPTS tries.
+RETRY_DELAY = datetime.timedelta(minutes=1)
+MAX_RETRY_DELAY = datetime.timedelta(hours=1)
+MAX_SEND_ATTEMPTS = 8
 
 
 def send_mail_wrapper(subject, template, context, recipients):
+    """Render an email and queue it for send_queued_mail, so that the request
+    doesn't wait on the mail server."""
+
     if recipients:
-        mail = EmailMultiAlternatives(
+        OutboundEmail.objects.create(
             subject=settings.EMAIL_SUBJECT_PREFIX + subject,
             body=render_to_string(template + ".txt", context),
-            from_email="FIXME email sender <fixme@example.com>",
-            to=recipients,
-            alternatives=[(render_to_string(template + ".html", context), "text/html")],
-            reply_to=["FIXME_reply_to_address@example.com"],
+            html_body=render_to_string(template + ".html", context),
+            recipients=list(recipients),
         )
-        send_res = mail.send()
-        if send_res != 1:
-            raise RuntimeError(
-                "Unknown failure sending mail??? {} {}".format(recipients, send_res)
+
+
+def hold_for_digests(comment, recipients, site_url):
+    """Queue digest notifications about `comment` for the users among
+    `recipients` who want digests, and return the emails of the others, who
+    should be emailed about it now."""
+
+    digest_users = list(
+        User.objects.filter(
+            email__in=recipients, email_digest_minutes__gt=0
+        ).values_list("id", "email")
+    )
+    PendingNotification.objects.bulk_create(
+        PendingNotification(user_id=user_id, comment=comment, site_url=site_url)
+        for user_id, _ in digest_users
+    )
+    held = {email for _, email in digest_users}
+    return [email for email in recipients if email not in held]
+
+
+def hold_many_for_digests(comments, puzzle_ids_by_email, site_url):
+    """hold_for_digests for many comments at once. `puzzle_ids_by_email`
+    maps each recipient to the puzzles whose comments they should hear about;
+    returns it without the recipients who get digests."""
+
+    digest_users = list(
+        User.objects.filter(
+            email__in=puzzle_ids_by_email, email_digest_minutes__gt=0
+        ).values_list("id", "email")
+    )
+    PendingNotification.objects.bulk_create(
+        PendingNotification(user_id=user_id, comment=comment, site_url=site_url)
+        for user_id, email in digest_users
+        for comment in comments
+        if comment.puzzle_id in puzzle_ids_by_email[email]
+    )
+    held = {email for _, email in digest_users}
+    return {
+        email: puzzle_ids
+        for email, puzzle_ids in puzzle_ids_by_email.items()
+        if email not in held
+    }
+
+
+def send_grouped_mail(subject, template, context, puzzles, puzzle_ids_by_email):
+    """Email everyone in `puzzle_ids_by_email` about the `puzzles` whose ids
+    are mapped to their email, rendering one email per distinct set of
+    puzzles. `context` is extended with the list of puzzles."""
+
+    groups = collections.defaultdict(list)
+    for email, puzzle_ids in puzzle_ids_by_email.items():
+        if puzzle_ids:
+            groups[frozenset(puzzle_ids)].append(email)
+    for puzzle_ids, recipients in groups.items():
+        send_mail_wrapper(
+            subject,
+            template,
+            dict(context, puzzles=[p for p in puzzles if p.id in puzzle_ids]),
+            sorted(recipients),
+        )
+
+
+def send_digests(now=None):
+    """Queue a digest email for every user whose oldest pending notification
+    has waited their digest interval. Returns how many emails were queued.
+
+    Each email covers the new comments on one puzzle. Users due a digest of
+    the same comments share one email, so it's only rendered once."""
+
+    now = now or timezone.now()
+    # a user is due once any of their notifications is older than their
+    # interval; there are only a few distinct intervals, so check each
+    intervals = (
+        PendingNotification.objects.values_list("user__email_digest_minutes", flat=True)
+        .order_by()
+        .distinct()
+    )
+    overdue = Q()
+    for minutes in intervals:
+        overdue |= Q(
+            user__email_digest_minutes=minutes,
+            created__lte=now - datetime.timedelta(minutes=minutes),
+        )
+    if not overdue:
+        return 0
+    due_users = PendingNotification.objects.filter(overdue).values("user")
+
+    # Claim the due notifications, queue their emails and delete them in one
+    # transaction, so a concurrent run skips them instead of sending them
+    # again, and a failure leaves them to be sent next time.
+    with transaction.atomic():
+        due = list(
+            PendingNotification.objects.filter(user__in=due_users)
+            .select_related("user")
+            .select_for_update(skip_locked=True, of=("self",))
+        )
+        if not due:
+            return 0
+        queued = queue_digests(due)
+        PendingNotification.objects.filter(
+            id__in=[notification.id for notification in due]
+        ).delete()
+    return queued
+
+
+def queue_digests(due):
+    """Queue the digest emails for the PendingNotifications `due`, returning
+    how many were queued."""
+
+    comments = {
+        comment.id: comment
+        for comment in PuzzleComment.objects.filter(
+            id__in={notification.comment_id for notification in due}
+        ).select_related("author", "puzzle")
+    }
+    by_user_and_puzzle = collections.defaultdict(list)
+    for notification in due:
+        puzzle_id = comments[notification.comment_id].puzzle_id
+        by_user_and_puzzle[notification.user, puzzle_id].append(notification)
+    # comment ids -> recipients, site url
+    digests = {}
+    for (user, _), notifications in by_user_and_puzzle.items():
+        notifications.sort(key=lambda n: (n.created, n.comment_id))
+        key = tuple(notification.comment_id for notification in notifications)
+        recipients, _ = digests.setdefault(key, ([], notifications[-1].site_url))
+        recipients.append(user.email)
+
+    for comment_ids, (recipients, site_url) in digests.items():
+        digest_comments = [comments[comment_id] for comment_id in comment_ids]
+        puzzle = digest_comments[0].puzzle
+        if len(digest_comments) == 1:
+            subject = "New comment on {}".format(puzzle.spoiler_free_title())
+        else:
+            subject = "{} new comments on {}".format(
+                len(digest_comments), puzzle.spoiler_free_title()
             )
+        send_mail_wrapper(
+            subject,
+            "digest_email",
+            {"puzzle": puzzle, "comments": digest_comments, "site_url": site_url},
+            [email for email in recipients if email],
+        )
+    return len(digests)
+
+
+def make_message(email, connection):
+    return EmailMultiAlternatives(
+        subject=email.subject,
+        body=email.body,
+        from_email=FROM_EMAIL,
+        to=email.recipients,
+        alternatives=[(email.html_body, "text/html")] if email.html_body else [],
+        reply_to=REPLY_TO,
+        connection=connection,
+    )
+
+
+def retry_delay(attempts):
+    return min(RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+
+
+def send_queued_mail(limit=100):
+    """Send up to `limit` queued emails that are due, over one connection.
+
+    Sent emails are deleted; failed ones are rescheduled. Returns the number
+    of emails sent and the number that failed."""
+
+    now = timezone.now()
+    emails = list(
+        OutboundEmail.objects.filter(
+            next_attempt__lte=now, attempts__lt=MAX_SEND_ATTEMPTS
+        ).order_by("next_attempt", "id")[:limit]
+    )
+    if not emails:
+        return 0, 0
+
+    sent = []
+    failed = []
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception as e:
+        failed = [(email, e) for email in emails]
+    else:
+        try:
+            for email in emails:
+                try:
+                    if make_message(email, connection).send() != 1:
+                        raise RuntimeError("Mail backend didn't send the message")
+                except Exception as e:
+                    failed.append((email, e))
+                else:
+                    sent.append(email.id)
+        finally:
+            connection.close()
+
+    OutboundEmail.objects.filter(id__in=sent).delete()
+    for email, error in failed:
+        email.attempts += 1
+        email.last_error = repr(error)
+        email.next_attempt = now + retry_delay(email.attempts)
+        email.save(update_fields=["attempts", "last_error", "next_attempt"])
+    return len(sent), len(failed)
@@ -0,0 +1,142 @@
+import atexit
+import collections
+import logging
+import threading
+import time
+
+from django.db import connection
+from django.db import DatabaseError
+from django.utils import timezone
+
+from puzzle_editing.models import flush_visits
+from puzzle_editing.models import visits_due
+
+logger = logging.getLogger("puzzles.request")
+
+# How many recent requests to remember for the admin's slow request page.
+RECENT_REQUESTS_SIZE = 500
+
+recent_requests = collections.deque(maxlen=RECENT_REQUESTS_SIZE)
+# other threads (or greenlets) append while the admin page reads it
+_recent_requests_lock = threading.Lock()
+
+_local = threading.local()
+
+
+class RequestStats:
+    def __init__(self):
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.template_seconds = 0.0
+        self.template_depth = 0
+
+    def record_query(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.sql_seconds += time.perf_counter() - start
+
+
+def current_stats():
+    """The stats of the request being handled on this thread, if any."""
+    return getattr(_local, "stats", None)
+
+
+def slowest_recent_requests(limit=100):
+    with _recent_requests_lock:
+        requests = list(recent_requests)
+    return sorted(requests, key=lambda r: r["total_ms"], reverse=True)[:limit]
+
+
+class RequestTimingMiddleware:
+    """Time each request, its SQL and its template rendering.
+
+    The numbers go to the puzzles.request logger, to a Server-Timing header
+    (so they show up in the browser's network panel) and to
+    recent_requests, which the admin can list slowest first. Template time
+    is only measured if the TimedDjangoTemplates backend is in use."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = RequestStats()
+        _local.stats = stats
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(stats.record_query):
+                response = self.get_response(request)
+        finally:
+            _local.stats = None
+        total_ms = (time.perf_counter() - start) * 1000
+        sql_ms = stats.sql_seconds * 1000
+        template_ms = stats.template_seconds * 1000
+        # streaming responses haven't been generated yet
+        size = None if response.streaming else len(response.content)
+
+        response["Server-Timing"] = (
+            'total;dur={:.1f}, sql;dur={:.1f};desc="{} queries", '
+            "template;dur={:.1f}".format(total_ms, sql_ms, stats.queries, template_ms)
+        )
+
+        user = getattr(request, "user", None)
+        record = {
+            "date": timezone.now(),
+            "method": request.method,
+            "path": request.get_full_path(),
+            "status": response.status_code,
+            "user": user.username if user and user.is_authenticated else "",
+            "total_ms": round(total_ms, 1),
+            "queries": stats.queries,
+            "sql_ms": round(sql_ms, 1),
+            "template_ms": round(template_ms, 1),
+            "size": size,
+        }
+        with _recent_requests_lock:
+            recent_requests.append(record)
+        logger.debug(
+            "%(method)s %(path)s %(status)s %(total_ms)sms "
+            "sql=%(queries)s/%(sql_ms)sms template=%(template_ms)sms "
+            "size=%(size)s user=%(user)s",
+            record,
+        )
+        return response
+
+
+class VisitFlushMiddleware:
+    """Write the puzzle visits buffered by record_visit once the response is
+    ready and enough of them have piled up (see models.visits_due), so that
+    page views don't write to the database while rendering, and visits from
+    many requests share one upsert.
+
+    A visit to a puzzle that was unread (the view sets
+    request.puzzle_was_unread) is written right away, along with the rest
+    of that user's visits, so the next page they load doesn't still show
+    it as unread."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            return self.get_response(request)
+        finally:
+            try:
+                if visits_due():
+                    flush_visits()
+                elif getattr(request, "puzzle_was_unread", False):
+                    flush_visits(request.user)
+            except DatabaseError:
+                # they're kept for the next try
+                logger.exception("Couldn't write puzzle visits")
+
+
+@atexit.register
+def flush_visits_at_exit():
+    # when a worker is restarted, rather than losing what's buffered
+    try:
+        flush_visits()
+    except Exception:
+        logger.exception("Couldn't write puzzle visits before exiting")
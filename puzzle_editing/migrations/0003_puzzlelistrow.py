@@ -0,0 +1,69 @@
+# Generated by Django 4.0.9 on 2026-10-17 02:55
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+import django.db.models.deletion
+
+from puzzle_editing import status
+
+
+def backfill_puzzle_list_rows(apps, schema_editor):
+    # the same as manage.py rebuild_puzzle_list_rows, on the historical models
+    Puzzle = apps.get_model('puzzle_editing', 'Puzzle')
+    PuzzleComment = apps.get_model('puzzle_editing', 'PuzzleComment')
+    PuzzleListRow = apps.get_model('puzzle_editing', 'PuzzleListRow')
+
+    rows = {
+        puzzle_id: PuzzleListRow(
+            puzzle_id=puzzle_id, status_rank=status.get_status_rank(puzzle_status)
+        )
+        for puzzle_id, puzzle_status in Puzzle.objects.values_list('id', 'status')
+    }
+    for puzzle_id, tag_name in Puzzle.tags.through.objects.filter(
+        puzzletag__important=True
+    ).values_list('puzzle_id', 'puzzletag__name'):
+        rows[puzzle_id].important_tag_names.append(tag_name)
+    for through, people in [
+        (Puzzle.authors.through, 'authors'),
+        (Puzzle.editors.through, 'editors'),
+    ]:
+        for puzzle_id, username, display_name in through.objects.values_list(
+            'puzzle_id', 'user__username', 'user__display_name'
+        ):
+            getattr(rows[puzzle_id], people).append([username, display_name])
+    for puzzle_id, last_comment_date in (
+        PuzzleComment.objects.values('puzzle')
+        .annotate(last_comment_date=Max('date'))
+        .values_list('puzzle', 'last_comment_date')
+    ):
+        rows[puzzle_id].last_comment_date = last_comment_date
+    for puzzle_id, answer_count in (
+        Puzzle.answers.through.objects.values('puzzle')
+        .annotate(answer_count=Count('puzzleanswer'))
+        .values_list('puzzle', 'answer_count')
+    ):
+        rows[puzzle_id].answer_count = answer_count
+    PuzzleListRow.objects.bulk_create(rows.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('puzzle_editing', '0002_testsolvesession_spreadsheet_link'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PuzzleListRow',
+            fields=[
+                ('puzzle', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='list_row', serialize=False, to='puzzle_editing.puzzle')),
+                ('status_rank', models.IntegerField(db_index=True)),
+                ('important_tag_names', models.JSONField(default=list)),
+                ('authors', models.JSONField(default=list)),
+                ('editors', models.JSONField(default=list)),
+                ('last_comment_date', models.DateTimeField(blank=True, null=True)),
+                ('answer_count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(backfill_puzzle_list_rows, migrations.RunPython.noop),
+    ]
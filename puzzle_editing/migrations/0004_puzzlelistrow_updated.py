@@ -0,0 +1,18 @@
+# Generated by Django 4.0.9 on 2026-10-17 03:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('puzzle_editing', '0003_puzzlelistrow'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='puzzlelistrow',
+            name='updated',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.0.9 on 2026-10-17 03:13
+
+from django.db import migrations, models
+
+
+def delete_duplicate_visits(apps, schema_editor):
+    # keep the latest visit of each (puzzle, user)
+    PuzzleVisited = apps.get_model('puzzle_editing', 'PuzzleVisited')
+    seen = set()
+    duplicate_ids = []
+    for visit_id, puzzle_id, user_id in PuzzleVisited.objects.order_by(
+        '-date', '-id'
+    ).values_list('id', 'puzzle_id', 'user_id'):
+        if (puzzle_id, user_id) in seen:
+            duplicate_ids.append(visit_id)
+        seen.add((puzzle_id, user_id))
+    for i in range(0, len(duplicate_ids), 500):
+        PuzzleVisited.objects.filter(id__in=duplicate_ids[i : i + 500]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('puzzle_editing', '0004_puzzlelistrow_updated'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_visits, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='puzzlevisited',
+            constraint=models.UniqueConstraint(fields=('puzzle', 'user'), name='unique_puzzle_visit'),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 4.0.9 on 2026-10-17 03:15
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max
+from django.utils import timezone
+import django.db.models.deletion
+
+
+def backfill_unread_puzzles(apps, schema_editor):
+    # same rule the inbox used before: spoiled and either never visited or
+    # commented on since the last visit
+    Puzzle = apps.get_model('puzzle_editing', 'Puzzle')
+    PuzzleComment = apps.get_model('puzzle_editing', 'PuzzleComment')
+    PuzzleVisited = apps.get_model('puzzle_editing', 'PuzzleVisited')
+    UnreadPuzzle = apps.get_model('puzzle_editing', 'UnreadPuzzle')
+
+    now = timezone.now()
+    last_comment_dates = dict(
+        PuzzleComment.objects.values('puzzle')
+        .annotate(last_comment_date=Max('date'))
+        .values_list('puzzle', 'last_comment_date')
+    )
+    visits = {
+        (puzzle_id, user_id): date
+        for puzzle_id, user_id, date in PuzzleVisited.objects.values_list(
+            'puzzle_id', 'user_id', 'date'
+        )
+    }
+    unread = []
+    for puzzle_id, user_id in Puzzle.spoiled.through.objects.values_list(
+        'puzzle_id', 'user_id'
+    ):
+        visited = visits.get((puzzle_id, user_id))
+        last_comment_date = last_comment_dates.get(puzzle_id)
+        if visited is None:
+            date = last_comment_date or now
+        elif last_comment_date and last_comment_date > visited:
+            date = last_comment_date
+        else:
+            continue
+        unread.append(UnreadPuzzle(puzzle_id=puzzle_id, user_id=user_id, date=date))
+    UnreadPuzzle.objects.bulk_create(unread, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('puzzle_editing', '0005_puzzlevisited_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UnreadPuzzle',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateTimeField()),
+                ('puzzle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='unread_entries', to='puzzle_editing.puzzle')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='unread', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='unreadpuzzle',
+            constraint=models.UniqueConstraint(fields=('user', 'puzzle'), name='unique_unread_puzzle'),
+        ),
+        migrations.RunPython(backfill_unread_puzzles, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.0.9 on 2026-10-17 03:25
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('puzzle_editing', '0008_outboundemail'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='email_digest_minutes',
+            field=models.PositiveIntegerField(choices=[(0, 'Immediately'), (15, 'Every 15 minutes'), (60, 'Every hour'), (240, 'Every 4 hours'), (1440, 'Once a day')], default=0, help_text='How often to email you about new comments. Comments on the same puzzle are collected into one email.'),
+        ),
+        migrations.CreateModel(
+            name='PendingNotification',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('site_url', models.CharField(max_length=200)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('comment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='puzzle_editing.puzzlecomment')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pending_notifications', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 4.0.9 on 2026-10-17 03:35
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+from puzzle_editing import status
+
+
+def backfill_status_changes(apps, schema_editor):
+    # the same as manage.py backfill_status_changes, on the historical models
+    PuzzleComment = apps.get_model('puzzle_editing', 'PuzzleComment')
+    StatusChange = apps.get_model('puzzle_editing', 'StatusChange')
+
+    displays = {status.get_display(st): st for st in status.STATUSES}
+    current = {}
+    changes = []
+    for puzzle_id, author_id, content, status_change, date in (
+        PuzzleComment.objects.order_by('date', 'id')
+        .values_list('puzzle_id', 'author_id', 'content', 'status_change', 'date')
+        .iterator()
+    ):
+        if status_change:
+            new_status = status_change
+        elif content == 'Created puzzle':
+            new_status = status.INITIAL_IDEA
+        elif content.startswith('Status changed to '):
+            new_status = displays.get(content[len('Status changed to '):])
+        else:
+            new_status = None
+        if new_status is None:
+            continue
+        changes.append(
+            StatusChange(
+                puzzle_id=puzzle_id,
+                from_status=current.get(puzzle_id, ''),
+                to_status=new_status,
+                date=date,
+                user_id=author_id,
+            )
+        )
+        current[puzzle_id] = new_status
+    StatusChange.objects.bulk_create(changes, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('puzzle_editing', '0009_email_digests'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatusChange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('from_status', models.CharField(blank=True, choices=[('II', 'Initial Idea'), ('AE', 'Awaiting Editor'), ('AR', 'Awaiting Review'), ('ID', 'Idea in Development'), ('IA', 'Idea in Development (Answer Assigned)'), ('AA', 'Awaiting Answer'), ('W', 'Writing (Answer Assigned)'), ('WF', 'Writing (Answer Flexible)'), ('AT', 'Awaiting Approval for Testsolving'), ('T', 'Testsolving'), ('R', 'Revising (Needs Testsolving)'), ('RP', 'Revising (Done with Testsolving)'), ('AO', 'Awaiting Approval (Done with Testsolving)'), ('NS', 'Needs Solution'), ('AS', 'Awaiting Solution Approval'), ('NP', 'Needs Post Production'), ('AP', 'Awaiting Postprod Approval'), ('NF', 'Needs Factcheck'), ('NR', 'Needs Final Revisions'), ('NC', 'Needs Copy Edits'), ('NH', 'Needs Hints'), ('AH', 'Awaiting Hints Approval'), ('D', 'Done'), ('DF', 'Deferred'), ('X', 'Dead')], max_length=2)),
+                ('to_status', models.CharField(choices=[('II', 'Initial Idea'), ('AE', 'Awaiting Editor'), ('AR', 'Awaiting Review'), ('ID', 'Idea in Development'), ('IA', 'Idea in Development (Answer Assigned)'), ('AA', 'Awaiting Answer'), ('W', 'Writing (Answer Assigned)'), ('WF', 'Writing (Answer Flexible)'), ('AT', 'Awaiting Approval for Testsolving'), ('T', 'Testsolving'), ('R', 'Revising (Needs Testsolving)'), ('RP', 'Revising (Done with Testsolving)'), ('AO', 'Awaiting Approval (Done with Testsolving)'), ('NS', 'Needs Solution'), ('AS', 'Awaiting Solution Approval'), ('NP', 'Needs Post Production'), ('AP', 'Awaiting Postprod Approval'), ('NF', 'Needs Factcheck'), ('NR', 'Needs Final Revisions'), ('NC', 'Needs Copy Edits'), ('NH', 'Needs Hints'), ('AH', 'Awaiting Hints Approval'), ('D', 'Done'), ('DF', 'Deferred'), ('X', 'Dead')], max_length=2)),
+                ('date', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('puzzle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='status_changes', to='puzzle_editing.puzzle')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='status_changes', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='statuschange',
+            index=models.Index(fields=['puzzle', 'date'], name='puzzle_edit_puzzle__ced716_idx'),
+        ),
+        migrations.RunPython(backfill_status_changes, migrations.RunPython.noop),
+    ]
@@ -1,3 +1,7 @@
+import functools
+import operator
+import threading
+import time
 from enum import Enum
 
 import django.urls as urls
@@ -5,10 +9,21 @@ from django import forms
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import FileExtensionValidator
 from django.core.validators import RegexValidator
+from django.db import connection
 from django.db import models
+from django.db import transaction
 from django.db.models import Avg
+from django.db.models import Count
 from django.db.models import Exists
+from django.db.models import Max
 from django.db.models import OuterRef
+from django.db.models import Q
+from django.db.models import Value
+from django.db.models.signals import m2m_changed
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_migrate
+from django.db.models.signals import post_save
+from django.db.models.signals import pre_delete
 from django.db.models.signals import pre_save
 from django.dispatch import receiver
 from django.utils import timezone
@@ -17,9 +32,136 @@ from django.utils.html import format_html_join
 from django.utils.html import mark_safe
 
 import puzzle_editing.status as status
+from puzzle_editing.rendering import cached_render_markdown
+from puzzle_editing.rendering import render_markdown
+from puzzle_editing.rendering import RENDERER_VERSION
 
 
-class User(AbstractUser):
+class MarkdownFieldsMixin:
+    """For models with fields that hold markdown. Keeps the sanitized HTML
+    of each field named in markdown_fields in a `<field>_html` field, and the
+    RENDERER_VERSION it was rendered with in `markdown_version`, so pages can
+    show them without running markdown. Models using this must declare
+    those fields.
+
+    Saving only re-renders the fields whose markdown changed since the
+    object was loaded, unless it was rendered with an older RENDERER_VERSION.
+    bulk_create and bulk_update skip save(), so objects written that way are
+    rendered on display until `manage.py rerender_markdown` catches up."""
+
+    markdown_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_markdown_sources()
+        return instance
+
+    def remember_markdown_sources(self, fields=None):
+        deferred = self.get_deferred_fields()
+        if not hasattr(self, "_markdown_sources"):
+            self._markdown_sources = {}
+        for field in self.markdown_fields:
+            if field not in deferred and (fields is None or field in fields):
+                self._markdown_sources[field] = getattr(self, field)
+
+    def stale_markdown_fields(self):
+        """The markdown fields whose HTML needs rendering: the ones that
+        changed, or all of them for new objects or an old renderer."""
+
+        sources = getattr(self, "_markdown_sources", None)
+        if sources is None or self.markdown_version != RENDERER_VERSION:
+            return list(self.markdown_fields)
+        return [
+            field
+            for field in self.markdown_fields
+            if field in sources and sources[field] != getattr(self, field)
+        ]
+
+    def render_markdown_fields(self, fields=None):
+        for field in self.markdown_fields if fields is None else fields:
+            setattr(self, field + "_html", render_markdown(getattr(self, field)))
+        self.markdown_version = RENDERER_VERSION
+
+    def rendered_markdown(self, field):
+        if self.markdown_version == RENDERER_VERSION:
+            return getattr(self, field + "_html")
+        return cached_render_markdown(getattr(self, field))
+
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using=using, fields=fields)
+        self.remember_markdown_sources(fields)
+
+    def save(self, *args, update_fields=None, **kwargs):
+        stale = self.stale_markdown_fields()
+        if update_fields is not None:
+            if not set(update_fields) & set(self.markdown_fields):
+                stale = []
+            elif self.markdown_version == RENDERER_VERSION:
+                stale = [field for field in stale if field in update_fields]
+        if stale:
+            self.render_markdown_fields(stale)
+            if update_fields is not None:
+                update_fields = set(update_fields) | {"markdown_version"}
+                update_fields |= {field + "_html" for field in stale}
+        super().save(*args, update_fields=update_fields, **kwargs)
+        self.remember_markdown_sources(update_fields)
+
+
+def markdown_html_field():
+    return models.TextField(blank=True, editable=False)
+
+
+def markdown_version_field():
+    return models.CharField(max_length=16, blank=True, editable=False)
+
+
+class TrackedFieldsMixin:
+    """Remembers the values the fields named in tracked_fields had when the
+    object was loaded from (or last saved to) the database, so changes to
+    them can be noticed without querying it again."""
+
+    tracked_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_tracked_fields()
+        return instance
+
+    def remember_tracked_fields(self, fields=None):
+        # deferred fields weren't loaded, so there's nothing to remember
+        deferred = self.get_deferred_fields()
+        if not hasattr(self, "_tracked_values"):
+            self._tracked_values = {}
+        for field in fields or self.tracked_fields:
+            if field in self.tracked_fields and field not in deferred:
+                self._tracked_values[field] = getattr(self, field)
+
+    def has_changed(self, field):
+        """Whether `field` differs from the database. Objects that were never
+        saved haven't changed."""
+
+        values = getattr(self, "_tracked_values", {})
+        return field in values and values[field] != getattr(self, field)
+
+    def original_value(self, field):
+        """The value `field` had in the database, or None if unknown."""
+
+        return getattr(self, "_tracked_values", {}).get(field)
+
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using=using, fields=fields)
+        self.remember_tracked_fields(fields)
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self.remember_tracked_fields()
+
+
+class User(MarkdownFieldsMixin, AbstractUser):
+    markdown_fields = ("bio",)
+
     display_name = models.CharField(max_length=500, blank=True)
     discord_username = models.CharField(
         max_length=500,
@@ -35,6 +177,19 @@ class User(AbstractUser):
         help_text="Tell us about yourself. What kinds of puzzle genres or subject matter do you like?",
     )
     enable_keyboard_shortcuts = models.BooleanField(default=False)
+    email_digest_minutes = models.PositiveIntegerField(
+        choices=(
+            (0, "Immediately"),
+            (15, "Every 15 minutes"),
+            (60, "Every hour"),
+            (240, "Every 4 hours"),
+            (1440, "Once a day"),
+        ),
+        default=0,
+        help_text="How often to email you about new comments. Comments on the same puzzle are collected into one email.",
+    )
+    bio_html = markdown_html_field()
+    markdown_version = markdown_version_field()
 
     @staticmethod
     def display_name_of(user):
@@ -114,11 +269,15 @@ class PuzzleAnswer(models.Model):
         return "{} (Round: {})".format(self.answer, self.round.name)
 
 
-class PuzzleTag(models.Model):
+class PuzzleTag(MarkdownFieldsMixin, models.Model):
     """A tag to classify puzzles."""
 
+    markdown_fields = ("description",)
+
     name = models.CharField(max_length=500)
     description = models.TextField(blank=True)
+    description_html = markdown_html_field()
+    markdown_version = markdown_version_field()
     important = models.BooleanField(
         default=False,
         help_text="Important tags are displayed prominently with the puzzle title.",
@@ -128,9 +287,45 @@ class PuzzleTag(models.Model):
         return "Tag: {}".format(self.name)
 
 
-class Puzzle(models.Model):
+class PuzzleQuerySet(models.QuerySet):
+    def bulk_update(self, objs, fields, *args, refresh_list_rows=True, **kwargs):
+        """Like QuerySet.bulk_update, but also does what saving each puzzle
+        would: bumps status_mtime and records a StatusChange when the status
+        changed, and refreshes the puzzles' list rows (unless the caller is
+        going to do that itself)."""
+
+        objs = list(objs)
+        fields = list(fields)
+        changes = []
+        if "status" in fields:
+            now = timezone.now()
+            for puzzle in objs:
+                if puzzle.has_changed("status"):
+                    puzzle.status_mtime = now
+                    changes.append(StatusChange.for_puzzle(puzzle))
+            if "status_mtime" not in fields:
+                fields.append("status_mtime")
+        rows = super().bulk_update(objs, fields, *args, **kwargs)
+        StatusChange.objects.bulk_create(changes)
+        for puzzle in objs:
+            puzzle.remember_tracked_fields()
+        # rendering markdown doesn't change anything lists show
+        if refresh_list_rows and any(
+            not field.endswith("_html") and field != "markdown_version"
+            for field in fields
+        ):
+            refresh_puzzle_list_rows(puzzle.id for puzzle in objs)
+        return rows
+
+
+class Puzzle(TrackedFieldsMixin, MarkdownFieldsMixin, models.Model):
     """A puzzle, that which Puzzlord keeps track of the writing process of."""
 
+    objects = PuzzleQuerySet.as_manager()
+
+    markdown_fields = ("summary", "description", "notes", "content", "solution")
+    tracked_fields = ("status",)
+
     name = models.CharField(max_length=500)
     codename = models.CharField(
         max_length=500,
@@ -206,6 +401,12 @@ class Puzzle(models.Model):
     )
     status_mtime = models.DateTimeField(editable=False)
 
+    def save(self, *args, update_fields=None, **kwargs):
+        # set_status_mtime bumps status_mtime along with the status
+        if update_fields is not None and "status" in update_fields:
+            update_fields = set(update_fields) | {"status_mtime"}
+        super().save(*args, update_fields=update_fields, **kwargs)
+
     def get_status_rank(self):
         return status.get_status_rank(self.status)
 
@@ -252,6 +453,13 @@ class Puzzle(models.Model):
     )
     solution = models.TextField(blank=True)
 
+    summary_html = markdown_html_field()
+    description_html = markdown_html_field()
+    notes_html = markdown_html_field()
+    content_html = markdown_html_field()
+    solution_html = markdown_html_field()
+    markdown_version = markdown_version_field()
+
     def get_emails(self, exclude_emails=()):
         emails = set(self.authors.values_list("email", flat=True))
         emails |= set(self.editors.values_list("email", flat=True))
@@ -276,18 +484,76 @@ class Puzzle(models.Model):
         return self.hints.order_by("order")
 
     def has_answer(self):
-        return self.answers.count() > 0
+        if hasattr(self, "prefetched_has_answer"):
+            return self.prefetched_has_answer
+        return self.answers.exists()
 
 
 @receiver(pre_save, sender=Puzzle)
 def set_status_mtime(sender, instance, **kwargs):
-    try:
-        obj = sender.objects.get(pk=instance.pk)
-    except sender.DoesNotExist:
-        pass  # Object is new
-    else:
-        if obj.status != instance.status:  # Field has changed
-            instance.status_mtime = timezone.now()
+    if instance.has_changed("status"):
+        instance.status_mtime = timezone.now()
+
+
+class StatusChange(models.Model):
+    """A puzzle moving from one status to another.
+
+    Written whenever a puzzle is created or its status is saved, so status
+    history doesn't have to be pieced together from comments. To record who
+    made the change, set `changed_by` on the puzzle before saving it."""
+
+    puzzle = models.ForeignKey(
+        Puzzle, on_delete=models.CASCADE, related_name="status_changes"
+    )
+    # blank when the puzzle was created with to_status
+    from_status = models.CharField(
+        max_length=status.MAX_LENGTH,
+        choices=status.DESCRIPTIONS.items(),
+        blank=True,
+    )
+    to_status = models.CharField(
+        max_length=status.MAX_LENGTH,
+        choices=status.DESCRIPTIONS.items(),
+    )
+    date = models.DateTimeField(default=timezone.now, db_index=True)
+    user = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="status_changes",
+    )
+
+    class Meta:
+        indexes = [models.Index(fields=["puzzle", "date"])]
+
+    def __str__(self):
+        return "{} went from {} to {}".format(
+            self.puzzle_id,
+            status.get_display(self.from_status) if self.from_status else "nothing",
+            status.get_display(self.to_status),
+        )
+
+    @classmethod
+    def for_puzzle(cls, puzzle, created=False):
+        return cls(
+            puzzle=puzzle,
+            from_status="" if created else puzzle.original_value("status") or "",
+            to_status=puzzle.status,
+            date=timezone.now() if created else puzzle.status_mtime,
+            user=getattr(puzzle, "changed_by", None),
+        )
+
+
+@receiver(post_save, sender=Puzzle)
+def record_status_change(sender, instance, created, update_fields, **kwargs):
+    # save() hasn't forgotten the old status yet
+    if created:
+        StatusChange.for_puzzle(instance, created=True).save()
+    elif instance.has_changed("status") and (
+        update_fields is None or "status" in update_fields
+    ):
+        StatusChange.for_puzzle(instance).save()
 
 
 def get_location_for_upload(instance, filename):
@@ -358,11 +624,168 @@ class PuzzleVisited(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     date = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["puzzle", "user"], name="unique_puzzle_visit"
+            )
+        ]
+
     def __str__(self):
         return "{} visited {}".format(self.user.username, self.puzzle)
 
 
-class TestsolveSession(models.Model):
+class UnreadPuzzle(models.Model):
+    """A puzzle a user is spoiled on and hasn't seen the latest comments on
+    (or hasn't visited at all).
+
+    Kept up to date by signals below and by flush_visits, so that finding a
+    user's unread puzzles doesn't need to compare every spoiled puzzle's
+    comments with the user's visits."""
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="unread")
+    puzzle = models.ForeignKey(
+        Puzzle, on_delete=models.CASCADE, related_name="unread_entries"
+    )
+    # when the puzzle became unread, i.e. the date of the latest unseen
+    # comment; a visit at or after this date marks the puzzle read
+    date = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "puzzle"], name="unique_unread_puzzle"
+            )
+        ]
+
+    def __str__(self):
+        return "{} has unread comments on {}".format(self.user.username, self.puzzle)
+
+
+# Visits waiting to be written, as {(puzzle_id, user_id): date}. Writing a
+# visit on every puzzle page view would take the (SQLite) database's write
+# lock on what is otherwise a read-only page, so visits are buffered here
+# and written in one statement by flush_visits, once enough have piled up or
+# the oldest has waited long enough (see visits_due).
+_pending_visits = {}
+_pending_visits_since = None
+_pending_visits_lock = threading.Lock()
+
+FLUSH_VISITS_AT = 100
+FLUSH_VISITS_AFTER = 5  # seconds
+
+
+def record_visit(puzzle, user):
+    """Note that the user just looked at the puzzle. Written to the database
+    by a later flush_visits, which VisitFlushMiddleware calls (right after
+    the response, if the puzzle was unread; see puzzle_was_unread)."""
+
+    global _pending_visits_since
+    with _pending_visits_lock:
+        if not _pending_visits:
+            _pending_visits_since = time.monotonic()
+        _pending_visits[(puzzle.id, user.id)] = timezone.now()
+
+
+def visits_due():
+    """Whether the buffered visits should be written now."""
+
+    with _pending_visits_lock:
+        return bool(_pending_visits) and (
+            len(_pending_visits) >= FLUSH_VISITS_AT
+            or time.monotonic() - _pending_visits_since >= FLUSH_VISITS_AFTER
+        )
+
+
+def flush_visits(user=None):
+    """Write all buffered visits, or only `user`'s, with a single upsert. If
+    that fails (say, because SQLite is locked), they're put back for the next
+    flush and the error is raised."""
+
+    global _pending_visits_since
+    with _pending_visits_lock:
+        if user is None:
+            visits = dict(_pending_visits)
+            _pending_visits.clear()
+        else:
+            visits = {
+                key: _pending_visits.pop(key)
+                for key in list(_pending_visits)
+                if key[1] == user.id
+            }
+    if not visits:
+        return
+
+    try:
+        with transaction.atomic():
+            write_visits(visits)
+    except Exception:
+        with _pending_visits_lock:
+            if not _pending_visits:
+                _pending_visits_since = time.monotonic()
+            for key, date in visits.items():
+                # unless they've visited again since
+                if _pending_visits.get(key, date) <= date:
+                    _pending_visits[key] = date
+        raise
+
+
+def write_visits(visits):
+    # the puzzle may have been deleted since
+    live_puzzle_ids = set(
+        Puzzle.objects.filter(
+            id__in={puzzle_id for puzzle_id, _ in visits}
+        ).values_list("id", flat=True)
+    )
+    visits = {key: date for key, date in visits.items() if key[0] in live_puzzle_ids}
+    if not visits:
+        return
+
+    if connection.vendor not in ("sqlite", "postgresql"):
+        for (puzzle_id, user_id), date in visits.items():
+            visit, created = PuzzleVisited.objects.get_or_create(
+                puzzle_id=puzzle_id, user_id=user_id
+            )
+            # date is auto_now, so save() would set it to now rather than to
+            # when they visited
+            if created or visit.date < date:
+                PuzzleVisited.objects.filter(id=visit.id).update(date=date)
+        mark_visits_read(visits)
+        return
+
+    qn = connection.ops.quote_name
+    table = qn(PuzzleVisited._meta.db_table)
+    puzzle_column = qn(PuzzleVisited._meta.get_field("puzzle").column)
+    user_column = qn(PuzzleVisited._meta.get_field("user").column)
+    date_column = qn(PuzzleVisited._meta.get_field("date").column)
+    params = []
+    for (puzzle_id, user_id), date in visits.items():
+        params += [puzzle_id, user_id, connection.ops.adapt_datetimefield_value(date)]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} ({puzzle_column}, {user_column}, {date_column}) "
+            f"VALUES {', '.join(['(%s, %s, %s)'] * len(visits))} "
+            f"ON CONFLICT ({puzzle_column}, {user_column}) "
+            f"DO UPDATE SET {date_column} = excluded.{date_column} "
+            f"WHERE excluded.{date_column} > {table}.{date_column}",
+            params,
+        )
+    mark_visits_read(visits)
+
+
+def mark_visits_read(visits):
+    UnreadPuzzle.objects.filter(
+        functools.reduce(
+            operator.or_,
+            (
+                Q(puzzle_id=puzzle_id, user_id=user_id, date__lte=date)
+                for (puzzle_id, user_id), date in visits.items()
+            ),
+        )
+    ).delete()
+
+
+class TestsolveSession(MarkdownFieldsMixin, models.Model):
     """An attempt by a group of people to testsolve a puzzle.
 
     Participants in the session will be able to make comments and see other
@@ -385,6 +808,10 @@ class TestsolveSession(models.Model):
         help_text="Link to the testsolve spreadsheet.",
     )
 
+    markdown_fields = ("notes",)
+    notes_html = markdown_html_field()
+    markdown_version = markdown_version_field()
+
     def participants(self):
         return User.objects.filter(testsolve_participations__session=self).annotate(
             current=Exists(
@@ -433,7 +860,7 @@ class TestsolveSession(models.Model):
         return "Testsolve session #{} on {}".format(self.id, self.puzzle)
 
 
-class PuzzleComment(models.Model):
+class PuzzleComment(MarkdownFieldsMixin, models.Model):
     """A comment on a puzzle.
 
     All comments on a puzzle are visible to people spoiled on the puzzle.
@@ -466,6 +893,10 @@ class PuzzleComment(models.Model):
         help_text="Any status change caused by this comment. Only used for recording history and computing statistics; not a source of truth (i.e. the puzzle will still store its current status, and this field's value on any comment doesn't directly imply anything about that in any technically enforced way).",
     )
 
+    markdown_fields = ("content",)
+    content_html = markdown_html_field()
+    markdown_version = markdown_version_field()
+
     def __str__(self):
         return "Comment #{} on {}".format(self.id, self.puzzle)
 
@@ -569,16 +1000,86 @@ def is_postprodder_on(user, puzzle):
 
 
 def get_user_role(user, puzzle):
-    if is_author_on(user, puzzle):
-        return "author"
-    elif is_editor_on(user, puzzle):
-        return "editor"
-    elif is_postprodder_on(user, puzzle):
-        return "postprodder"
-    elif is_factchecker_on(user, puzzle):
-        return "factchecker"
-    else:
-        return None
+    return PuzzleAccess(user, puzzle).role
+
+
+# Bits of the masks returned by get_role_bitmasks.
+ROLE_SPOILED = 1
+ROLE_AUTHOR = 2
+ROLE_EDITOR = 4
+ROLE_FACTCHECKER = 8
+ROLE_POSTPRODDER = 16
+
+
+def get_role_bitmasks(user, puzzle_ids=None):
+    """Return a dict from puzzle id to a bitmask of the user's ROLE_* roles on
+    that puzzle, in one query. Puzzles the user has no role on are omitted.
+
+    Restricted to the given puzzle ids if provided, else covers all puzzles
+    (which is faster than a huge IN clause when listing everything)."""
+
+    role_throughs = [
+        (ROLE_SPOILED, Puzzle.spoiled.through),
+        (ROLE_AUTHOR, Puzzle.authors.through),
+        (ROLE_EDITOR, Puzzle.editors.through),
+        (ROLE_FACTCHECKER, Puzzle.factcheckers.through),
+        (ROLE_POSTPRODDER, Puzzle.postprodders.through),
+    ]
+    queries = []
+    for role, through in role_throughs:
+        query = through.objects.filter(user_id=user.id)
+        if puzzle_ids is not None:
+            query = query.filter(puzzle_id__in=puzzle_ids)
+        queries.append(
+            query.annotate(role=Value(role)).values_list("puzzle_id", "role")
+        )
+
+    masks = {}
+    for puzzle_id, role in queries[0].union(*queries[1:], all=True):
+        masks[puzzle_id] = masks.get(puzzle_id, 0) | role
+    return masks
+
+
+def set_role_attributes(puzzle, mask):
+    """Set the is_<role> attributes that templates listing puzzles expect."""
+
+    puzzle.is_spoiled = bool(mask & ROLE_SPOILED)
+    puzzle.is_author = bool(mask & ROLE_AUTHOR)
+    puzzle.is_editing = bool(mask & ROLE_EDITOR)
+    puzzle.is_factchecking = bool(mask & ROLE_FACTCHECKER)
+    puzzle.is_postprodding = bool(mask & ROLE_POSTPRODDER)
+
+
+class PuzzleAccess:
+    """Everything a user is on one puzzle, loaded with one query.
+
+    Views should get this through for_request, so that every check on the
+    same puzzle while handling a request shares that query."""
+
+    def __init__(self, user, puzzle):
+        self.mask = get_role_bitmasks(user, [puzzle.id]).get(puzzle.id, 0)
+        set_role_attributes(self, self.mask)
+
+    @classmethod
+    def for_request(cls, request, puzzle):
+        memo = request.__dict__.setdefault("puzzle_access", {})
+        if puzzle.id not in memo:
+            memo[puzzle.id] = cls(request.user, puzzle)
+        return memo[puzzle.id]
+
+    @property
+    def role(self):
+        """The user's most important role, as returned by get_user_role."""
+        if self.is_author:
+            return "author"
+        elif self.is_editing:
+            return "editor"
+        elif self.is_postprodding:
+            return "postprodder"
+        elif self.is_factchecking:
+            return "factchecker"
+        else:
+            return None
 
 
 class Hint(models.Model):
@@ -635,3 +1136,332 @@ class SiteSetting(models.Model):
             return None
         except ValueError:
             return None
+
+
+class PendingNotification(models.Model):
+    """A comment a user will be emailed about in their next digest.
+
+    Only made for users with email_digest_minutes set; everyone else is
+    emailed about each comment right away."""
+
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="pending_notifications"
+    )
+    comment = models.ForeignKey(PuzzleComment, on_delete=models.CASCADE)
+    # emails are sent outside of any request, so remember where links go
+    site_url = models.CharField(max_length=200)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return "{} to hear about comment #{}".format(self.user, self.comment_id)
+
+
+class OutboundEmail(models.Model):
+    """An email waiting to be sent by the send_queued_mail command.
+
+    Emails are rendered when they're queued, so sending them needs nothing
+    but this row. Failed sends are retried with exponential backoff until
+    they've been attempted messaging.MAX_SEND_ATTEMPTS times."""
+
+    subject = models.TextField()
+    body = models.TextField()
+    html_body = models.TextField(blank=True)
+    recipients = models.JSONField(default=list)
+    created = models.DateTimeField(auto_now_add=True)
+    next_attempt = models.DateTimeField(default=timezone.now, db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    def __str__(self):
+        return "{} to {}".format(self.subject, ", ".join(self.recipients))
+
+
+class PuzzleListRow(models.Model):
+    """A denormalized snapshot of what puzzle lists show about a puzzle.
+
+    Everything here can be recomputed from other tables; it exists so that
+    listing puzzles doesn't have to join tags, authors, editors, answers and
+    comments for every row on every render. Signals below keep it up to date.
+    If you reorder statuses, run `manage.py rebuild_puzzle_list_rows` to fix
+    up status_rank."""
+
+    puzzle = models.OneToOneField(
+        Puzzle, on_delete=models.CASCADE, primary_key=True, related_name="list_row"
+    )
+    status_rank = models.IntegerField(db_index=True)
+    important_tag_names = models.JSONField(default=list)
+    # lists of [username, display_name] pairs
+    authors = models.JSONField(default=list)
+    editors = models.JSONField(default=list)
+    last_comment_date = models.DateTimeField(null=True, blank=True)
+    answer_count = models.IntegerField(default=0)
+    # unlike Puzzle.last_updated, also bumped by changes to people, tags,
+    # answers and comments
+    updated = models.DateTimeField(auto_now=True, db_index=True)
+
+    def __str__(self):
+        return "List row for {}".format(self.puzzle_id)
+
+
+def refresh_puzzle_list_rows(puzzle_ids):
+    """Recompute the PuzzleListRow of each of the given puzzles.
+
+    Takes a constant number of queries however many puzzles are passed."""
+
+    puzzle_ids = set(puzzle_ids)
+    if not puzzle_ids:
+        return
+
+    # Locking the puzzles makes concurrent refreshes of the same puzzle take
+    # turns, rather than both deleting its row and then both inserting one.
+    with transaction.atomic():
+        rows = {
+            puzzle_id: PuzzleListRow(
+                puzzle_id=puzzle_id, status_rank=status.get_status_rank(puzzle_status)
+            )
+            for puzzle_id, puzzle_status in Puzzle.objects.select_for_update()
+            .filter(id__in=puzzle_ids)
+            .order_by("id")
+            .values_list("id", "status")
+        }
+
+        for tag_name, puzzle_id in PuzzleTag.objects.filter(
+            important=True, puzzles__in=puzzle_ids
+        ).values_list("name", "puzzles"):
+            rows[puzzle_id].important_tag_names.append(tag_name)
+
+        for username, display_name, puzzle_id in User.objects.filter(
+            authored_puzzles__in=puzzle_ids
+        ).values_list("username", "display_name", "authored_puzzles"):
+            rows[puzzle_id].authors.append([username, display_name])
+
+        for username, display_name, puzzle_id in User.objects.filter(
+            editing_puzzles__in=puzzle_ids
+        ).values_list("username", "display_name", "editing_puzzles"):
+            rows[puzzle_id].editors.append([username, display_name])
+
+        for puzzle_id, last_comment_date in (
+            PuzzleComment.objects.filter(puzzle__in=puzzle_ids)
+            .values("puzzle")
+            .annotate(last_comment_date=Max("date"))
+            .values_list("puzzle", "last_comment_date")
+        ):
+            rows[puzzle_id].last_comment_date = last_comment_date
+
+        for puzzle_id, answer_count in (
+            Puzzle.answers.through.objects.filter(puzzle__in=puzzle_ids)
+            .values("puzzle")
+            .annotate(answer_count=Count("puzzleanswer"))
+            .values_list("puzzle", "answer_count")
+        ):
+            rows[puzzle_id].answer_count = answer_count
+
+        PuzzleListRow.objects.filter(puzzle__in=puzzle_ids).delete()
+        PuzzleListRow.objects.bulk_create(rows.values())
+
+
+@receiver(post_save, sender=Puzzle)
+def refresh_list_row_on_puzzle_save(sender, instance, **kwargs):
+    refresh_puzzle_list_rows([instance.pk])
+
+
+@receiver(post_save, sender=PuzzleComment)
+@receiver(post_delete, sender=PuzzleComment)
+def refresh_list_row_on_comment_change(sender, instance, **kwargs):
+    refresh_puzzle_list_rows([instance.puzzle_id])
+
+
+@receiver(m2m_changed, sender=Puzzle.authors.through)
+@receiver(m2m_changed, sender=Puzzle.editors.through)
+@receiver(m2m_changed, sender=Puzzle.tags.through)
+@receiver(m2m_changed, sender=Puzzle.answers.through)
+def refresh_list_rows_on_m2m_change(
+    sender, instance, action, reverse, pk_set, **kwargs
+):
+    if not reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            refresh_puzzle_list_rows([instance.pk])
+    elif action == "pre_clear":
+        # pk_set is None for post_clear, so remember what we're about to lose.
+        # The through model's foreign key to the other side is named after
+        # its model (user, puzzletag, puzzleanswer).
+        instance._cleared_puzzle_ids = list(
+            sender.objects.filter(
+                **{instance._meta.model_name: instance.pk}
+            ).values_list("puzzle_id", flat=True)
+        )
+    elif action == "post_clear":
+        refresh_puzzle_list_rows(getattr(instance, "_cleared_puzzle_ids", ()))
+    elif action in ("post_add", "post_remove"):
+        refresh_puzzle_list_rows(pk_set)
+
+
+@receiver(post_save, sender=PuzzleTag)
+def refresh_list_rows_on_tag_save(sender, instance, **kwargs):
+    refresh_puzzle_list_rows(instance.puzzles.values_list("id", flat=True))
+
+
+@receiver(pre_delete, sender=PuzzleTag)
+def remember_tagged_puzzles_on_tag_delete(sender, instance, **kwargs):
+    # The through rows go away with the tag, so remember which puzzles to
+    # refresh once they're gone.
+    instance._tagged_puzzle_ids = list(instance.puzzles.values_list("id", flat=True))
+
+
+@receiver(post_delete, sender=PuzzleTag)
+def refresh_list_rows_on_tag_delete(sender, instance, **kwargs):
+    refresh_puzzle_list_rows(getattr(instance, "_tagged_puzzle_ids", ()))
+
+
+@receiver(pre_delete, sender=PuzzleAnswer)
+def remember_answered_puzzles_on_answer_delete(sender, instance, **kwargs):
+    # Like tags, the through rows go away with the answer without an
+    # m2m_changed. (Rounds can't be deleted while they have answers.)
+    instance._answered_puzzle_ids = list(instance.puzzles.values_list("id", flat=True))
+
+
+@receiver(post_delete, sender=PuzzleAnswer)
+def refresh_list_rows_on_answer_delete(sender, instance, **kwargs):
+    refresh_puzzle_list_rows(getattr(instance, "_answered_puzzle_ids", ()))
+
+
+@receiver(post_save, sender=User)
+def refresh_list_rows_on_user_save(sender, instance, update_fields, **kwargs):
+    # Logging in saves last_login and nothing else; don't bother then.
+    if update_fields and not {"username", "display_name"} & set(update_fields):
+        return
+    refresh_puzzle_list_rows(
+        Puzzle.objects.filter(Q(authors=instance) | Q(editors=instance)).values_list(
+            "id", flat=True
+        )
+    )
+
+
+def refresh_unread_puzzles(puzzle_ids, user_ids):
+    """Recompute which of the given puzzles each of the given users has
+    unread comments on, from their comments and visits.
+
+    Takes a constant number of queries however many are passed."""
+
+    puzzle_ids = set(puzzle_ids)
+    user_ids = set(user_ids)
+    if not puzzle_ids or not user_ids:
+        return
+
+    spoiled = Puzzle.spoiled.through.objects.filter(
+        puzzle_id__in=puzzle_ids, user_id__in=user_ids
+    ).values_list("puzzle_id", "user_id")
+    visits = {
+        (puzzle_id, user_id): date
+        for puzzle_id, user_id, date in PuzzleVisited.objects.filter(
+            puzzle_id__in=puzzle_ids, user_id__in=user_ids
+        ).values_list("puzzle_id", "user_id", "date")
+    }
+    last_comment_dates = dict(
+        PuzzleComment.objects.filter(puzzle_id__in=puzzle_ids)
+        .values("puzzle")
+        .annotate(last_comment_date=Max("date"))
+        .values_list("puzzle", "last_comment_date")
+    )
+
+    now = timezone.now()
+    unread = []
+    for puzzle_id, user_id in spoiled:
+        visited = visits.get((puzzle_id, user_id))
+        last_comment_date = last_comment_dates.get(puzzle_id)
+        if visited is None:
+            date = last_comment_date or now
+        elif last_comment_date and last_comment_date > visited:
+            date = last_comment_date
+        else:
+            continue
+        unread.append(UnreadPuzzle(puzzle_id=puzzle_id, user_id=user_id, date=date))
+
+    with transaction.atomic():
+        UnreadPuzzle.objects.filter(
+            puzzle_id__in=puzzle_ids, user_id__in=user_ids
+        ).delete()
+        UnreadPuzzle.objects.bulk_create(unread)
+
+
+@receiver(post_save, sender=PuzzleComment)
+def mark_unread_on_comment(sender, instance, created, **kwargs):
+    if not created:
+        return
+    # the author has seen their own comment
+    reader_ids = list(
+        Puzzle.spoiled.through.objects.filter(puzzle_id=instance.puzzle_id)
+        .exclude(user_id=instance.author_id)
+        .values_list("user_id", flat=True)
+    )
+    UnreadPuzzle.objects.filter(
+        puzzle_id=instance.puzzle_id, user_id__in=reader_ids
+    ).update(date=instance.date)
+    UnreadPuzzle.objects.bulk_create(
+        [
+            UnreadPuzzle(
+                puzzle_id=instance.puzzle_id, user_id=user_id, date=instance.date
+            )
+            for user_id in reader_ids
+        ],
+        ignore_conflicts=True,
+    )
+
+
+@receiver(m2m_changed, sender=Puzzle.spoiled.through)
+def update_unread_on_spoil(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse:
+        # instance is a User and pk_set holds puzzle ids
+        entries = UnreadPuzzle.objects.filter(user=instance)
+        if action == "post_add":
+            refresh_unread_puzzles(pk_set, [instance.pk])
+        elif action == "post_remove":
+            entries.filter(puzzle_id__in=pk_set).delete()
+        elif action == "post_clear":
+            entries.delete()
+    else:
+        entries = UnreadPuzzle.objects.filter(puzzle=instance)
+        if action == "post_add":
+            refresh_unread_puzzles([instance.pk], pk_set)
+        elif action == "post_remove":
+            entries.filter(user_id__in=pk_set).delete()
+        elif action == "post_clear":
+            entries.delete()
+
+
+MARKDOWN_MODELS = [User, Puzzle, PuzzleTag, TestsolveSession, PuzzleComment]
+
+
+def rerender_markdown(force=False, batch_size=500):
+    """Re-render the stored HTML of every object rendered with an old
+    RENDERER_VERSION (or of every object, if force is set). Returns how many
+    objects were re-rendered."""
+
+    count = 0
+    for model in MARKDOWN_MODELS:
+        stale = model.objects.all()
+        if not force:
+            stale = stale.exclude(markdown_version=RENDERER_VERSION)
+        ids = list(stale.order_by("pk").values_list("pk", flat=True))
+        html_fields = [field + "_html" for field in model.markdown_fields]
+        for i in range(0, len(ids), batch_size):
+            objects = list(
+                model.objects.filter(pk__in=ids[i : i + batch_size]).only(
+                    *model.markdown_fields
+                )
+            )
+            for obj in objects:
+                obj.render_markdown_fields()
+            model.objects.bulk_update(objects, html_fields + ["markdown_version"])
+            count += len(objects)
+    return count
+
+
+@receiver(post_migrate)
+def rerender_markdown_after_migrate(sender, apps, **kwargs):
+    if sender.name != "puzzle_editing":
+        return
+    # not if we've just migrated back to before the rendered fields existed
+    fields = apps.get_model("puzzle_editing", "PuzzleComment")._meta.get_fields()
+    if any(field.name == "markdown_version" for field in fields):
+        rerender_markdown()
@@ -0,0 +1,126 @@
+import functools
+import re
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+from django import template
+from django.db import connection
+
+# Query budgets are only checked inside enforce_query_budgets(), which the
+# test suite uses; everywhere else the decorator costs one attribute lookup.
+_state = threading.local()
+
+
+def query_budget(max_queries):
+    """Declare that a view or template tag makes at most `max_queries` SQL
+    queries when run against the dataset in tests.QueryBudgets.
+
+    Tags called while rendering a view count towards the view's budget as
+    well as their own. Inclusion tags registered with a BudgetedLibrary are
+    charged for rendering their templates too. Streaming responses are only
+    charged for the queries made before the response is returned."""
+
+    def decorator(func):
+        name = "{}.{}".format(func.__module__, func.__name__)
+        wrapper = functools.wraps(func)(checked(name, max_queries, func))
+        wrapper.query_budget = max_queries
+        wrapper.query_budget_name = name
+        return wrapper
+
+    return decorator
+
+
+def checked(name, max_queries, func):
+    """Wrap func so that calls inside enforce_query_budgets() check that it
+    makes at most `max_queries` queries, reporting them as `name`."""
+
+    def wrapper(*args, **kwargs):
+        violations = getattr(_state, "violations", None)
+        if violations is None:
+            return func(*args, **kwargs)
+
+        queries = []
+
+        def record(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(record):
+            result = func(*args, **kwargs)
+        if len(queries) > max_queries:
+            violations.append(describe_violation(name, max_queries, queries))
+        return result
+
+    return wrapper
+
+
+class BudgetedLibrary(template.Library):
+    """A template Library whose inclusion tags' query_budgets cover
+    rendering their templates as well as building their context, since
+    that's where lazy querysets and related lookups make their queries."""
+
+    def inclusion_tag(self, filename, func=None, takes_context=None, name=None):
+        register = super().inclusion_tag(filename, None, takes_context, name)
+
+        def dec(func):
+            if not hasattr(func, "query_budget"):
+                return register(func)
+            # check the whole node's render instead of just the function
+            register(func.__wrapped__)
+            tag_name = name or func.__name__
+            compile_func = self.tags[tag_name]
+
+            @functools.wraps(compile_func)
+            def compile_budgeted(parser, token):
+                node = compile_func(parser, token)
+                node.render = checked(
+                    func.query_budget_name, func.query_budget, node.render
+                )
+                return node
+
+            self.tags[tag_name] = compile_budgeted
+            return func
+
+        if func:
+            return dec(func)
+        return dec
+
+
+def normalize_sql(sql):
+    # make queries that only differ in how many ids they look up the same
+    return re.sub(r"\((?:%s, )+%s\)", "(%s, ...)", sql)
+
+
+def describe_violation(name, max_queries, queries):
+    lines = [
+        "{} made {} queries, over its budget of {}:".format(
+            name, len(queries), max_queries
+        )
+    ]
+    # the queries past the budget, diff-style
+    for i, sql in enumerate(queries):
+        lines.append("{} {:>3}. {}".format("+" if i >= max_queries else " ", i, sql))
+    repeated = [
+        (count, sql)
+        for sql, count in Counter(map(normalize_sql, queries)).most_common()
+        if count > 1
+    ]
+    if repeated:
+        lines.append("Repeated queries (N+1s?):")
+        lines.extend("  {:>3}x {}".format(count, sql) for count, sql in repeated)
+    return "\n".join(lines)
+
+
+@contextmanager
+def enforce_query_budgets():
+    """Check every query_budget called inside this block, yielding a list
+    that collects a description of each budget that was exceeded."""
+
+    violations = []
+    previous = getattr(_state, "violations", None)
+    _state.violations = violations
+    try:
+        yield violations
+    finally:
+        _state.violations = previous
@@ -0,0 +1,122 @@
+import collections
+import hashlib
+import threading
+
+import bleach
+import markdown as markdown_module
+from bleach import Cleaner
+from bleach.linkifier import LinkifyFilter
+from markdown import markdown as convert_markdown
+
+SAFE_TAGS = [
+    "a",
+    "abbr",
+    "acronym",
+    "b",
+    "big",
+    "blockquote",
+    "br",
+    "cite",
+    "code",
+    "dd",
+    "del",
+    "div",
+    "dl",
+    "dt",
+    "em",
+    "h1",
+    "h2",
+    "h3",
+    "h4",
+    "h5",
+    "h6",
+    "hr",
+    "i",
+    "img",
+    "ins",
+    "li",
+    "ol",
+    "p",
+    "pre",
+    "q",
+    "s",
+    "small",
+    "span",
+    "sub",
+    "sup",
+    "strike",
+    "strong",
+    "table",
+    "tbody",
+    "td",
+    "th",
+    "thead",
+    "tfoot",
+    "tr",
+    "u",
+    "ul",
+]
+
+EXTENSIONS = ["extra"]
+
+# LinkifyFilter converts raw URLs in text into links
+cleaner = Cleaner(tags=SAFE_TAGS, filters=[LinkifyFilter])
+
+# Identifies everything that affects the output of render_markdown. Stored
+# next to pre-rendered HTML; if it changes, `manage.py rerender_markdown`
+# (which also runs after every migrate) renders everything again.
+RENDERER_VERSION = hashlib.sha1(
+    repr(
+        (SAFE_TAGS, EXTENSIONS, markdown_module.__version__, bleach.__version__)
+    ).encode()
+).hexdigest()[:16]
+
+
+def render_markdown(text):
+    """Markdown to sanitized HTML, as a plain string."""
+    return cleaner.clean(convert_markdown(text, extensions=EXTENSIONS))
+
+
+class RenderCache:
+    """A bounded, thread-safe LRU cache of render_markdown results, keyed by
+    a hash of the text and RENDERER_VERSION."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, text):
+        key = hashlib.sha1("{}\0{}".format(RENDERER_VERSION, text).encode()).digest()
+        with self.lock:
+            html = self.entries.get(key)
+            if html is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return html
+            self.misses += 1
+        # render outside the lock; at worst two threads render the same text
+        html = render_markdown(text)
+        with self.lock:
+            self.entries[key] = html
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return html
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+render_cache = RenderCache(maxsize=2000)
+
+
+def cached_render_markdown(text):
+    """render_markdown for text that isn't stored pre-rendered, like markdown
+    previews and fields of models without MarkdownFieldsMixin."""
+    return render_cache.render(text)
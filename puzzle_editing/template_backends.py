@@ -0,0 +1,40 @@
+import time
+
+from django.template.backends.django import DjangoTemplates
+
+from puzzle_editing.middleware import current_stats
+
+
+class TimedTemplate:
+    def __init__(self, template):
+        self.template = template
+
+    @property
+    def origin(self):
+        return self.template.origin
+
+    def render(self, context=None, request=None):
+        stats = current_stats()
+        if stats is None:
+            return self.template.render(context, request)
+        # templates rendered while rendering another one (e.g. cached
+        # fragments) are already part of the outer template's time
+        stats.template_depth += 1
+        start = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            stats.template_depth -= 1
+            if not stats.template_depth:
+                stats.template_seconds += time.perf_counter() - start
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, but reporting how long rendering takes to
+    RequestTimingMiddleware."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
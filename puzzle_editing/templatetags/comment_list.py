@@ -1,23 +1,61 @@
+import base64
 import datetime
+import json
 
-from django import template
+from django.db.models import Q
 
 import puzzle_editing.status as status
 from puzzle_editing.models import CommentReaction
+from puzzle_editing.query_budget import BudgetedLibrary
+from puzzle_editing.query_budget import query_budget
 
-register = template.Library()
+register = BudgetedLibrary()
 
+# Comment threads only render their newest comments; older ones are fetched
+# a page at a time by the "Load older comments" link.
+COMMENT_PAGE_SIZE = 50
 
-@register.inclusion_tag("tags/comment_list.html")
-def comment_list(
-    user,
-    puzzle,
-    comments,
-    comment_form,
-    show_testsolve_session_links,
-    allow_status_changes,
-):
-    comments = comments.order_by("date").select_related("author")
+
+def make_comment_cursor(comment):
+    return (
+        base64.urlsafe_b64encode(
+            json.dumps([comment.date.isoformat(), comment.id]).encode()
+        )
+        .decode()
+        .rstrip("=")
+    )
+
+
+def parse_comment_cursor(cursor):
+    """Return the (date, id) a cursor points before, or None if invalid."""
+
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        date, comment_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.datetime.fromisoformat(date), int(comment_id)
+    except (ValueError, TypeError):  # not worth crashing over
+        return None
+
+
+def load_comment_page(user, puzzle, comments, before=None, limit=COMMENT_PAGE_SIZE):
+    """Fetch the newest `limit` comments, or the newest ones strictly before
+    the cursor `before`, decorated with what tags/comment_rows.html displays.
+
+    Returns the comments oldest first, and a cursor for the page before them
+    if there is one."""
+
+    comments = comments.order_by("-date", "-id").select_related("author")
+    position = before and parse_comment_cursor(before)
+    if position:
+        date, comment_id = position
+        comments = comments.filter(Q(date__lt=date) | Q(date=date, id__lt=comment_id))
+    # fetch one extra to find out whether there's an older page
+    comments = list(comments[: limit + 1])
+    older = None
+    if len(comments) > limit:
+        comments = comments[:limit]
+        older = make_comment_cursor(comments[-1])
+    comments.reverse()
 
     authors = set(puzzle.authors.values_list("id", flat=True))
 
@@ -42,10 +80,31 @@ def comment_list(
             mr[reaction.emoji] = []
         mr[reaction.emoji].append(reaction.reactor.username)
 
+    return comments, older
+
+
+@register.inclusion_tag("tags/comment_list.html")
+@query_budget(3)
+def comment_list(
+    user,
+    puzzle,
+    comments,
+    comment_form,
+    show_testsolve_session_links,
+    allow_status_changes,
+    older_comments_url,
+):
+    """Show the newest page of a comment thread. `older_comments_url` is the
+    view that returns earlier pages, given a ?before= cursor."""
+
+    comments, older = load_comment_page(user, puzzle, comments)
+
     return {
         "username": user.username,
         "puzzle": puzzle,
         "comments": comments,
+        "older_comments_url": older_comments_url,
+        "older_cursor": older,
         "comment_form": comment_form,
         "show_testsolve_session_links": show_testsolve_session_links,
         "allow_status_changes": allow_status_changes,
@@ -1,9 +1,11 @@
 import datetime
 
-from django import template
 from django.conf import settings
 
-register = template.Library()
+from puzzle_editing.query_budget import BudgetedLibrary
+from puzzle_editing.query_budget import query_budget
+
+register = BudgetedLibrary()
 
 
 def display_timedelta(delta):
@@ -21,6 +23,7 @@ def display_timedelta(delta):
 
 
 @register.inclusion_tag("tags/countdown.html")
+@query_budget(0)
 def countdown():
     delta = settings.HUNT_TIME - datetime.datetime.now(datetime.timezone.utc)
     countdown = delta >= datetime.timedelta(0)
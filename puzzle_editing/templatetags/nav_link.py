@@ -1,10 +1,13 @@
 import django.urls as urls
-from django import template
 
-register = template.Library()
+from puzzle_editing.query_budget import BudgetedLibrary
+from puzzle_editing.query_budget import query_budget
+
+register = BudgetedLibrary()
 
 
 @register.inclusion_tag("tags/nav_link.html")
+@query_budget(0)
 def nav_link(current_path, url_name, text):
     url = urls.reverse(url_name)
 
@@ -1,137 +1,422 @@
-import random
+import base64
+import datetime
+import hashlib
+import json
 
 from django import template
+from django.core.cache import cache
+from django.db.models import DateTimeField
 from django.db.models import Exists
-from django.db.models import Max
+from django.db.models import F
 from django.db.models import OuterRef
-from django.db.models import Prefetch
+from django.db.models import Q
 from django.db.models import Subquery
+from django.db.models import Value
+from django.db.models.functions import Coalesce
+from django.template.loader import get_template
+from django.utils.safestring import mark_safe
 
 import puzzle_editing.status as status
-from puzzle_editing.models import PuzzleTag
-from puzzle_editing.models import PuzzleVisited
+from puzzle_editing.models import get_role_bitmasks
+from puzzle_editing.models import PuzzleListRow
+from puzzle_editing.models import refresh_puzzle_list_rows
+from puzzle_editing.models import set_role_attributes
+from puzzle_editing.models import UnreadPuzzle
 from puzzle_editing.models import User
+from puzzle_editing.query_budget import BudgetedLibrary
+from puzzle_editing.query_budget import query_budget
 
-register = template.Library()
+register = BudgetedLibrary()
 
+DEFAULT_PAGE_SIZE = 100
+DEFAULT_SORT = "priority"
+# Cached rows are keyed by version, so this only bounds how long stale
+# versions linger.
+ROW_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Sortable columns, by the name used in the ?sort= parameter (prefix with "-"
+# to sort descending), and the field they sort by. Ties are always broken by
+# id, so (sort value, id) identifies a position in the list and can be used as
+# a keyset cursor.
+SORT_FIELDS = {
+    "priority": "priority",
+    "id": "id",
+    "status": "list_row__status_rank",
+    "status_mtime": "status_mtime",
+    "last_updated": "last_updated",
+    "last_comment": "list_row__last_comment_date",
+    "answers": "list_row__answer_count",
+}
+SORT_LABELS = {
+    "priority": "Priority",
+    "id": "ID",
+    "status": "Status",
+    "status_mtime": "Last status change",
+    "last_updated": "Last updated",
+    "last_comment": "Last comment",
+    "answers": "Number of answers",
+}
+DATETIME_SORTS = {"status_mtime", "last_updated", "last_comment"}
+
+# The columns of the table, and what they sort by, if anything.
+COLUMNS = [
+    ("🤔", None),
+    ("ID/Name", "id"),
+    ("Status", "status"),
+    ("Last Status Change", "status_mtime"),
+    ("Authors", None),
+    ("Summary", None),
+    ("Priority", "priority"),
+    ("Editors", None),
+    ("Last Updated", "last_updated"),
+    ("Last Comment", "last_comment"),
+    ("🏃", None),
+]
+
+# ?role= values and the Puzzle field listing the users with that role
+ROLE_FILTERS = {
+    "author": "authors",
+    "editor": "editors",
+    "factchecker": "factcheckers",
+    "postprodder": "postprodders",
+    "spoiled": "spoiled",
+}
+# checkbox filters; all of them are off by default
+FILTER_CHECKBOXES = [
+    ("dead", "Show dead puzzles"),
+    ("deferred", "Show deferred puzzles"),
+    ("unvisited", "Only show spoiled+unvisited"),
+    ("before_solution", "Hide puzzles ≥ Needs Solution"),
+    ("answered", "Show only puzzles with answers"),
+]
+FILTER_PARAMS = [name for name, _ in FILTER_CHECKBOXES] + ["role"]
+
+# stands in for "no comments yet" so that it sorts and compares sanely
+NO_DATE = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def parse_sort(sort):
+    """Return (sort key, descending), falling back to the default sort."""
+
+    descending = sort.startswith("-")
+    key = sort.lstrip("-")
+    if key not in SORT_FIELDS:
+        return DEFAULT_SORT, False
+    return key, descending
+
+
+def sort_expression(key):
+    if key in DATETIME_SORTS:
+        return Coalesce(
+            F(SORT_FIELDS[key]), Value(NO_DATE), output_field=DateTimeField()
+        )
+    return Coalesce(F(SORT_FIELDS[key]), Value(-1))
+
+
+def make_cursor(sort, puzzle):
+    key, _ = parse_sort(sort)
+    value = puzzle.list_sort_value
+    if key in DATETIME_SORTS:
+        value = value.isoformat()
+    return (
+        base64.urlsafe_b64encode(json.dumps([value, puzzle.id]).encode())
+        .decode()
+        .rstrip("=")
+    )
+
+
+def parse_cursor(sort, cursor):
+    """Return the (sort value, id) a cursor points after, or None if invalid."""
+
+    key, _ = parse_sort(sort)
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        value, puzzle_id = json.loads(base64.urlsafe_b64decode(padded))
+        if key in DATETIME_SORTS:
+            value = datetime.datetime.fromisoformat(value)
+        elif not is_database_int(value):
+            return None
+        puzzle_id = int(puzzle_id)
+    except (ValueError, TypeError):  # not worth crashing over
+        return None
+    if not is_database_int(puzzle_id):
+        return None
+    return value, puzzle_id
+
+
+def is_database_int(value):
+    # bools are ints, and bigger ints overflow when they're sent to SQLite
+    return type(value) is int and -(2**63) <= value < 2**63
+
+
+def filter_puzzles(puzzles, user, params):
+    """Apply the filters in the GET parameters `params` to puzzles.
+
+    Dead and deferred puzzles are hidden unless ?dead=1 or ?deferred=1."""
+
+    if not params.get("dead"):
+        puzzles = puzzles.exclude(status=status.DEAD)
+    if not params.get("deferred"):
+        puzzles = puzzles.exclude(status=status.DEFERRED)
+    if params.get("before_solution"):
+        puzzles = puzzles.filter(
+            status__in=status.STATUSES[
+                : status.STATUSES.index(status.NEEDS_SOLUTION) + 1
+            ]
+        )
+    if params.get("answered"):
+        puzzles = puzzles.filter(list_row__answer_count__gt=0)
+
+    role = params.get("role")
+    if role in ROLE_FILTERS:
+        puzzles = puzzles.filter(**{ROLE_FILTERS[role]: user})
+    elif role == "unspoiled":
+        puzzles = puzzles.exclude(spoiled=user)
+
+    if params.get("unvisited"):
+        puzzles = puzzles.filter(unread_entries__user=user)
+    return puzzles
+
+
+def make_puzzle_data(puzzles, user, sort=DEFAULT_SORT, after=None, limit=None):
+    """Fetch a window of puzzles, decorated with what puzzle lists display.
+
+    The puzzles are ordered by `sort`; if `after` is a cursor from
+    make_cursor, only puzzles strictly after it are returned, and at most
+    `limit` of them are fetched from the database."""
+
+    key, descending = parse_sort(sort)
+    direction = "-" if descending else ""
+    puzzles = puzzles.annotate(list_sort_value=sort_expression(key)).order_by(
+        direction + "list_sort_value", direction + "id"
+    )
+    position = after and parse_cursor(sort, after)
+    if position:
+        value, puzzle_id = position
+        if descending:
+            puzzles = puzzles.filter(
+                Q(list_sort_value__lt=value)
+                | Q(list_sort_value=value, id__lt=puzzle_id)
+            )
+        else:
+            puzzles = puzzles.filter(
+                Q(list_sort_value__gt=value)
+                | Q(list_sort_value=value, id__gt=puzzle_id)
+            )
 
-def make_puzzle_data(puzzles, user, do_query_filter_in):
     puzzles = (
-        puzzles.order_by("priority").annotate(
-            is_spoiled=Exists(
-                User.objects.filter(spoiled_puzzles=OuterRef("pk"), id=user.id)
-            ),
-            is_author=Exists(
-                User.objects.filter(authored_puzzles=OuterRef("pk"), id=user.id)
-            ),
-            is_editing=Exists(
-                User.objects.filter(editing_puzzles=OuterRef("pk"), id=user.id)
-            ),
-            is_factchecking=Exists(
-                User.objects.filter(factchecking_puzzles=OuterRef("pk"), id=user.id)
-            ),
-            is_postprodding=Exists(
-                User.objects.filter(postprodding_puzzles=OuterRef("pk"), id=user.id)
-            ),
-            last_comment_date=Max("comments__date"),
-            last_visited_date=Subquery(
-                PuzzleVisited.objects.filter(puzzle=OuterRef("pk"), user=user).values(
-                    "date"
-                )
+        puzzles.select_related("list_row")
+        .annotate(
+            is_unread=Exists(
+                UnreadPuzzle.objects.filter(puzzle=OuterRef("pk"), user=user)
             ),
         )
-        # This prefetch is super slow.
-        # .prefetch_related(
-        #     Prefetch(
-        #         "tags",
-        #         queryset=PuzzleTag.objects.filter(important=True).only("name"),
-        #         to_attr="prefetched_important_tags",
-        #     ),
-        # )
-        .defer("description", "notes", "editor_notes", "content", "solution")
+        .defer(
+            "description",
+            "notes",
+            "editor_notes",
+            "content",
+            "solution",
+            "summary_html",
+            "description_html",
+            "notes_html",
+            "content_html",
+            "solution_html",
+        )
     )
+    if limit is not None:
+        puzzles = puzzles[:limit]
 
     puzzles = list(puzzles)
 
-    for puzzle in puzzles:
-        puzzle.opt_authors = []
-        puzzle.opt_editors = []
-        puzzle.prefetched_important_tag_names = []
-
-    puzzle_ids = [puzzle.id for puzzle in puzzles]
-    id_to_index = {puzzle.id: i for i, puzzle in enumerate(puzzles)}
-
-    # Handrolling prefetches because
-    # (1) we can aggressively skip model construction
-    # (2) (actually important, from my tests) if we know we're listing all
-    #     puzzles, skipping the puzzles__in constraint massively improves
-    #     performance. (I want to keep it in other cases so that we don't
-    #     regress.)
-    tagships = PuzzleTag.objects.filter(important=True)
-    if do_query_filter_in:
-        tagships = tagships.filter(puzzles__in=puzzle_ids)
-    for tag_name, puzzle_id in tagships.values_list("name", "puzzles"):
-        if puzzle_id in id_to_index:
-            puzzles[id_to_index[puzzle_id]].prefetched_important_tag_names.append(
-                tag_name
-            )
+    # Tags, authors, editors, answers and the last comment date all come from
+    # the denormalized PuzzleListRow, so there's nothing to prefetch. Rows
+    # should always exist, but build any that are missing (e.g. for puzzles
+    # from before the table existed) rather than crash.
+    missing_ids = [puzzle.id for puzzle in puzzles if not hasattr(puzzle, "list_row")]
+    if missing_ids:
+        refresh_puzzle_list_rows(missing_ids)
+        rows = PuzzleListRow.objects.in_bulk(missing_ids)
+        for puzzle in puzzles:
+            if puzzle.id in rows:
+                puzzle.list_row = rows[puzzle.id]
 
-    authorships = User.objects
-    if do_query_filter_in:
-        authorships = authorships.filter(authored_puzzles__in=puzzle_ids)
-    for username, display_name, puzzle_id in authorships.values_list(
-        "username", "display_name", "authored_puzzles"
-    ):
-        if puzzle_id in id_to_index:
-            puzzles[id_to_index[puzzle_id]].opt_authors.append((username, display_name))
-
-    editorships = User.objects
-    if do_query_filter_in:
-        editorships = editorships.filter(editing_puzzles__in=puzzle_ids)
-    for username, display_name, puzzle_id in editorships.values_list(
-        "username", "display_name", "editing_puzzles"
-    ):
-        if puzzle_id in id_to_index:
-            puzzles[id_to_index[puzzle_id]].opt_editors.append((username, display_name))
+    masks = get_role_bitmasks(user, [puzzle.id for puzzle in puzzles])
 
     for puzzle in puzzles:
-        puzzle.authors_html = User.html_user_list_of_flat(
-            puzzle.opt_authors, linkify=False
-        )
-        puzzle.editors_html = User.html_user_list_of_flat(
-            puzzle.opt_editors, linkify=False
-        )
+        set_role_attributes(puzzle, masks.get(puzzle.id, 0))
+        row = puzzle.list_row
+        puzzle.prefetched_important_tag_names = row.important_tag_names
+        puzzle.opt_authors = row.authors
+        puzzle.opt_editors = row.editors
+        puzzle.last_comment_date = row.last_comment_date
+        # the row's answer count is already an aggregate over the answers
+        # through table, so this saves a COUNT per row in the template
+        puzzle.prefetched_has_answer = row.answer_count > 0
 
     return puzzles
 
 
-# TODO: There's gotta be a better way of generating a unique ID for each time
-# this template gets rendered...
+def row_cache_key(puzzle):
+    # PuzzleListRow.updated is bumped by every signal that can change what a
+    # row shows, but QuerySet.update() sends no signals, so the puzzle's own
+    # fields that the cells show are part of the version too.
+    version = repr(
+        (
+            puzzle.list_row.updated,
+            puzzle.name,
+            puzzle.codename,
+            puzzle.status,
+            puzzle.priority,
+            puzzle.needed_editors,
+            puzzle.summary,
+            puzzle.last_updated,
+        )
+    )
+    return "puzzle_list_row:{}:{}".format(
+        puzzle.id, hashlib.sha1(version.encode()).hexdigest()
+    )
+
+
+def render_row_cells(puzzle):
+    context = {
+        "puzzle": puzzle,
+        "authors_html": User.html_user_list_of_flat(puzzle.opt_authors, linkify=False),
+        "editors_html": User.html_user_list_of_flat(puzzle.opt_editors, linkify=False),
+    }
+    return (
+        get_template("tags/puzzle_list_row_head.html").render(context),
+        get_template("tags/puzzle_list_row_tail.html").render(context),
+    )
+
+
+def attach_row_html(puzzles):
+    """Set row_head_html and row_tail_html on each puzzle from
+    make_puzzle_data, rendering only the rows that aren't already cached.
+
+    These are the cells that look the same to every user. The role cell and
+    the spoiled/unvisited classes depend on who's looking, and the status
+    mtime is shown relative to now, so those are rendered on every request."""
+
+    keys = {row_cache_key(puzzle): puzzle for puzzle in puzzles}
+    cached = cache.get_many(keys)
+    rendered = {}
+    for key, puzzle in keys.items():
+        if key not in cached:
+            rendered[key] = render_row_cells(puzzle)
+        head, tail = cached.get(key) or rendered[key]
+        puzzle.row_head_html = mark_safe(head)
+        puzzle.row_tail_html = mark_safe(tail)
+    if rendered:
+        cache.set_many(rendered, ROW_CACHE_TIMEOUT)
+
+
+def iter_puzzle_data(puzzles, user, chunk_size=500):
+    """Like make_puzzle_data, but yield every puzzle in id order, fetching a
+    chunk at a time so that memory use doesn't grow with the number of
+    puzzles. Each chunk is its own short keyset query, so no database cursor
+    or transaction is held open between chunks."""
+
+    after = None
+    while True:
+        chunk = make_puzzle_data(
+            puzzles, user, sort="id", after=after, limit=chunk_size
+        )
+        yield from chunk
+        if len(chunk) < chunk_size:
+            return
+        after = make_cursor("id", chunk[-1])
 
 
 @register.inclusion_tag("tags/puzzle_list.html", takes_context=True)
+@query_budget(2)
 def puzzle_list(context, puzzles, user, with_new_link=False):
+    """Show one page of a list of puzzles.
+
+    Paging is controlled by GET parameters: ?limit= sets the page size and
+    ?sort= the column to sort by, for every list on the page; ?after_<n>=
+    holds the cursor of the n-th list rendered on the page, and ?only=<n>
+    skips rendering every other list (which is how later pages are loaded on
+    demand). Sorting and the filters in FILTER_PARAMS all happen in the
+    database, so they work the same however many pages there are."""
+
     req = context["request"]
-    limit = None
-    if req.method == "GET" and "limit" in req.GET:
+    # number the lists on this page so their cursors can be told apart
+    list_id = getattr(req, "puzzle_list_count", 0)
+    req.puzzle_list_count = list_id + 1
+
+    if req.GET.get("only", str(list_id)) != str(list_id):
+        return {"skipped": True}
+
+    limit = DEFAULT_PAGE_SIZE
+    if "limit" in req.GET:
         try:
-            limit = int(req.GET["limit"])
+            limit = max(int(req.GET["limit"]), 1)
         except ValueError:
             limit = 50
+    sort = req.GET.get("sort", DEFAULT_SORT)
+    sort_key, sort_descending = parse_sort(sort)
+    after_param = "after_{}".format(list_id)
+
+    # fetch one extra to find out whether there's another page
+    puzzle_data = make_puzzle_data(
+        filter_puzzles(puzzles, user, req.GET),
+        user,
+        sort=sort,
+        after=req.GET.get(after_param),
+        limit=limit + 1,
+    )
+    next_page_query = None
+    if len(puzzle_data) > limit:
+        puzzle_data = puzzle_data[:limit]
+        query = req.GET.copy()
+        query[after_param] = make_cursor(sort, puzzle_data[-1])
+        query["only"] = list_id
+        next_page_query = query.urlencode()
+    attach_row_html(puzzle_data)
+
+    # Changing the sort or filters starts every list over from the top.
+    base_query = req.GET.copy()
+    for param in list(base_query):
+        if param.startswith("after_") or param == "only":
+            del base_query[param]
+
+    # ?bulk=1 adds checkboxes to pick puzzles for bulk_puzzles to change
+    bulk = bool(req.GET.get("bulk"))
+    columns = [{"text": ""}] if bulk else []
+    for text, key in COLUMNS:
+        column = {"text": text}
+        if key:
+            if key == sort_key:
+                column["arrow"] = "▼" if sort_descending else "▲"
+                descending = not sort_descending
+            else:
+                descending = key in DATETIME_SORTS
+            query = base_query.copy()
+            query["sort"] = ("-" if descending else "") + key
+            column["query"] = query.urlencode()
+        columns.append(column)
 
     return {
-        "limit": limit,
-        "puzzles": make_puzzle_data(
-            puzzles, user, do_query_filter_in=req.path != "/all"
-        ),
+        "puzzles": puzzle_data,
+        "next_page_query": next_page_query,
         "new_puzzle_link": False,
-        "dead_status": status.DEAD,
-        "deferred_status": status.DEFERRED,
-        "past_needs_solution_statuses": [
-            st["value"]
-            for st in status.ALL_STATUSES
-            if status.get_status_rank(st["value"])
-            > status.get_status_rank(status.NEEDS_SOLUTION)
+        "list_id": list_id,
+        "columns": columns,
+        "filtered": any(param in req.GET for param in FILTER_PARAMS),
+        "filter_checkboxes": [
+            {"name": name, "label": label, "checked": bool(req.GET.get(name))}
+            for name, label in FILTER_CHECKBOXES
+        ],
+        "role": req.GET.get("role", ""),
+        "role_choices": ["unspoiled"] + list(ROLE_FILTERS),
+        "sort": sort,
+        "sort_choices": [
+            {"value": ("-" if descending else "") + key, "label": label + suffix}
+            for key, label in SORT_LABELS.items()
+            for descending, suffix in [(False, " ▲"), (True, " ▼")]
         ],
-        "random_id": "%016x" % random.randrange(16**16),
+        "limit_param": req.GET.get("limit"),
+        "bulk": bulk,
+        "current_path": req.get_full_path(),
     }
@@ -1,35 +1,29 @@
-from django import template
-from django.db.models import Exists
 from django.db.models import Max
 from django.db.models import OuterRef
 from django.db.models import Subquery
 
+from puzzle_editing.models import get_role_bitmasks
+from puzzle_editing.models import ROLE_AUTHOR
+from puzzle_editing.models import ROLE_SPOILED
 from puzzle_editing.models import TestsolveParticipation
 from puzzle_editing.models import User
+from puzzle_editing.query_budget import BudgetedLibrary
+from puzzle_editing.query_budget import query_budget
 
-register = template.Library()
+register = BudgetedLibrary()
 
 
 @register.inclusion_tag("tags/testsolve_session_list.html")
+@query_budget(3)
 def testsolve_session_list(
     sessions, user, show_notes=False, show_leave_button=False, show_ratings=False
 ):
     sessions = (
         sessions.annotate(
-            is_author=Exists(
-                User.objects.filter(
-                    authored_puzzles__testsolve_sessions=OuterRef("pk"), id=user.id
-                )
-            ),
-            is_spoiled=Exists(
-                User.objects.filter(
-                    spoiled_puzzles__testsolve_sessions=OuterRef("pk"), id=user.id
-                )
-            ),
             last_comment_date=Max("comments__date"),
         )
         .order_by("puzzle__priority")
-        .select_related("puzzle")
+        .select_related("puzzle", "puzzle__list_row")
     )
 
     if show_ratings:
@@ -42,27 +36,47 @@ def testsolve_session_list(
         )
 
     # handroll participants join to avoid queries
-    # TODO: getting important tag names is also costing one query per session
-    # (but that one's a lot more annoying to implement and handrolling its
-    # prefetch may not be worth the performance gain)
     sessions = list(sessions)
 
+    masks = get_role_bitmasks(user, {session.puzzle_id for session in sessions})
+
     for session in sessions:
         session.opt_participants = []
+        session.done_count = 0
+        # important tags from the list row, instead of a query per puzzle
+        if hasattr(session.puzzle, "list_row"):
+            session.puzzle.prefetched_important_tag_names = (
+                session.puzzle.list_row.important_tag_names
+            )
+        mask = masks.get(session.puzzle_id, 0)
+        session.is_author = bool(mask & ROLE_AUTHOR)
+        session.is_spoiled = bool(mask & ROLE_SPOILED)
 
     id_to_index = {session.id: i for i, session in enumerate(sessions)}
 
-    for session_id, username, display_name in TestsolveParticipation.objects.filter(
+    for (
+        session_id,
+        username,
+        display_name,
+        ended,
+    ) in TestsolveParticipation.objects.filter(
         session__in=[session.id for session in sessions]
-    ).values_list("session", "user__username", "user__display_name"):
-        sessions[id_to_index[session_id]].opt_participants.append(
-            (username, display_name)
-        )
+    ).values_list(
+        "session", "user__username", "user__display_name", "ended"
+    ):
+        session = sessions[id_to_index[session_id]]
+        session.opt_participants.append((username, display_name))
+        if ended is not None:
+            session.done_count += 1
 
     for session in sessions:
         session.participants_html = User.html_user_list_of_flat(
             session.opt_participants, linkify=False
         )
+        # what get_done_participants_display would say
+        session.done_display = "{} / {}".format(
+            session.done_count, len(session.opt_participants)
+        )
 
     return {
         "sessions": sessions,
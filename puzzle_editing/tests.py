@@ -1,19 +1,61 @@
+import base64
+import contextlib
+import io
+import json
 import logging
+from concurrent import futures
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
+from datetime import timedelta
+from unittest import mock
 
 import django.urls as urls
 from django.contrib.auth.models import Permission
 from django.contrib.contenttypes.models import ContentType
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db import OperationalError
+from django.template import Context
+from django.template import Template
 from django.test import Client
+from django.test import RequestFactory
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
+from . import chart_renderer
+from . import graph
+from . import messaging
+from . import models
 from . import status
 from . import views
+from .management.commands.benchmark_views import benchmark_urls
+from .models import flush_visits
+from .models import get_role_bitmasks
+from .models import OutboundEmail
 from .models import Puzzle
+from .models import PuzzleAccess
+from .models import PuzzleAnswer
+from .models import PuzzleComment
+from .models import PuzzleListRow
+from .models import PuzzleTag
+from .models import PuzzleVisited
+from .models import rerender_markdown
+from .models import ROLE_AUTHOR
+from .models import ROLE_EDITOR
+from .models import ROLE_SPOILED
 from .models import Round
+from .models import StatusChange
+from .models import StatusSubscription
 from .models import TestsolveParticipation
 from .models import TestsolveSession
 from .models import User
+from .query_budget import enforce_query_budgets
+from .rendering import render_cache
+from .templatetags.comment_list import COMMENT_PAGE_SIZE
+from .urls import urlpatterns
 
 logging.disable(logging.DEBUG)  # there's a particular template lookup failure
 # in a view that really doesn't seem relevant
@@ -27,6 +69,8 @@ def create_user(name):
 
 class Misc(TestCase):
     def setUp(self):
+        # write visits buffered during the test while its puzzles still exist
+        self.addCleanup(flush_visits)
         self.a = User.objects.create_user(
             username="a", email="a@example.com", password="secret"
         )
@@ -90,6 +134,7 @@ class Misc(TestCase):
         )
 
         response = c.get(urls.reverse("puzzle", args=[self.puzzle2.id]))
+        flush_visits()
         response = c.get(urls.reverse("index"))
         self.assertEqual(response.status_code, 200)
         self.assertQuerysetEqual(
@@ -115,6 +160,729 @@ class Misc(TestCase):
         self.assertEqual(response.status_code, 200)
         # TODO add more
 
+    def test_puzzle_list_pagination(self):
+        c = Client()
+        c.login(username="b", password="password")
+
+        for sort in ["priority", "-id", "status", "-last_comment"]:
+            seen = []
+            query = "?limit=2&sort=" + sort
+            while query:
+                response = c.get(urls.reverse("all") + query)
+                self.assertEqual(response.status_code, 200)
+                # the puzzle_list tag's context, not the view's
+                tag_context = next(
+                    ctx for ctx in response.context if "next_page_query" in ctx
+                )
+                self.assertLessEqual(len(tag_context["puzzles"]), 2)
+                seen.extend(puzzle.id for puzzle in tag_context["puzzles"])
+                query = tag_context["next_page_query"]
+                query = query and "?" + query
+            self.assertEqual(
+                sorted(seen),
+                [self.puzzle1.id, self.puzzle2.id, self.puzzle3.id],
+                sort,
+            )
+        self.assertEqual(seen[0], max(seen))
+
+    def test_puzzle_list_filters(self):
+        c = Client()
+        c.login(username="b", password="password")
+        self.puzzle2.status = status.DEAD
+        self.puzzle2.save()
+
+        def listed(**params):
+            response = c.get(urls.reverse("all"), params)
+            self.assertEqual(response.status_code, 200)
+            tag_context = next(ctx for ctx in response.context if "columns" in ctx)
+            return [puzzle.id for puzzle in tag_context["puzzles"]]
+
+        self.assertEqual(listed(sort="id"), [self.puzzle1.id, self.puzzle3.id])
+        self.assertEqual(
+            listed(sort="-id", dead="1"),
+            [self.puzzle3.id, self.puzzle2.id, self.puzzle1.id],
+        )
+        self.assertEqual(
+            listed(sort="status", dead="1"),
+            [self.puzzle3.id, self.puzzle1.id, self.puzzle2.id],
+        )
+        # malformed cursors are ignored
+        for value in [["abc", 1], [[1], 1], [None, 1], [True, 1], [1, 2**70], {}]:
+            cursor = base64.urlsafe_b64encode(json.dumps(value).encode()).decode()
+            self.assertEqual(
+                listed(sort="status", after_0=cursor), listed(sort="status")
+            )
+        self.assertEqual(listed(sort="id", after_0="!"), listed(sort="id"))
+        self.assertEqual(listed(role="editor"), [self.puzzle3.id])
+        self.assertEqual(listed(role="unspoiled"), [self.puzzle1.id])
+        self.assertEqual(listed(unvisited="1"), [self.puzzle3.id])
+        # the visit counts on the very next page, without waiting for a flush
+        c.get(urls.reverse("puzzle", args=[self.puzzle3.id]))
+        self.assertEqual(listed(unvisited="1"), [])
+        self.assertNotContains(c.get(urls.reverse("all")), "spoiled unvisited")
+        PuzzleComment(
+            puzzle=self.puzzle3, author=self.a, is_system=False, content="hi"
+        ).save()
+        self.assertEqual(listed(unvisited="1"), [self.puzzle3.id])
+        self.assertContains(c.get(urls.reverse("all")), "spoiled unvisited")
+        c.get(urls.reverse("puzzle", args=[self.puzzle3.id]))
+        self.assertNotContains(c.get(urls.reverse("all")), "spoiled unvisited")
+
+    def test_puzzle_list_row_cache(self):
+        cache.clear()
+        c = Client()
+        c.login(username="b", password="password")
+        response = c.get(urls.reverse("all"))
+        self.assertContains(response, "codename 3")
+
+        with mock.patch(
+            "puzzle_editing.templatetags.puzzle_list.render_row_cells"
+        ) as render:
+            response = c.get(urls.reverse("all"))
+            render.assert_not_called()
+        self.assertContains(response, "codename 3")
+
+        self.puzzle3.codename = "renamed"
+        self.puzzle3.save()
+        response = c.get(urls.reverse("all"))
+        self.assertContains(response, "renamed")
+        self.assertNotContains(response, "codename 3")
+
+        # updates that skip signals
+        Puzzle.objects.filter(id=self.puzzle3.id).update(codename="updated")
+        self.assertContains(c.get(urls.reverse("all")), "updated")
+
+    def test_generate_hunt(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            call_command("generate_hunt", puzzles=12, users=6, comments=3, seed=1)
+        self.assertEqual(User.objects.filter(username__startswith="hunt").count(), 6)
+        self.assertEqual(Puzzle.objects.count(), 3 + 12)
+        self.assertEqual(PuzzleComment.objects.count(), 12 * 3)
+        self.assertEqual(PuzzleListRow.objects.count(), Puzzle.objects.count())
+
+        c = Client()
+        c.login(username="hunt0", password="password")
+        response = c.get(urls.reverse("all"))
+        self.assertEqual(response.status_code, 200)
+
+    def test_request_timing(self):
+        c = Client()
+        c.login(username="b", password="password")
+        response = c.get(urls.reverse("all"))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("sql;dur=", response["Server-Timing"])
+        self.assertIn("template;dur=", response["Server-Timing"])
+
+        self.assertEqual(c.get("/admin/slow_requests/").status_code, 302)
+        self.a.is_staff = True
+        self.a.save()
+        c.login(username="a", password="secret")
+        response = c.get("/admin/slow_requests/")
+        self.assertContains(response, "GET /all")
+
+    def test_puzzle_access(self):
+        request = RequestFactory().get("/")
+        request.user = self.a
+        with self.assertNumQueries(1):
+            access = PuzzleAccess.for_request(request, self.puzzle1)
+            self.assertIs(PuzzleAccess.for_request(request, self.puzzle1), access)
+        self.assertTrue(access.is_spoiled)
+        self.assertTrue(access.is_author)
+        self.assertFalse(access.is_editing)
+        self.assertEqual(access.role, "author")
+        self.assertEqual(PuzzleAccess(self.b, self.puzzle3).role, "editor")
+        self.assertIsNone(PuzzleAccess(self.a, self.puzzle2).role)
+
+    def test_puzzle_visits(self):
+        c = Client()
+        c.login(username="a", password="secret")
+        visits = PuzzleVisited.objects.filter(puzzle=self.puzzle1, user=self.a)
+        c.get(urls.reverse("puzzle", args=[self.puzzle1.id]))
+        # it was unread, so the visit is written right away
+        first = visits.get().date
+        c.get(urls.reverse("puzzle", args=[self.puzzle1.id]))
+        # otherwise buffered until enough visits pile up, or they've waited
+        # long enough
+        self.assertEqual(visits.get().date, first)
+        with mock.patch.object(models, "FLUSH_VISITS_AFTER", 0):
+            c.get(urls.reverse("index"))
+        second = visits.get().date
+        self.assertGreater(second, first)
+
+        c.get(urls.reverse("puzzle", args=[self.puzzle1.id]))
+        with mock.patch.object(connection, "cursor", side_effect=OperationalError):
+            with self.assertRaises(OperationalError):
+                flush_visits()
+        # kept for the next flush
+        flush_visits()
+        self.assertEqual(visits.count(), 1)
+        self.assertGreater(visits.get().date, second)
+
+    def test_unread_puzzles(self):
+        def unread(user):
+            return set(user.unread.values_list("puzzle_id", flat=True))
+
+        # nothing has been visited yet
+        self.assertEqual(unread(self.a), {self.puzzle1.id, self.puzzle3.id})
+        c = Client()
+        c.login(username="a", password="secret")
+        response = c.get(urls.reverse("puzzle", args=[self.puzzle1.id]))
+        self.assertEqual(response.context["next_unread_puzzle_id"], self.puzzle3.id)
+        c.get(urls.reverse("puzzle", args=[self.puzzle3.id]))
+        self.assertEqual(unread(self.a), set())
+
+        PuzzleComment(
+            puzzle=self.puzzle3, author=self.b, is_system=False, content="hi"
+        ).save()
+        self.assertEqual(unread(self.a), {self.puzzle3.id})
+        # still never visited, even if they commented
+        self.assertEqual(unread(self.b), {self.puzzle2.id, self.puzzle3.id})
+        response = c.get(urls.reverse("index"))
+        self.assertEqual(list(response.context["inbox_puzzles"]), [self.puzzle3])
+        c.get(urls.reverse("puzzle", args=[self.puzzle3.id]))
+        response = c.get(urls.reverse("index"))
+        self.assertEqual(list(response.context["inbox_puzzles"]), [])
+
+        self.puzzle1.spoiled.add(self.c)
+        self.assertEqual(unread(self.c), {self.puzzle1.id})
+        self.c.spoiled_puzzles.remove(self.puzzle1)
+        self.assertEqual(unread(self.c), set())
+
+    def test_rendered_markdown(self):
+        comment = PuzzleComment(
+            puzzle=self.puzzle1, author=self.a, is_system=False, content="*hi*"
+        )
+        comment.save()
+        self.assertEqual(comment.content_html, "<p><em>hi</em></p>")
+
+        c = Client()
+        c.login(username="a", password="secret")
+        with mock.patch("puzzle_editing.models.render_markdown") as render:
+            response = c.get(urls.reverse("puzzle", args=[self.puzzle1.id]))
+            render.assert_not_called()
+        self.assertContains(response, "<em>hi</em>")
+
+        # saves only render markdown that changed
+        puzzle = Puzzle.objects.get(id=self.puzzle1.id)
+        with mock.patch(
+            "puzzle_editing.models.render_markdown", return_value="<p>new</p>"
+        ) as render:
+            puzzle.status = status.WRITING
+            puzzle.save()
+            render.assert_not_called()
+            puzzle.notes = "new"
+            puzzle.save()
+            render.assert_called_once_with("new")
+        puzzle.refresh_from_db()
+        self.assertEqual(puzzle.notes_html, "<p>new</p>")
+
+        PuzzleComment.objects.filter(id=comment.id).update(
+            content="**bye**", markdown_version="old"
+        )
+        self.assertEqual(rerender_markdown(), 1)
+        comment.refresh_from_db()
+        self.assertEqual(comment.content_html, "<p><strong>bye</strong></p>")
+
+    def test_markdown_render_cache(self):
+        render_cache.clear()
+        c = Client()
+        for _ in range(3):
+            response = c.post(
+                urls.reverse("preview_markdown"),
+                "*cached*",
+                content_type="text/plain",
+            )
+            self.assertIn("<em>cached</em>", response.json()["output"])
+        self.assertEqual(render_cache.misses, 1)
+        self.assertEqual(render_cache.hits, 2)
+
+    def test_comment_pages(self):
+        # created in one insert, so they mostly share a date and are paged by id
+        PuzzleComment.objects.bulk_create(
+            PuzzleComment(
+                puzzle=self.puzzle1, author=self.a, is_system=False, content=str(i)
+            )
+            for i in range(COMMENT_PAGE_SIZE + 5)
+        )
+        ids = list(
+            PuzzleComment.objects.filter(puzzle=self.puzzle1)
+            .order_by("date", "id")
+            .values_list("id", flat=True)
+        )
+
+        c = Client()
+        c.login(username="a", password="secret")
+        response = c.get(urls.reverse("puzzle", args=[self.puzzle1.id]))
+        context = next(ctx for ctx in response.context if "older_cursor" in ctx)
+        self.assertEqual([comment.id for comment in context["comments"]], ids[5:])
+        self.assertContains(response, "Load older comments")
+
+        url = urls.reverse("puzzle_comments", args=[self.puzzle1.id])
+        data = c.get(url, {"before": context["older_cursor"]}).json()
+        self.assertIsNone(data["older"])
+        for comment_id in ids[:5]:
+            self.assertIn('id="comment-{}"'.format(comment_id), data["html"])
+        self.assertNotIn('id="comment-{}"'.format(ids[5]), data["html"])
+
+        c.login(username="c", password="password")
+        self.assertEqual(c.get(url).status_code, 403)
+        url = urls.reverse("testsolve_comments", args=[self.session1.id])
+        self.assertEqual(c.get(url).status_code, 403)
+        c.login(username="b", password="password")
+        self.assertEqual(c.get(url).json()["html"].strip(), "")
+
+    def test_queued_mail(self):
+        c = Client()
+        c.login(username="b", password="password")
+        c.post(
+            urls.reverse("puzzle", args=[self.puzzle3.id]),
+            {"add_comment": "1", "content": "hello"},
+        )
+        self.assertEqual(len(mail.outbox), 0)
+        email = OutboundEmail.objects.get()
+        self.assertEqual(email.recipients, ["a@example.com"])
+
+        with mock.patch(
+            "django.core.mail.backends.locmem.EmailBackend.send_messages",
+            side_effect=OSError("mail server is down"),
+        ):
+            self.assertEqual(messaging.send_queued_mail(), (0, 1))
+        email.refresh_from_db()
+        self.assertEqual(email.attempts, 1)
+        self.assertIn("mail server is down", email.last_error)
+        # not due again yet
+        self.assertEqual(messaging.send_queued_mail(), (0, 0))
+
+        OutboundEmail.objects.update(next_attempt=timezone.now())
+        with contextlib.redirect_stdout(io.StringIO()):
+            call_command("send_queued_mail")
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn("hello", mail.outbox[0].body)
+        self.assertFalse(OutboundEmail.objects.exists())
+
+    def test_email_digests(self):
+        c = Client()
+        c.login(username="a", password="secret")
+        c.post(
+            urls.reverse("account"),
+            {
+                "email": "a@example.com",
+                "discord_username": "a#1234",
+                "credits_name": "A",
+                "email_digest_minutes": "15",
+            },
+        )
+        self.a.refresh_from_db()
+        self.assertEqual(self.a.email_digest_minutes, 15)
+
+        c.login(username="b", password="password")
+        for content in ["first", "second"]:
+            c.post(
+                urls.reverse("puzzle", args=[self.puzzle3.id]),
+                {"add_comment": "1", "content": content},
+            )
+        self.assertFalse(OutboundEmail.objects.exists())
+        self.assertEqual(self.a.pending_notifications.count(), 2)
+
+        self.assertEqual(messaging.send_digests(), 0)
+        later = timezone.now() + timedelta(minutes=16)
+        # a failure leaves the notifications for the next run
+        with mock.patch.object(
+            messaging, "send_mail_wrapper", side_effect=RuntimeError
+        ):
+            with self.assertRaises(RuntimeError):
+                messaging.send_digests(later)
+        self.assertEqual(self.a.pending_notifications.count(), 2)
+        self.assertEqual(messaging.send_digests(later), 1)
+        email = OutboundEmail.objects.get()
+        self.assertEqual(email.recipients, ["a@example.com"])
+        self.assertIn("2 new comments", email.subject)
+        self.assertLess(email.body.index("first"), email.body.index("second"))
+        self.assertFalse(self.a.pending_notifications.exists())
+
+    def test_status_mtime(self):
+        puzzle = Puzzle.objects.get(id=self.puzzle2.id)
+        old_mtime = puzzle.status_mtime
+        puzzle.priority = 1
+        with CaptureQueriesContext(connection) as queries:
+            puzzle.save(update_fields=["priority"])
+        # no looking up the old status first
+        self.assertTrue(queries[0]["sql"].startswith("UPDATE"))
+        self.assertEqual(puzzle.status_mtime, old_mtime)
+
+        puzzle.status = status.WRITING
+        puzzle.save(update_fields=["status"])
+        puzzle.refresh_from_db()
+        self.assertGreater(puzzle.status_mtime, old_mtime)
+        self.assertFalse(puzzle.has_changed("status"))
+
+        puzzles = list(Puzzle.objects.filter(id__in=[self.puzzle1.id, self.puzzle3.id]))
+        puzzles[0].status = status.DEAD
+        Puzzle.objects.bulk_update(puzzles, ["status"])
+        self.assertGreater(
+            Puzzle.objects.get(id=self.puzzle1.id).status_mtime, old_mtime
+        )
+        self.assertEqual(Puzzle.objects.get(id=self.puzzle3.id).status_mtime, old_mtime)
+        self.assertEqual(
+            PuzzleListRow.objects.get(puzzle=self.puzzle1).status_rank,
+            status.get_status_rank(status.DEAD),
+        )
+
+    def test_bulk_puzzles(self):
+        StatusSubscription(user=self.c, status=status.WRITING).save()
+        tag = PuzzleTag(name="Hard", important=True)
+        tag.save()
+        c = Client()
+        c.login(username="a", password="secret")
+        response = c.get(urls.reverse("all"), {"bulk": "1"})
+        self.assertContains(response, 'form="bulk-0"')
+        url = urls.reverse("bulk_puzzles")
+        response = c.get(
+            url,
+            {
+                "puzzles": [self.puzzle1.id, self.puzzle3.id],
+                "next": "javascript:alert(1)",
+            },
+        )
+        self.assertEqual(len(response.context["puzzles"]), 2)
+        self.assertEqual(response.context["form"]["next"].value(), urls.reverse("all"))
+
+        response = c.post(
+            url,
+            {
+                "puzzles": [self.puzzle1.id, self.puzzle2.id],
+                "action": "status",
+                "status": status.WRITING,
+            },
+        )
+        self.assertIn("puzzles", response.context["form"].errors)
+        self.assertEqual(
+            Puzzle.objects.get(id=self.puzzle1.id).status, status.TESTSOLVING
+        )
+
+        response = c.post(
+            url,
+            {
+                "puzzles": [self.puzzle1.id, self.puzzle3.id],
+                "action": "status",
+                "status": status.WRITING,
+                "next": "https://example.org/",
+            },
+        )
+        self.assertEqual(len(response.context["changed"]), 2)
+        self.assertEqual(response.context["next"], urls.reverse("all"))
+        row = PuzzleListRow.objects.get(puzzle=self.puzzle1)
+        self.assertEqual(row.status_rank, status.get_status_rank(status.WRITING))
+        self.assertEqual(
+            row.last_comment_date,
+            PuzzleComment.objects.filter(puzzle=self.puzzle1).latest("date").date,
+        )
+        self.assertEqual(
+            set(Puzzle.objects.values_list("status", flat=True)),
+            {status.WRITING, self.puzzle2.status},
+        )
+        self.assertEqual(
+            PuzzleComment.objects.filter(status_change=status.WRITING).count(), 2
+        )
+        # one email each: b edits puzzle 3, c is subscribed to both
+        emails = {
+            tuple(email.recipients): email.body for email in OutboundEmail.objects.all()
+        }
+        self.assertEqual(set(emails), {("b@example.com",), ("c@example.com",)})
+        self.assertIn("Puzzle 1", emails["c@example.com",])
+        self.assertIn("Puzzle 3", emails["c@example.com",])
+        self.assertNotIn("Puzzle 1", emails["b@example.com",])
+        self.assertEqual(
+            set(self.b.unread.values_list("puzzle_id", flat=True)),
+            {self.puzzle2.id, self.puzzle3.id},
+        )
+
+        response = c.post(
+            url,
+            {
+                "puzzles": [self.puzzle1.id, self.puzzle3.id],
+                "action": "add_tag",
+                "tag": tag.id,
+                "next": "/authored",
+            },
+        )
+        self.assertEqual(response.context["next"], "/authored")
+        self.assertEqual(set(tag.puzzles.all()), {self.puzzle1, self.puzzle3})
+        self.assertEqual(
+            PuzzleListRow.objects.get(puzzle=self.puzzle1).important_tag_names,
+            ["Hard"],
+        )
+
+    def test_status_changes(self):
+        self.assertEqual(
+            StatusChange.objects.get(puzzle=self.puzzle2).to_status,
+            status.INITIAL_IDEA,
+        )
+        c = Client()
+        c.login(username="a", password="secret")
+        c.post(
+            urls.reverse("puzzle", args=[self.puzzle1.id]),
+            {"change_status": status.NEEDS_SOLUTION},
+        )
+        change = StatusChange.objects.filter(puzzle=self.puzzle1).latest("id")
+        self.assertEqual(
+            (change.from_status, change.to_status, change.user),
+            (status.TESTSOLVING, status.NEEDS_SOLUTION, self.a),
+        )
+
+        x, y = graph.status_counts_over_time()
+        self.assertEqual(len(x), StatusChange.objects.count())
+        plotted = [s for s in status.STATUSES[::-1] if s not in graph.exclude]
+        final = dict(zip(plotted, y[-1]))
+        self.assertEqual(final[status.NEEDS_SOLUTION], 1)
+        self.assertEqual(final[status.TESTSOLVING], 0)
+
+        # rebuilt from the comments, which don't mention the puzzles'
+        # creation since they were made without views here
+        with contextlib.redirect_stdout(io.StringIO()):
+            call_command("backfill_status_changes", force=True)
+        change = StatusChange.objects.get()
+        self.assertEqual(
+            (change.puzzle, change.from_status, change.to_status),
+            (self.puzzle1, "", status.NEEDS_SOLUTION),
+        )
+
+    def test_statistics_counts(self):
+        meta = PuzzleTag.objects.create(name="meta", important=True)
+        hard = PuzzleTag.objects.create(name="hard", important=True)
+        PuzzleTag.objects.create(name="boring")
+        round = Round.objects.create(name="Round")
+        a1, a2, a3, a4 = (
+            PuzzleAnswer.objects.create(answer=answer, round=round)
+            for answer in ("ONE", "TWO", "THREE", "FOUR")
+        )
+        self.puzzle1.tags.add(hard)
+        self.puzzle1.answers.add(a1)
+        self.puzzle2.tags.add(meta)
+        self.puzzle2.answers.add(a1, a2)
+        self.puzzle3.answers.add(a3)
+
+        c = Client()
+        c.login(username="a", password="secret")
+        response = c.get(urls.reverse("statistics"))
+        self.assertEqual(
+            response.context["answers"],
+            {"assigned": 4, "waiting": 1, "meta": 2, "hard": 1, "rest": 1},
+        )
+        self.assertEqual(
+            response.context["status"],
+            [
+                {
+                    "status": status.get_display(status.INITIAL_IDEA),
+                    "count": 2,
+                    "rest_count": 1,
+                    "meta": 1,
+                    "hard": 0,
+                },
+                {
+                    "status": status.get_display(status.TESTSOLVING),
+                    "count": 1,
+                    "rest_count": 0,
+                    "meta": 0,
+                    "hard": 1,
+                },
+            ],
+        )
+
+    def test_statistics_chart(self):
+        c = Client()
+        c.login(username="a", password="secret")
+        url = urls.reverse("statistics_chart")
+        response = c.get(url, {"time": "1w"})
+        self.assertEqual(response["Content-Type"], "image/png")
+        self.assertTrue(response.content.startswith(b"\x89PNG"))
+        etag = response["ETag"]
+
+        with mock.patch("puzzle_editing.graph.render_puzzle_graph") as render:
+            response = c.get(url, {"time": "1w"}, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            response = c.get(url, {"time": "1w"})
+            self.assertEqual(response.status_code, 200)
+            render.assert_not_called()
+
+        self.puzzle2.status = status.WRITING
+        self.puzzle2.save()
+        response = c.get(url, {"time": "1w"}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+        # the window moves along even if nothing changes
+        etag = response["ETag"]
+        alltime_etag = c.get(url)["ETag"]
+        later = timezone.now() + timedelta(hours=2)
+        with mock.patch("django.utils.timezone.now", return_value=later):
+            response = c.get(url, {"time": "1w"}, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            response = c.get(url, HTTP_IF_NONE_MATCH=alltime_etag)
+            self.assertEqual(response.status_code, 304)
+
+    def test_statistics_chart_renderer(self):
+        c = Client()
+        c.login(username="a", password="secret")
+        url = urls.reverse("statistics_chart")
+        pool = mock.Mock()
+        pool.submit.side_effect = lambda *args, **kwargs: futures.Future()
+        with mock.patch.object(chart_renderer, "_get_pool", return_value=pool):
+            with mock.patch.object(chart_renderer, "RENDER_TIMEOUT", 0.01):
+                response = c.get(url, {"time": "1d"})
+                self.assertEqual(response.status_code, 503)
+                # the retry waits for the same render instead of starting another
+                response = c.get(url, {"time": "1d"})
+                self.assertEqual(response.status_code, 503)
+                self.assertEqual(pool.submit.call_count, 1)
+
+            with mock.patch.object(chart_renderer, "MAX_PENDING", 1):
+                with self.assertRaises(chart_renderer.RendererBusy):
+                    chart_renderer.render("other", [], [], [], [])
+
+            # it's cached when it's done, even though nobody was waiting
+            future = next(iter(chart_renderer._in_flight.values()))
+            future.set_result(b"png")
+            self.assertEqual(chart_renderer._in_flight, {})
+            response = c.get(url, {"time": "1d"})
+            self.assertEqual(response.content, b"png")
+
+            # a render that fails, or whose worker dies, is a 503 too
+            for error in (ValueError(), BrokenProcessPool()):
+                cache.clear()
+                failed = futures.Future()
+                failed.set_exception(error)
+                pool.submit.side_effect = lambda *args, **kwargs: failed
+                with self.assertLogs("puzzles.charts", "ERROR"):
+                    response = c.get(url, {"time": "1d"})
+                self.assertEqual(response.status_code, 503)
+            pool.shutdown.assert_called_once_with(wait=False)
+
+    def test_statistics_data(self):
+        c = Client()
+        c.login(username="a", password="secret")
+        StatusChange.objects.filter(puzzle=self.puzzle1).update(
+            date=timezone.now() - timedelta(days=10)
+        )
+        data = c.get(urls.reverse("statistics_data"), {"time": "1w"}).json()
+        self.assertEqual(len(data["counts"]), len(data["statuses"]))
+        for column in data["counts"]:
+            self.assertEqual(len(column), len(data["t"]))
+        # the change from before the window is folded into its first point
+        self.assertEqual(data["t"][0], data["start"])
+        self.assertAlmostEqual(data["end"] - data["start"], 7 * 24 * 60 * 60, 0)
+        testsolving = data["counts"][
+            data["statuses"].index(status.get_display(status.TESTSOLVING))
+        ]
+        self.assertEqual(testsolving, [1] * len(data["t"]))
+
+    def test_role_bitmasks(self):
+        self.assertEqual(
+            get_role_bitmasks(self.b),
+            {
+                self.puzzle2.id: ROLE_SPOILED | ROLE_AUTHOR,
+                self.puzzle3.id: ROLE_SPOILED | ROLE_EDITOR,
+            },
+        )
+        self.assertEqual(
+            get_role_bitmasks(self.b, [self.puzzle1.id, self.puzzle3.id]),
+            {self.puzzle3.id: ROLE_SPOILED | ROLE_EDITOR},
+        )
+
+    def test_puzzle_list_query_count(self):
+        c = Client()
+        c.login(username="b", password="password")
+        round = Round.objects.create(name="Round")
+        tag = PuzzleTag.objects.create(name="meta", important=True)
+
+        def add_puzzles(n):
+            for i in range(n):
+                puzzle = Puzzle.objects.create(
+                    name="Puzzle {}".format(i),
+                    status_mtime=datetime.fromtimestamp(0),
+                )
+                puzzle.authors.add(self.a)
+                puzzle.editors.add(self.c)
+                puzzle.spoiled.add(self.b)
+                puzzle.tags.add(tag)
+                puzzle.answers.add(
+                    PuzzleAnswer.objects.create(answer="ANSWER", round=round)
+                )
+                PuzzleComment.objects.create(
+                    puzzle=puzzle, author=self.a, is_system=False, content="hi"
+                )
+
+        def count_queries():
+            with CaptureQueriesContext(connection) as context:
+                response = c.get(urls.reverse("all"))
+            self.assertEqual(response.status_code, 200)
+            self.assertContains(response, "answered")
+            return len(context.captured_queries)
+
+        add_puzzles(3)
+        queries = count_queries()
+        add_puzzles(10)
+        self.assertEqual(count_queries(), queries)
+
+    def test_puzzles_ndjson(self):
+        c = Client()
+        c.login(username="b", password="password")
+
+        response = c.get(urls.reverse("puzzles_ndjson"))
+        self.assertEqual(response.status_code, 200)
+        rows = [json.loads(line) for line in response.streaming_content]
+        self.assertEqual(
+            [row["id"] for row in rows],
+            [self.puzzle1.id, self.puzzle2.id, self.puzzle3.id],
+        )
+        self.assertEqual(rows[0]["name"], "(codename)")
+
+        since = max(row["last_updated"] for row in rows)
+        self.puzzle2.tags.add(PuzzleTag.objects.create(name="meta", important=True))
+        response = c.get(urls.reverse("puzzles_ndjson"), {"since": since})
+        rows = [json.loads(line) for line in response.streaming_content]
+        self.assertEqual([row["id"] for row in rows], [self.puzzle2.id])
+        self.assertEqual(rows[0]["tags"], ["meta"])
+
+        response = c.get(urls.reverse("puzzles_ndjson"), {"since": "yesterday"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_puzzle_list_row(self):
+        row = PuzzleListRow.objects.get(puzzle=self.puzzle3)
+        self.assertEqual(row.status_rank, status.get_status_rank(status.INITIAL_IDEA))
+        self.assertEqual(row.authors, [["a", ""]])
+        self.assertEqual(row.editors, [["b", ""]])
+        self.assertIsNone(row.last_comment_date)
+
+        tag = PuzzleTag.objects.create(name="meta", important=True)
+        self.puzzle3.tags.add(tag)
+        self.b.display_name = "Bee"
+        self.b.save()
+        comment = PuzzleComment.objects.create(
+            puzzle=self.puzzle3, author=self.a, is_system=False, content="hi"
+        )
+
+        row = PuzzleListRow.objects.get(puzzle=self.puzzle3)
+        self.assertEqual(row.important_tag_names, ["meta"])
+        self.assertEqual(row.editors, [["b", "Bee"]])
+        self.assertEqual(row.last_comment_date, comment.date)
+
+        tag.puzzles.clear()
+        self.assertEqual(
+            PuzzleListRow.objects.get(puzzle=self.puzzle3).important_tag_names, []
+        )
+
+    def test_puzzle_list_row_answer_delete(self):
+        round = Round.objects.create(name="Round")
+        answer = PuzzleAnswer.objects.create(answer="ONE", round=round)
+        self.puzzle1.answers.add(answer)
+        self.puzzle2.answers.add(answer)
+        self.assertEqual(PuzzleListRow.objects.get(puzzle=self.puzzle1).answer_count, 1)
+
+        answer.delete()
+        self.assertEqual(PuzzleListRow.objects.get(puzzle=self.puzzle1).answer_count, 0)
+        self.assertEqual(PuzzleListRow.objects.get(puzzle=self.puzzle2).answer_count, 0)
+
     def test_puzzle(self):
         c = Client()
         c.login(username="b", password="password")
@@ -236,3 +1004,67 @@ class Misc(TestCase):
             302,
             "rounds doesn't work for non-meta-editor",
         )
+
+
+class QueryBudgets(TestCase):
+    """Checks the query_budget of every view and inclusion tag against a small
+    synthetic hunt. If a budget is exceeded, either fix the extra queries or,
+    if they're unavoidable, raise the budget."""
+
+    @classmethod
+    def setUpTestData(cls):
+        with contextlib.redirect_stdout(io.StringIO()):
+            call_command(
+                "generate_hunt",
+                puzzles=30,
+                users=10,
+                comments=4,
+                rounds=4,
+                tags=6,
+                sessions=2,
+                seed=0,
+            )
+
+    def setUp(self):
+        self.addCleanup(flush_visits)
+
+    def test_every_view_has_a_budget(self):
+        for pattern in urlpatterns:
+            if pattern.callback.__module__ == views.__name__:
+                self.assertTrue(
+                    hasattr(pattern.callback, "query_budget"),
+                    "{} has no query_budget".format(pattern.name),
+                )
+
+    def test_tag_budgets_cover_their_templates(self):
+        user = User.objects.get(username="hunt0")
+        tag = Template(
+            "{% load testsolve_session_list %}"
+            "{% testsolve_session_list sessions user %}"
+        )
+        context = Context({"sessions": TestsolveSession.objects.all(), "user": user})
+        # a query per row while rendering the tag's template is an N+1 too
+        with mock.patch.object(
+            Puzzle, "html_link", lambda puzzle: Puzzle.objects.count()
+        ):
+            with enforce_query_budgets() as found:
+                tag.render(context)
+        self.assertEqual(len(found), 1)
+        self.assertIn("testsolve_session_list made", found[0])
+
+    def test_views_within_budget(self):
+        user = User.objects.get(username="hunt0")
+        c = Client()
+        c.force_login(user)
+
+        paths = list(benchmark_urls(user))
+        self.assertGreater(len(paths), 30)
+        violations = []
+        for name, path in paths:
+            # both the first visit, which fills caches, and a warm one
+            for _ in range(2):
+                with enforce_query_budgets() as found:
+                    response = c.get(path)
+                self.assertLess(response.status_code, 400, name)
+                violations.extend(found)
+        self.assertFalse(violations, "\n\n".join(violations))
@@ -23,8 +23,11 @@ urlpatterns = [
     path("register", views.register, name="register"),
     path("authored", views.authored, name="authored"),
     path("all", views.all, name="all"),
+    path("api/puzzles.ndjson", views.puzzles_ndjson, name="puzzles_ndjson"),
     path("random_answers", views.random_answers, name="random_answers"),
+    path("puzzles/bulk", views.bulk_puzzles, name="bulk_puzzles"),
     path("puzzle/<int:id>", views.puzzle, name="puzzle"),
+    path("puzzle/<int:id>/comments", views.puzzle_comments, name="puzzle_comments"),
     path("puzzle/<int:id>/edit", views.puzzle_edit, name="puzzle_edit"),
     path("puzzle/<int:id>/people", views.puzzle_people, name="puzzle_people"),
     path("puzzle/<int:id>/answers", views.puzzle_answers, name="puzzle_answers"),
@@ -38,6 +41,11 @@ urlpatterns = [
     path("testsolve_finder", views.testsolve_finder, name="testsolve_finder"),
     path("testsolve_all", views.testsolve_all, name="testsolve_all"),
     path("testsolve/<int:id>", views.testsolve_one, name="testsolve_one"),
+    path(
+        "testsolve/<int:id>/comments",
+        views.testsolve_comments,
+        name="testsolve_comments",
+    ),
     path("testsolve/<int:id>/finish", views.testsolve_finish, name="testsolve_finish"),
     path("postprod", views.postprod, name="postprod"),
     path("needs_editor", views.needs_editor, name="needs_editor"),
@@ -55,6 +63,8 @@ urlpatterns = [
     path("tags", views.tags, name="tags"),
     path("spoiled", views.spoiled, name="spoiled"),
     path("statistics", views.statistics, name="statistics"),
+    path("statistics/chart.png", views.statistics_chart, name="statistics_chart"),
+    path("statistics/chart.json", views.statistics_data, name="statistics_data"),
     path("tags/new", views.new_tag, name="new_tag"),
     path("tags/<int:id>", views.single_tag, name="single_tag"),
     path("tags/<int:id>/edit", views.edit_tag, name="edit_tag"),
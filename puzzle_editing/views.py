@@ -1,4 +1,6 @@
+import collections
 import datetime
+import json
 import os
 import random
 import re
@@ -9,6 +11,7 @@ from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.decorators import permission_required
 from django.core.exceptions import ValidationError
+from django.db import transaction
 from django.db.models import Avg
 from django.db.models import Count
 from django.db.models import Exists
@@ -18,12 +21,19 @@ from django.db.models import OuterRef
 from django.db.models import Q
 from django.db.models import Subquery
 from django.db.models.functions import Lower
+from django.http import HttpResponse
 from django.http import JsonResponse
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.shortcuts import redirect
 from django.shortcuts import render
 from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.cache import patch_cache_control
+from django.utils.dateparse import parse_datetime
 from django.utils.html import mark_safe
+from django.utils.http import url_has_allowed_host_and_scheme
 from django.views.decorators.csrf import csrf_exempt
 from django.views.static import serve
 
@@ -31,28 +41,36 @@ import puzzle_editing.messaging as messaging
 import puzzle_editing.status as status
 import puzzle_editing.testsolve_sheets as testsolve_sheets
 import puzzle_editing.utils as utils
-from puzzle_editing.graph import curr_puzzle_graph_b64
+from puzzle_editing.chart_renderer import RendererBusy
+from puzzle_editing.graph import cached_puzzle_graph
+from puzzle_editing.graph import puzzle_graph_etag
+from puzzle_editing.graph import status_series
 from puzzle_editing.models import CommentReaction
-from puzzle_editing.models import get_user_role
+from puzzle_editing.models import get_role_bitmasks
 from puzzle_editing.models import Hint
-from puzzle_editing.models import is_author_on
-from puzzle_editing.models import is_editor_on
-from puzzle_editing.models import is_factchecker_on
-from puzzle_editing.models import is_postprodder_on
 from puzzle_editing.models import is_spoiled_on
 from puzzle_editing.models import Puzzle
+from puzzle_editing.models import PuzzleAccess
 from puzzle_editing.models import PuzzleAnswer
 from puzzle_editing.models import PuzzleComment
 from puzzle_editing.models import PuzzlePostprod
 from puzzle_editing.models import PuzzleTag
 from puzzle_editing.models import PuzzleVisited
+from puzzle_editing.models import record_visit
+from puzzle_editing.models import refresh_puzzle_list_rows
+from puzzle_editing.models import refresh_unread_puzzles
 from puzzle_editing.models import Round
+from puzzle_editing.models import set_role_attributes
 from puzzle_editing.models import SiteSetting
 from puzzle_editing.models import StatusSubscription
 from puzzle_editing.models import TestsolveGuess
 from puzzle_editing.models import TestsolveParticipation
 from puzzle_editing.models import TestsolveSession
+from puzzle_editing.models import UnreadPuzzle
 from puzzle_editing.models import User
+from puzzle_editing.query_budget import query_budget
+from puzzle_editing.templatetags.comment_list import load_comment_page
+from puzzle_editing.templatetags.puzzle_list import iter_puzzle_data
 
 
 def get_sessions_with_joined_and_current(user):
@@ -84,6 +102,7 @@ def get_credits_name(user):
     return user.credits_name or user.display_name or user.username
 
 
+@query_budget(14)
 def index(request):
     user = request.user
 
@@ -109,20 +128,8 @@ def index(request):
     postprodding = Puzzle.objects.filter(
         status=status.NEEDS_POSTPROD, postprodders=user
     )
-    inbox_puzzles = (
-        user.spoiled_puzzles.exclude(status=status.DEAD)
-        .annotate(
-            last_comment_date=Max("comments__date"),
-            last_visited_date=Subquery(
-                PuzzleVisited.objects.filter(puzzle=OuterRef("pk"), user=user).values(
-                    "date"
-                )
-            ),
-        )
-        .filter(
-            Q(last_visited_date__isnull=True)
-            | Q(last_comment_date__gt=F("last_visited_date"))
-        )
+    inbox_puzzles = Puzzle.objects.filter(unread_entries__user=user).exclude(
+        status=status.DEAD
     )
 
     return render(
@@ -221,6 +228,7 @@ class RegisterForm(forms.ModelForm):
         return user
 
 
+@query_budget(2)
 def register(request):
     if request.method == "POST":
         form = RegisterForm(request.POST)
@@ -260,8 +268,15 @@ class AccountForm(forms.Form):
         required=False,
         help_text="On puzzle pages only. Press ? for help.",
     )
+    email_digest_minutes = forms.TypedChoiceField(
+        label="Comment emails",
+        choices=User._meta.get_field("email_digest_minutes").choices,
+        coerce=int,
+        help_text=User._meta.get_field("email_digest_minutes").help_text,
+    )
 
 
+@query_budget(2)
 @login_required
 def account(request):
     user = request.user
@@ -275,6 +290,7 @@ def account(request):
             user.bio = form.cleaned_data["bio"]
             user.credits_name = form.cleaned_data["credits_name"]
             user.enable_keyboard_shortcuts = form.cleaned_data["keyboard_shortcuts"]
+            user.email_digest_minutes = form.cleaned_data["email_digest_minutes"]
             user.save()
 
             return render(request, "account.html", {"form": form, "success": True})
@@ -289,6 +305,7 @@ def account(request):
                 "credits_name": user.credits_name or user.display_name or user.username,
                 "bio": user.bio,
                 "keyboard_shortcuts": user.enable_keyboard_shortcuts,
+                "email_digest_minutes": user.email_digest_minutes,
             }
         )
 
@@ -329,6 +346,7 @@ class PuzzleInfoForm(forms.ModelForm):
         }
 
 
+@query_budget(3)
 @login_required
 def new(request):
     user = request.user
@@ -338,6 +356,7 @@ def new(request):
         if form.is_valid():
             new_puzzle = form.save(commit=False)
             new_puzzle.status_mtime = datetime.datetime.now()
+            new_puzzle.changed_by = user
             new_puzzle.save()
             form.save_m2m()
 
@@ -359,6 +378,7 @@ def new(request):
         return render(request, "new.html", {"form": form})
 
 
+@query_budget(6)
 @login_required
 def random_answers(request):
     answers = list(PuzzleAnswer.objects.filter(puzzles__isnull=True))
@@ -367,6 +387,7 @@ def random_answers(request):
 
 
 # TODO: "authored" is now a misnomer
+@query_budget(5)
 @login_required
 def authored(request):
     puzzles = Puzzle.objects.filter(authors=request.user)
@@ -381,12 +402,81 @@ def authored(request):
     )
 
 
+@query_budget(4)
 @login_required
 def all(request):
     puzzles = Puzzle.objects.all()
     return render(request, "all.html", {"puzzles": puzzles})
 
 
+def parse_since(since):
+    """Parse a Unix timestamp or an ISO 8601 date into an aware datetime."""
+
+    try:
+        return datetime.datetime.fromtimestamp(float(since), datetime.timezone.utc)
+    except ValueError:
+        date = parse_datetime(since)
+        if date is None:
+            raise
+        if timezone.is_naive(date):
+            date = timezone.make_aware(date, datetime.timezone.utc)
+        return date
+
+
+def puzzle_list_json(puzzle):
+    row = puzzle.list_row
+    return {
+        "id": puzzle.id,
+        "name": puzzle.spoiler_free_name(),
+        "url": urls.reverse("puzzle", args=[puzzle.id]),
+        "status": puzzle.status,
+        "status_display": puzzle.get_status_display(),
+        "status_rank": row.status_rank,
+        "status_mtime": puzzle.status_mtime.timestamp(),
+        "priority": puzzle.priority,
+        "priority_display": puzzle.get_priority_display(),
+        "tags": row.important_tag_names,
+        "authors": [username for username, _ in row.authors],
+        "editors": [username for username, _ in row.editors],
+        "needed_editors": puzzle.needed_editors,
+        "answered": puzzle.has_answer(),
+        "last_comment_date": row.last_comment_date.timestamp()
+        if row.last_comment_date
+        else None,
+        # pass the largest of these back as ?since= to get only later changes
+        "last_updated": max(puzzle.last_updated, row.updated).timestamp(),
+    }
+
+
+@query_budget(2)
+@login_required
+def puzzles_ndjson(request):
+    """Stream every puzzle's list row as newline-delimited JSON.
+
+    Meant for bots and dashboards that would otherwise scrape /all. With
+    ?since=<timestamp>, only puzzles that changed after it are included."""
+
+    puzzles = Puzzle.objects.all()
+    if "since" in request.GET:
+        try:
+            since = parse_since(request.GET["since"])
+        except (ValueError, OverflowError):
+            return JsonResponse(
+                {"success": False, "error": "Could not parse since"}, status=400
+            )
+        puzzles = puzzles.filter(
+            Q(last_updated__gt=since) | Q(list_row__updated__gt=since)
+        )
+
+    return StreamingHttpResponse(
+        (
+            json.dumps(puzzle_list_json(puzzle)) + "\n"
+            for puzzle in iter_puzzle_data(puzzles, request.user)
+        ),
+        content_type="application/x-ndjson",
+    )
+
+
 class PuzzleCommentForm(forms.Form):
     content = forms.CharField(widget=MarkdownTextarea)
 
@@ -469,6 +559,9 @@ def add_comment(
         emails = puzzle.get_emails(exclude_emails=(author.email,))
 
     if send_email:
+        emails = messaging.hold_for_digests(
+            comment, emails, "{}://{}".format(request.scheme, request.get_host())
+        )
         messaging.send_mail_wrapper(
             subject,
             "new_comment_email",
@@ -487,15 +580,13 @@ def add_comment(
         )
 
 
+@query_budget(35)
 @login_required  # noqa: C901
 def puzzle(request, id):  # noqa: C901
     puzzle = get_object_or_404(Puzzle, id=id)
     user = request.user
 
-    vis, vis_created = PuzzleVisited.objects.get_or_create(puzzle=puzzle, user=user)
-    if not vis_created:
-        # update the auto_now=True DateTimeField anyway
-        vis.save()
+    record_visit(puzzle, user)
 
     def add_system_comment_here(message, status_change=""):
         add_comment(
@@ -513,6 +604,7 @@ def puzzle(request, id):  # noqa: C901
         elif "change_status" in request.POST:
             new_status = request.POST["change_status"]
             puzzle.status = new_status
+            puzzle.changed_by = user
             puzzle.save()
 
             status_display = status.get_display(new_status)
@@ -617,6 +709,7 @@ def puzzle(request, id):  # noqa: C901
                 )
                 if status_change:
                     puzzle.status = status_change
+                    puzzle.changed_by = user
                     puzzle.save()
         elif "react_comment" in request.POST:
             emoji = request.POST.get("emoji")
@@ -628,18 +721,20 @@ def puzzle(request, id):  # noqa: C901
         # refresh
         return redirect(urls.reverse("puzzle", args=[id]))
 
-    if is_spoiled_on(user, puzzle):
+    access = PuzzleAccess.for_request(request, puzzle)
+    if access.is_spoiled:
         comments = PuzzleComment.objects.filter(puzzle=puzzle)
-        unread_puzzles = user.spoiled_puzzles.annotate(
-            last_comment_date=Max("comments__date"),
-            last_visited_date=Subquery(
-                PuzzleVisited.objects.filter(puzzle=OuterRef("pk"), user=user).values(
-                    "date"
-                )
-            ),
-        ).filter(
-            Q(last_visited_date__isnull=True)
-            | Q(last_comment_date__gt=F("last_visited_date"))
+        # Lists and the index read what's unread from UnreadPuzzle, so a
+        # visit that changes it can't wait in the buffer with the rest.
+        if UnreadPuzzle.objects.filter(user=user, puzzle=puzzle).exists():
+            request.puzzle_was_unread = True
+        # this visit isn't written yet, so leave this puzzle out explicitly
+        next_unread_puzzle_id = (
+            UnreadPuzzle.objects.filter(user=user)
+            .exclude(puzzle=puzzle)
+            .order_by("puzzle_id")
+            .values_list("puzzle_id", flat=True)
+            .first()
         )
 
         # TODO: participants is still hitting the database once per session;
@@ -672,18 +767,16 @@ def puzzle(request, id):  # noqa: C901
                 "comment_form": PuzzleCommentForm(),
                 "testsolve_sessions": testsolve_sessions,
                 "all_statuses": status.ALL_STATUSES,
-                "is_author": is_author_on(user, puzzle),
-                "is_editor": is_editor_on(user, puzzle),
-                "is_factchecker": is_factchecker_on(user, puzzle),
-                "is_postprodder": is_postprodder_on(user, puzzle),
+                "is_author": access.is_author,
+                "is_editor": access.is_editing,
+                "is_factchecker": access.is_factchecking,
+                "is_postprodder": access.is_postprodding,
                 "content_form": PuzzleContentForm(instance=puzzle),
                 "solution_form": PuzzleSolutionForm(instance=puzzle),
                 "priority_form": PuzzlePriorityForm(instance=puzzle),
                 "hint_form": PuzzleHintForm(initial={"puzzle": puzzle}),
                 "enable_keyboard_shortcuts": user.enable_keyboard_shortcuts,
-                "next_unread_puzzle_id": unread_puzzles[0].id
-                if unread_puzzles.count()
-                else None,
+                "next_unread_puzzle_id": next_unread_puzzle_id,
                 "disable_postprod": SiteSetting.get_setting("DISABLE_POSTPROD"),
                 "sheets_enabled": settings.TESTSOLVE_SHEETS_CONFIG["enabled"],
             },
@@ -692,9 +785,313 @@ def puzzle(request, id):  # noqa: C901
         return render(
             request,
             "puzzle_unspoiled.html",
-            {"puzzle": puzzle, "role": get_user_role(user, puzzle)},
+            {"puzzle": puzzle, "role": access.role},
+        )
+
+
+def comment_page_response(request, puzzle, comments, show_testsolve_session_links):
+    """The comments before ?before= in a thread, as rows to splice into the
+    thread's comment_list, along with the URL of the page before them."""
+
+    page, older = load_comment_page(
+        request.user, puzzle, comments, before=request.GET.get("before")
+    )
+    html = render_to_string(
+        "tags/comment_rows.html",
+        {
+            "username": request.user.username,
+            "comments": page,
+            "show_testsolve_session_links": show_testsolve_session_links,
+            "emoji_options": CommentReaction.EMOJI_OPTIONS,
+        },
+        request=request,
+    )
+    older_url = None
+    if older:
+        older_url = "{}?before={}".format(request.path, older)
+    return JsonResponse({"success": True, "html": html, "older": older_url})
+
+
+@query_budget(7)
+@login_required
+def puzzle_comments(request, id):
+    puzzle = get_object_or_404(Puzzle, id=id)
+    if not PuzzleAccess.for_request(request, puzzle).is_spoiled:
+        return JsonResponse(
+            {"success": False, "error": "Not spoiled on this puzzle"}, status=403
+        )
+    return comment_page_response(
+        request, puzzle, PuzzleComment.objects.filter(puzzle=puzzle), True
+    )
+
+
+# bulk actions that add a user to one of these fields of each puzzle, and
+# what to call the user in the comment saying so
+BULK_PEOPLE_ACTIONS = {
+    "add_author": ("authors", "author"),
+    "add_editor": ("editors", "editor"),
+    "add_factchecker": ("factcheckers", "factchecker"),
+    "add_postprodder": ("postprodders", "postprodder"),
+    "add_spoiled": ("spoiled", "spoiled user"),
+}
+
+
+def safe_next_url(url, host):
+    """`url` if it's safe to send the user to after a form, or else the list
+    of all puzzles. Rules out other sites and javascript: URLs."""
+
+    if url and url_has_allowed_host_and_scheme(url, allowed_hosts={host}):
+        return url
+    return urls.reverse("all")
+
+
+class BulkPuzzleForm(forms.Form):
+    puzzles = forms.ModelMultipleChoiceField(
+        queryset=Puzzle.objects.all(), widget=forms.MultipleHiddenInput
+    )
+    action = forms.ChoiceField(
+        choices=[
+            ("status", "Change status"),
+            ("priority", "Change priority"),
+            ("add_tag", "Add tag"),
+            ("remove_tag", "Remove tag"),
+        ]
+        + [(action, "Add " + role) for action, (_, role) in BULK_PEOPLE_ACTIONS.items()]
+    )
+    status = forms.ChoiceField(
+        choices=[("", "---------")] + list(status.DESCRIPTIONS.items()),
+        required=False,
+    )
+    priority = forms.TypedChoiceField(
+        choices=[("", "---------")] + list(Puzzle._meta.get_field("priority").choices),
+        coerce=int,
+        empty_value=None,
+        required=False,
+    )
+    tag = forms.ModelChoiceField(queryset=PuzzleTag.objects.all(), required=False)
+    user = forms.ModelChoiceField(queryset=User.objects.all(), required=False)
+    next = forms.CharField(widget=forms.HiddenInput, required=False)
+
+    def __init__(self, *args, host, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.host = host
+
+    def clean_next(self):
+        return safe_next_url(self.cleaned_data["next"], self.host)
+
+    def clean(self):
+        """Put the value the chosen action needs in cleaned_data["value"]."""
+
+        cleaned_data = super().clean()
+        action = cleaned_data.get("action")
+        needed = {
+            "status": "status",
+            "priority": "priority",
+            "add_tag": "tag",
+            "remove_tag": "tag",
+        }.get(action, "user")
+        cleaned_data["value"] = cleaned_data.get(needed)
+        if action and cleaned_data["value"] in (None, ""):
+            self.add_error(needed, "Choose one to {}.".format(action.replace("_", " ")))
+        return cleaned_data
+
+
+@transaction.atomic
+def apply_bulk_action(request, puzzles, action, value):
+    """Make one change to many puzzles, leaving a system comment on each one
+    it changed, and email everyone involved once about all of them.
+
+    Takes a constant number of queries however many puzzles there are.
+    Returns the puzzles that changed."""
+
+    user = request.user
+    comments = []
+    subscribers = []
+    if action == "status":
+        changed = [puzzle for puzzle in puzzles if puzzle.status != value]
+        for puzzle in changed:
+            puzzle.status = value
+            puzzle.changed_by = user
+        # the list rows are refreshed below, once the comments exist
+        Puzzle.objects.bulk_update(changed, ["status"], refresh_list_rows=False)
+        description = "Status changed to " + status.get_display(value)
+        comments = [
+            PuzzleComment(puzzle=puzzle, content="", status_change=value)
+            for puzzle in changed
+        ]
+        if value != status.TESTSOLVING:
+            sessions = TestsolveSession.objects.filter(
+                puzzle__in=changed, joinable=True
+            )
+            comments.extend(
+                PuzzleComment(
+                    puzzle_id=session.puzzle_id,
+                    testsolve_session=session,
+                    content="Puzzle status changed, automatically marking session as no longer joinable",
+                )
+                for session in sessions
+            )
+            sessions.update(joinable=False)
+        subscribers = StatusSubscription.objects.filter(status=value).values_list(
+            "user__email", flat=True
+        )
+    elif action == "priority":
+        changed = [puzzle for puzzle in puzzles if puzzle.priority != value]
+        for puzzle in changed:
+            puzzle.priority = value
+        Puzzle.objects.bulk_update(changed, ["priority"], refresh_list_rows=False)
+        description = "Priority changed to " + dict(
+            Puzzle._meta.get_field("priority").choices
+        ).get(value, str(value))
+    else:
+        if action in ("add_tag", "remove_tag"):
+            through = Puzzle.tags.through
+            link = {"puzzletag": value}
+            role = "tag"
+        else:
+            field, role = BULK_PEOPLE_ACTIONS[action]
+            through = getattr(Puzzle, field).through
+            link = {"user": value}
+        already = set(
+            through.objects.filter(puzzle__in=puzzles, **link).values_list(
+                "puzzle_id", flat=True
+            )
+        )
+        if action == "remove_tag":
+            changed = [puzzle for puzzle in puzzles if puzzle.id in already]
+            through.objects.filter(puzzle__in=changed, **link).delete()
+            description = "Removed tag " + value.name
+        else:
+            changed = [puzzle for puzzle in puzzles if puzzle.id not in already]
+            through.objects.bulk_create(
+                [through(puzzle=puzzle, **link) for puzzle in changed],
+                ignore_conflicts=True,
+            )
+            description = "Added {} {}".format(
+                role, value.name if role == "tag" else value
+            )
+        if action == "add_spoiled":
+            refresh_unread_puzzles([puzzle.id for puzzle in changed], [value.id])
+
+    if not changed:
+        return changed
+    if action != "status":
+        comments = [
+            PuzzleComment(puzzle=puzzle, content=description) for puzzle in changed
+        ]
+
+    # bulk_create skips save() and the signals that would do all this
+    for comment in comments:
+        comment.author = user
+        comment.is_system = True
+        comment.render_markdown_fields()
+    comments = PuzzleComment.objects.bulk_create(comments)
+    changed_ids = [puzzle.id for puzzle in changed]
+    refresh_puzzle_list_rows(changed_ids)
+    refresh_unread_puzzles(
+        changed_ids,
+        Puzzle.spoiled.through.objects.filter(puzzle_id__in=changed_ids)
+        .exclude(user=user)
+        .values_list("user_id", flat=True),
+    )
+
+    # what add_comment would have emailed each person, gathered up
+    puzzle_ids_by_email = collections.defaultdict(set)
+    for field in ("authors", "editors", "factcheckers", "postprodders"):
+        for puzzle_id, email in (
+            getattr(Puzzle, field)
+            .through.objects.filter(puzzle_id__in=changed_ids)
+            .values_list("puzzle_id", "user__email")
+        ):
+            puzzle_ids_by_email[email].add(puzzle_id)
+    session_ids = [c.testsolve_session_id for c in comments if c.testsolve_session_id]
+    for puzzle_id, email in TestsolveParticipation.objects.filter(
+        session_id__in=session_ids
+    ).values_list("session__puzzle_id", "user__email"):
+        puzzle_ids_by_email[email].add(puzzle_id)
+    for email in subscribers:
+        puzzle_ids_by_email[email].update(changed_ids)
+    puzzle_ids_by_email.pop(user.email, None)
+    puzzle_ids_by_email.pop("", None)
+
+    puzzle_ids_by_email = messaging.hold_many_for_digests(
+        comments,
+        puzzle_ids_by_email,
+        "{}://{}".format(request.scheme, request.get_host()),
+    )
+    messaging.send_grouped_mail(
+        "{} on {} puzzles".format(description, len(changed)),
+        "bulk_change_email",
+        {"request": request, "user": user, "description": description},
+        changed,
+        puzzle_ids_by_email,
+    )
+    return changed
+
+
+@query_budget(2)
+@login_required
+def bulk_puzzles(request):
+    """Make one change to many puzzles at once. The puzzles to change are
+    chosen with checkboxes on puzzle lists, which GET this page."""
+
+    user = request.user
+    if request.method == "POST":
+        form = BulkPuzzleForm(request.POST, host=request.get_host())
+        if form.is_valid():
+            puzzles = list(form.cleaned_data["puzzles"])
+            unspoiled = {puzzle.id for puzzle in puzzles} - set(
+                user.spoiled_puzzles.filter(
+                    id__in=[puzzle.id for puzzle in puzzles]
+                ).values_list("id", flat=True)
+            )
+            if unspoiled:
+                form.add_error(
+                    "puzzles",
+                    "You aren't spoiled on puzzles {}".format(
+                        ", ".join(map(str, sorted(unspoiled)))
+                    ),
+                )
+            else:
+                changed = apply_bulk_action(
+                    request,
+                    puzzles,
+                    form.cleaned_data["action"],
+                    form.cleaned_data["value"],
+                )
+                return render(
+                    request,
+                    "bulk_puzzles.html",
+                    {
+                        "changed": changed,
+                        "unchanged": len(puzzles) - len(changed),
+                        "next": form.cleaned_data["next"],
+                    },
+                )
+    else:
+        form = BulkPuzzleForm(
+            initial={
+                "puzzles": request.GET.getlist("puzzles"),
+                "next": safe_next_url(request.GET.get("next"), request.get_host()),
+            },
+            host=request.get_host(),
         )
 
+    return render(
+        request,
+        "bulk_puzzles.html",
+        {
+            "form": form,
+            "puzzles": Puzzle.objects.filter(
+                id__in=[
+                    puzzle_id
+                    for puzzle_id in form["puzzles"].value() or []
+                    if str(puzzle_id).isdigit()
+                ]
+            ),
+        },
+    )
+
 
 # https://stackoverflow.com/a/55129913/3243497
 class AnswerCheckboxSelectMultiple(forms.CheckboxSelectMultiple):
@@ -748,11 +1145,12 @@ class PuzzleAnswersForm(forms.ModelForm):
         }
 
 
+@query_budget(9)
 @login_required
 def puzzle_answers(request, id):
     puzzle = get_object_or_404(Puzzle, id=id)
     user = request.user
-    spoiled = is_spoiled_on(user, puzzle)
+    spoiled = PuzzleAccess.for_request(request, puzzle).is_spoiled
 
     if request.method == "POST":
         form = PuzzleAnswersForm(user, request.POST, instance=puzzle)
@@ -823,11 +1221,12 @@ class PuzzleTaggingForm(forms.ModelForm):
         }
 
 
+@query_budget(12)
 @login_required
 def puzzle_tags(request, id):
     puzzle = get_object_or_404(Puzzle, id=id)
     user = request.user
-    spoiled = is_spoiled_on(user, puzzle)
+    spoiled = PuzzleAccess.for_request(request, puzzle).is_spoiled
 
     if request.method == "POST":
         form = PuzzleTaggingForm(request.POST, instance=puzzle)
@@ -860,11 +1259,12 @@ def puzzle_tags(request, id):
     )
 
 
+@query_budget(7)
 @login_required
 def puzzle_postprod(request, id):
     puzzle = get_object_or_404(Puzzle, id=id)
     user = request.user
-    spoiled = is_spoiled_on(user, puzzle)
+    spoiled = PuzzleAccess.for_request(request, puzzle).is_spoiled
 
     if request.method == "POST":
         instance = puzzle.postprod if puzzle.has_postprod() else None
@@ -913,6 +1313,7 @@ def puzzle_postprod(request, id):
     )
 
 
+@query_budget(3)
 @login_required
 def postprod_zip(request, id):
     pp = get_object_or_404(PuzzlePostprod, puzzle__id=id)
@@ -946,6 +1347,7 @@ class PuzzlePeopleForm(forms.ModelForm):
         ]
 
 
+@query_budget(6)
 @login_required
 def puzzle_edit(request, id):
     puzzle = get_object_or_404(Puzzle, id=id)
@@ -972,7 +1374,11 @@ def puzzle_edit(request, id):
     return render(
         request,
         "puzzle_edit.html",
-        {"puzzle": puzzle, "form": form, "spoiled": is_spoiled_on(user, puzzle)},
+        {
+            "puzzle": puzzle,
+            "form": form,
+            "spoiled": PuzzleAccess.for_request(request, puzzle).is_spoiled,
+        },
     )
 
 
@@ -1009,6 +1415,7 @@ def get_changed_data_message(form):
     return "<br/>".join(lines)
 
 
+@query_budget(13)
 @login_required
 def puzzle_people(request, id):
     puzzle = get_object_or_404(Puzzle, id=id)
@@ -1043,6 +1450,7 @@ def puzzle_people(request, id):
     return render(request, "puzzle_people.html", context)
 
 
+@query_budget(4)
 @login_required
 def puzzle_escape(request, id):
     puzzle = get_object_or_404(Puzzle, id=id)
@@ -1083,13 +1491,14 @@ def puzzle_escape(request, id):
         "puzzle_escape.html",
         {
             "puzzle": puzzle,
-            "spoiled": is_spoiled_on(user, puzzle),
+            "spoiled": PuzzleAccess.for_request(request, puzzle).is_spoiled,
             "status": status.get_display(puzzle.status),
             "is_in_testsolving": puzzle.status == status.TESTSOLVING,
         },
     )
 
 
+@query_budget(5)
 @login_required
 def edit_comment(request, id):
     comment = get_object_or_404(PuzzleComment, id=id)
@@ -1135,6 +1544,7 @@ def edit_comment(request, id):
     )
 
 
+@query_budget(4)
 @login_required
 def edit_hint(request, id):
     hint = get_object_or_404(Hint, id=id)
@@ -1181,6 +1591,7 @@ def warn_about_testsolving(is_spoiled, in_session, has_session):
         return None
 
 
+@query_budget(12)
 @login_required
 def testsolve_main(request):
     user = request.user
@@ -1211,20 +1622,17 @@ def testsolve_main(request):
     past_sessions = sessions.filter(joined=True, current=False)
     joinable_sessions = sessions.filter(joined=False, joinable=True)
 
-    testsolvable_puzzles = (
+    testsolvable_puzzles = list(
         Puzzle.objects.filter(status=status.TESTSOLVING)
         .annotate(
-            is_author=Exists(
-                User.objects.filter(authored_puzzles=OuterRef("pk"), id=user.id)
-            ),
-            is_spoiled=Exists(
-                User.objects.filter(spoiled_puzzles=OuterRef("pk"), id=user.id)
-            ),
             in_session=Exists(current_sessions.filter(puzzle=OuterRef("pk"))),
             has_session=Exists(joinable_sessions.filter(puzzle=OuterRef("pk"))),
         )
         .order_by("priority")
     )
+    masks = get_role_bitmasks(user, [puzzle.id for puzzle in testsolvable_puzzles])
+    for puzzle in testsolvable_puzzles:
+        set_role_attributes(puzzle, masks.get(puzzle.id, 0))
 
     testsolvable = [
         {
@@ -1246,6 +1654,7 @@ def testsolve_main(request):
     return render(request, "testsolve_main.html", context)
 
 
+@query_budget(2)
 @login_required
 def testsolve_finder(request):
     usernames_arg = request.GET.get("usernames")
@@ -1318,6 +1727,7 @@ class ShareFolderForm(forms.Form):
     gmail_address = forms.CharField()
 
 
+@query_budget(23)
 @login_required
 def testsolve_one(request, id):
     session = get_object_or_404(TestsolveSession, id=id)
@@ -1471,15 +1881,34 @@ def testsolve_one(request, id):
     return render(request, "testsolve_one.html", context)
 
 
+@query_budget(7)
 @login_required
-def spoiled(request):
-    puzzles = Puzzle.objects.filter(
-        status__in=[status.TESTSOLVING, status.REVISING]
-    ).annotate(
-        is_spoiled=Exists(
-            User.objects.filter(spoiled_puzzles=OuterRef("pk"), id=request.user.id)
+def testsolve_comments(request, id):
+    session = get_object_or_404(
+        TestsolveSession.objects.select_related("puzzle"), id=id
+    )
+    puzzle = session.puzzle
+    if not (
+        is_spoiled_on(request.user, puzzle)
+        or session.participations.filter(user=request.user).exists()
+    ):
+        return JsonResponse(
+            {"success": False, "error": "Not in this testsolve session"}, status=403
         )
+    return comment_page_response(
+        request, puzzle, session.comments.filter(puzzle=puzzle), False
+    )
+
+
+@query_budget(18)
+@login_required
+def spoiled(request):
+    puzzles = list(
+        Puzzle.objects.filter(status__in=[status.TESTSOLVING, status.REVISING])
     )
+    masks = get_role_bitmasks(request.user, [puzzle.id for puzzle in puzzles])
+    for puzzle in puzzles:
+        set_role_attributes(puzzle, masks.get(puzzle.id, 0))
     context = {"puzzles": puzzles}
     return render(request, "spoiled.html", context)
 
@@ -1550,6 +1979,7 @@ class PuzzleFinishForm(forms.Form):
     comment = forms.CharField(widget=MarkdownTextarea, required=False)
 
 
+@query_budget(5)
 @login_required
 def testsolve_finish(request, id):
     session = get_object_or_404(TestsolveSession, id=id)
@@ -1649,6 +2079,7 @@ def testsolve_finish(request, id):
     return render(request, "testsolve_finish.html", context)
 
 
+@query_budget(5)
 @login_required
 def testsolve_all(request):
     return render(
@@ -1658,6 +2089,7 @@ def testsolve_all(request):
     )
 
 
+@query_budget(4)
 @login_required
 def postprod(request):
     postprodding = Puzzle.objects.filter(
@@ -1675,6 +2107,7 @@ def postprod(request):
     return render(request, "postprod.html", context)
 
 
+@query_budget(9)
 @login_required
 def factcheck(request):
     factchecking = Puzzle.objects.filter(
@@ -1700,6 +2133,7 @@ def factcheck(request):
     return render(request, "factcheck.html", context)
 
 
+@query_budget(3)
 @login_required
 def awaiting_editor(request):
     return render(
@@ -1709,6 +2143,7 @@ def awaiting_editor(request):
     )
 
 
+@query_budget(4)
 @login_required
 def needs_editor(request):
     needs_editors = Puzzle.objects.annotate(
@@ -1742,6 +2177,7 @@ class RoundForm(forms.ModelForm):
         fields = ["name", "description"]
 
 
+@query_budget(11)
 @login_required
 @permission_required("puzzle_editing.change_round")
 def rounds(request):
@@ -1798,6 +2234,7 @@ def rounds(request):
     )
 
 
+@query_budget(4)
 @login_required
 @permission_required("puzzle_editing.change_round")
 def edit_round(request, id):
@@ -1825,6 +2262,7 @@ def edit_round(request, id):
     )
 
 
+@query_budget(6)
 @login_required
 @permission_required("puzzle_editing.change_round")
 def edit_answer(request, id):
@@ -1842,6 +2280,7 @@ def edit_answer(request, id):
     return render(request, "edit_answer.html", {"answer": answer, "form": answer_form})
 
 
+@query_budget(4)
 @login_required
 @permission_required("puzzle_editing.change_round")
 def bulk_add_answers(request, id):
@@ -1865,6 +2304,7 @@ def bulk_add_answers(request, id):
     )
 
 
+@query_budget(3)
 @login_required
 def tags(request):
     return render(
@@ -1874,6 +2314,7 @@ def tags(request):
     )
 
 
+@query_budget(8)
 @login_required
 def statistics(request):
     past_writing = 0
@@ -1886,18 +2327,36 @@ def statistics(request):
         .annotate(count=Count("status"))
     )
     rest = dict((p["status"], p["count"]) for p in all_counts)
-    tags = PuzzleTag.objects.filter(important=True)
-    tag_counts = {}
-    for tag in tags:
-        query = (
-            Puzzle.objects.filter(tags=tag)
-            .values("status")
-            .order_by("status")
-            .annotate(count=Count("status"))
+    tags = list(PuzzleTag.objects.filter(important=True))
+    tag_names = {tag.id: tag.name for tag in tags}
+    tag_counts = {tag.name: {} for tag in tags}
+    # Answers assigned to puzzles count once per puzzle, and under each of
+    # the puzzle's important tags.
+    answers = PuzzleAnswer.objects.aggregate(
+        assigned=Count("puzzles"),
+        waiting=Count("id", filter=Q(puzzles__isnull=True)),
+    )
+    answers["rest"] = answers["assigned"]
+    answers.update((tag.name, 0) for tag in tags)
+    # one row per important tag and status with any puzzles, so this doesn't
+    # take more queries as there are more tags
+    matrix = (
+        Puzzle.tags.through.objects.filter(puzzletag__important=True)
+        .values("puzzletag_id", "puzzle__status")
+        .order_by()
+        .annotate(
+            puzzles=Count("puzzle_id", distinct=True),
+            assigned=Count("puzzle__answers"),
         )
-        tag_counts[tag.name] = dict((p["status"], p["count"]) for p in query)
-        for p in query:
-            rest[p["status"]] -= p["count"]
+    )
+    for p in matrix:
+        name = tag_names.get(p["puzzletag_id"])
+        if name is None:  # marked important since we listed the tags
+            continue
+        tag_counts[name][p["puzzle__status"]] = p["puzzles"]
+        rest[p["puzzle__status"]] -= p["puzzles"]
+        answers[name] += p["assigned"]
+        answers["rest"] -= p["assigned"]
     statuses = []
     for p in sorted(all_counts, key=lambda x: status.get_status_rank(x["status"])):
         status_obj = {
@@ -1919,22 +2378,9 @@ def statistics(request):
                 if status.past_testsolving(p["status"]):
                     past_testsolving -= status_obj[tag.name]
         statuses.append(status_obj)
-    answers = {
-        "assigned": PuzzleAnswer.objects.filter(puzzles__isnull=False).count(),
-        "rest": PuzzleAnswer.objects.filter(puzzles__isnull=False).count(),
-        "waiting": PuzzleAnswer.objects.filter(puzzles__isnull=True).count(),
-    }
-    for tag in tags:
-        answers[tag.name] = PuzzleAnswer.objects.filter(
-            puzzles__isnull=False, puzzles__tags=tag
-        ).count()
-        answers["rest"] -= answers[tag.name]
 
     target_count = SiteSetting.get_int_setting("TARGET_PUZZLE_COUNT")
     unreleased_count = SiteSetting.get_int_setting("UNRELEASED_PUZZLE_COUNT")
-    image_base64 = curr_puzzle_graph_b64(
-        request.GET.get("time", "alltime"), target_count
-    )
 
     return render(
         request,
@@ -1943,7 +2389,7 @@ def statistics(request):
             "status": statuses,
             "tags": tags,
             "answers": answers,
-            "image_base64": image_base64,
+            "time": request.GET.get("time", "alltime"),
             "past_writing": past_writing,
             "past_testsolving": past_testsolving,
             "target_count": target_count,
@@ -1952,6 +2398,46 @@ def statistics(request):
     )
 
 
+@query_budget(5)
+@login_required
+def statistics_chart(request):
+    """The chart of puzzle statuses over time on the statistics page, as a
+    PNG. Browsers revalidate it with its ETag, which changes along with the
+    status changes it shows. If it takes too long to draw, this responds 503
+    and the chart is cached for the retry."""
+
+    time = request.GET.get("time", "alltime")
+    target_count = SiteSetting.get_int_setting("TARGET_PUZZLE_COUNT")
+    etag = puzzle_graph_etag(time, target_count)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        try:
+            png = cached_puzzle_graph(time, target_count, etag)
+        except RendererBusy:
+            response = HttpResponse(
+                "The chart is still being drawn; try again in a few seconds.",
+                content_type="text/plain",
+                status=503,
+            )
+            response["Retry-After"] = "5"
+            return response
+        response = HttpResponse(png, content_type="image/png")
+        response["ETag"] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+@query_budget(4)
+@login_required
+def statistics_data(request):
+    """The numbers behind the chart on the statistics page, which the browser
+    draws itself; see graph.status_series."""
+
+    data = status_series(request.GET.get("time", "alltime"))
+    data["target"] = SiteSetting.get_int_setting("TARGET_PUZZLE_COUNT")
+    return JsonResponse(data)
+
+
 class PuzzleTagForm(forms.ModelForm):
     description = forms.CharField(
         widget=MarkdownTextarea,
@@ -1964,6 +2450,7 @@ class PuzzleTagForm(forms.ModelForm):
         fields = ["name", "description", "important"]
 
 
+@query_budget(2)
 @login_required
 def new_tag(request):
     if request.method == "POST":
@@ -1977,6 +2464,7 @@ def new_tag(request):
     return render(request, "new_tag.html", {"form": PuzzleTagForm()})
 
 
+@query_budget(6)
 @login_required
 def single_tag(request, id):
     tag = get_object_or_404(PuzzleTag, id=id)
@@ -1996,6 +2484,7 @@ def single_tag(request, id):
     )
 
 
+@query_budget(3)
 @login_required
 def edit_tag(request, id):
     tag = get_object_or_404(PuzzleTag, id=id)
@@ -2034,6 +2523,7 @@ def annotate_users_helper(user_list, annotation_kwargs):
             setattr(user, k, getattr(my_user, k))
 
 
+@query_budget(25)
 @login_required
 def users(request):
     users = list(User.objects.all())
@@ -2097,6 +2587,7 @@ def users(request):
     )
 
 
+@query_budget(21)
 @login_required
 def editors(request):
     users = User.objects.all().annotate(
@@ -2148,6 +2639,7 @@ def editors(request):
     )
 
 
+@query_budget(21)
 @login_required
 def users_statuses(request):
     # distinct=True because https://stackoverflow.com/questions/59071464/django-how-to-annotate-manytomany-field-with-count
@@ -2176,6 +2668,7 @@ def users_statuses(request):
     )
 
 
+@query_budget(12)
 @login_required
 def user(request, username: str):
     them = get_object_or_404(User, username=username)
@@ -2191,6 +2684,7 @@ def user(request, username: str):
     )
 
 
+@query_budget(0)
 @csrf_exempt
 def preview_markdown(request):
     if request.method == "POST":
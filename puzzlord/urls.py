@@ -17,7 +17,14 @@ from django.contrib import admin
 from django.urls import include
 from django.urls import path
 
+from puzzle_editing.admin import slow_requests
+
 urlpatterns = [
+    path(
+        "admin/slow_requests/",
+        admin.site.admin_view(slow_requests),
+        name="admin_slow_requests",
+    ),
     path("admin/", admin.site.urls),
     path("", include("puzzle_editing.urls")),
 ]
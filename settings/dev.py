@@ -81,8 +81,9 @@ LOGGING = {
             "level": "DEBUG",
             "propagate": False,
         },
+        # one line per request is too much for the console (and test output)
         "puzzles.request": {
-            "handlers": ["request", "puzzles-console"],
+            "handlers": ["request"],
             "level": "DEBUG",
             "propagate": False,
         },